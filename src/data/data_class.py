@@ -1,9 +1,87 @@
+import os
+import numpy as np
 import pandas as pd
+import src.utils.cache_utils as cache_utils
+
+# Storage formats supported for the clean data, parquet keeps the dtypes and allows to load only some columns
+STORAGE_FORMATS = {'parquet': '.parquet', 'csv': '.csv'}
+
+
+def write_frame(df, path):
+    """
+    Write a dataframe to the given path, the format is chosen from the extension (.parquet or .csv)
+    :param df: DataFrame to write
+    :param path: str : path of the file
+    """
+    if path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False, encoding='utf-8')
+
+
+def read_frame(path, columns=None):
+    """
+    Read a dataframe written by write_frame. If a parquet file is asked but was never written, we fall back on
+    the csv file with the same name (data written before we switched to parquet)
+    :param path: str : path of the file
+    :param columns: list : only load these columns (optional)
+    :return: DataFrame
+    """
+    if path.endswith('.parquet'):
+        if os.path.exists(path) or not os.path.exists(path[:-len('.parquet')] + '.csv'):
+            return pd.read_parquet(path, columns=columns)
+        path = path[:-len('.parquet')] + '.csv'
+        print(f"{path} : no parquet file found, reading the csv file instead")
+
+    return pd.read_csv(path, usecols=columns, low_memory=False, encoding='utf-8')
+
+def is_text_column(column):
+    """
+    Check if a column holds strings: object dtype, or categorical (dictionary encoded) with string categories
+    :param column: Series
+    :return: bool
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # a column with only missing values has no categories
+        return column.cat.categories.dtype == object or len(column.cat.categories) == 0
+    return column.dtype == object
+
+
+def apply_schema(df, schema, name='data'):
+    """
+    Convert the columns of a dataframe to the dtypes of a schema (the columns not in the schema or not in df are kept)
+    :param df: DataFrame to convert
+    :param schema: dict : {column: dtype}, e.g. 'category' for the repeated strings, 'int16' for the years
+    :param name: str : name of the data, for the errors
+    :return: DataFrame : the converted dataframe (df itself if nothing has to be converted)
+    """
+    conversions = {}
+    for column, dtype in schema.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        # the integers must fit in the smaller type (no silent overflow)
+        if pd.api.types.is_integer_dtype(dtype) and len(df) > 0:
+            info = np.iinfo(dtype)
+            values = df[column]
+            if values.isna().any() or values.min() < info.min or values.max() > info.max:
+                raise ValueError(f"{name} : the values of {column} do not fit in {dtype}")
+        conversions[column] = dtype
+
+    return df.astype(conversions) if conversions else df
+
 
 # Class for all the data cleaners, it defines the structure we expect of the data and the methods to clean it
 class DataClass():
 
-    def __init__(self, name, file_name, credits, separator, loaded, columns, raw_path, clean_path, output_name=None):
+    # Compact dtypes of the clean data {column: dtype} (categorical strings, small integers), applied after the cleaning
+    # and the loading of the clean data. The columns that are not listed keep their dtype
+    schema = {}
+
+    # Modules of the helpers called by the cleaning code (e.g. 'src.utils.general_utils'), their code is hashed with the
+    # code of the class in the fingerprint: a change in a helper invalidates the clean data as well
+    code_dependencies = []
+
+    def __init__(self, name, file_name, credits, separator, loaded, columns, raw_path, clean_path, output_name=None, storage_format='parquet', chunksize=None):
 
         # name used to refer to the dataset when errors are raised
         self.name = name
@@ -11,8 +89,8 @@ class DataClass():
         self.file_name = file_name
         # output name of the cleaned data
         self.output_name = output_name
-        # create empty dataframes
-        self.raw_df = pd.DataFrame()
+        # create empty dataframes (the raw data is read from the file the first time it is used, see raw_df)
+        self._raw_df = pd.DataFrame()
         self.clean_df = pd.DataFrame()
         # We can add a credits attribute to give credit to the source of the data
         self.credits = credits
@@ -23,13 +101,35 @@ class DataClass():
         # Paths to the raw and clean data
         self.raw_path = raw_path
         self.clean_path = clean_path
+
+        # Format used to store the clean data (see STORAGE_FORMATS)
+        if storage_format not in STORAGE_FORMATS:
+            raise ValueError(f"{name} : unknown storage format {storage_format}, expected one of {list(STORAGE_FORMATS)}")
+        self.storage_format = storage_format
+
+        # If chunksize is given, the raw file is streamed by chunks of chunksize rows instead of being loaded at once
+        self.chunksize = chunksize
+
+        # dtypes of the clean data before apply_schema (see memory_report)
+        self.dtypes_before = None
         
         if(loaded): # If loaded is true, there is a file corresponding to the data in the raw directory
             self.loaded = True
-            self.fetch_raw_data()
+            self._raw_df = None # not read yet, it might not be needed if the clean data is up to date
         else: # was created from in memory content, no file corresponding in the raw directory
             self.loaded = False
         
+    # The raw data is read from the file the first time it is used
+    @property
+    def raw_df(self):
+        if self._raw_df is None:
+            self.fetch_raw_data()
+        return self._raw_df
+
+    @raw_df.setter
+    def raw_df(self, df):
+        self._raw_df = df
+
     # Function called when 'len' is called on the object
     def __len__(self):
         return self.clean_df.shape[0] 
@@ -48,36 +148,90 @@ class DataClass():
         self.raw_df = pd.read_csv(f'{self.raw_path}{self.file_name}', delimiter=self.separator)
         print(f"{self.name} : loaded {self.raw_df.shape[0]} rows !")
 
-    # Writes the cleaned data to a csv file
-    def write_clean_data(self):
-        
-        self.check_clean_data()
+    # Reads the raw data by chunks of self.chunksize rows, yields the chunks one by one (nothing is stored in raw_df)
+    def fetch_raw_chunks(self):
+
+        if not self.loaded:
+            print(f"{self.name} : This object does not come from a local file, cannot be loaded")
+            return
+
+        rows = 0
+        with pd.read_csv(f'{self.raw_path}{self.file_name}', delimiter=self.separator, chunksize=self.chunksize) as reader:
+            for chunk in reader:
+                rows += chunk.shape[0]
+                yield chunk
+        print(f"{self.name} : streamed {rows} rows !")
+
+    # Name of the clean file in the clean folder, with the extension of the storage format
+    def clean_file_name(self):
 
         # takes the file name if no output_name is given
         if self.output_name is None:
             self.output_name = self.file_name
 
         clean_name = self.output_name
-         # hierarchy of the file is not repercuted in the clean folder
+        # hierarchy of the file is not repercuted in the clean folder
         if("/" in clean_name):
-            split = clean_name.split("/")
-            clean_name = split[-1]
-            print(f"{self.name} : File name has been changed to {clean_name} (we don't want directories in the clean folder)")
+            clean_name = clean_name.split("/")[-1]
+
+        # the extension follows the storage format (file_name is the raw file, often a .csv or .tsv)
+        return os.path.splitext(clean_name)[0] + STORAGE_FORMATS[self.storage_format]
+
+    # Writes the cleaned data to the clean folder
+    def write_clean_data(self):
         
-        self.clean_df.to_csv(f'{self.clean_path}{clean_name}', index=False, encoding='utf-8')
+        self.check_clean_data()
+
+        clean_name = self.clean_file_name()
+        if os.path.splitext(clean_name)[0] != os.path.splitext(self.output_name)[0]:
+            print(f"{self.name} : File name has been changed to {clean_name} (we don't want directories in the clean folder)")
+
+        write_frame(self.clean_df, f'{self.clean_path}{clean_name}')
         print(f"{self.name} : Clean data has been and saved to {self.clean_path}{clean_name}! ({self.clean_df.shape[0]} rows)")
 
     # If the clean data is already saved, load it (will throw an error if the file is not found)
-    def load_clean_data(self):
-        if self.output_name is None:
-            self.output_name = self.file_name
-        print(f"{self.name} : Loading clean data from {self.clean_path}{self.output_name}")
+    # columns can be given to load only a part of the data (much faster with parquet)
+    def load_clean_data(self, columns=None):
+        clean_name = self.clean_file_name()
+        print(f"{self.name} : Loading clean data from {self.clean_path}{clean_name}")
 
-        # read the csv file and set the columns, but this is a big file!
-        self.clean_df = pd.read_csv(f'{self.clean_path}{self.output_name}', low_memory=False, encoding='utf-8')
+        self.clean_df = read_frame(f'{self.clean_path}{clean_name}', columns=columns)
 
-        # set the column with self.columns
-        self.clean_df.columns = self.columns
+        # set the column with self.columns (csv files written by older versions might have other headers)
+        # only when they describe the clean data: self.columns are the raw columns, some cleaners drop a few of them
+        if columns is None and self.columns is not None and len(self.columns) == self.clean_df.shape[1]:
+            self.clean_df.columns = self.columns
+
+        # csv files (and parquet files written by older versions) do not keep the dtypes of the schema
+        self.apply_schema()
+
+    # Convert the clean data to the dtypes of the schema, the previous dtypes are kept for memory_report
+    def apply_schema(self):
+        converted = apply_schema(self.clean_df, self.schema, self.name)
+        if converted is not self.clean_df:
+            self.dtypes_before = self.clean_df.dtypes
+        self.clean_df = converted
+        return self.clean_df
+
+    # Memory used by each column of the clean data (bytes) before and after apply_schema
+    # (if the schema was not applied yet, "after" is the memory the columns would use with the schema)
+    def memory_report(self):
+        before_df, after_df = self.clean_df, apply_schema(self.clean_df, self.schema, self.name)
+        if after_df is self.clean_df and self.dtypes_before is not None and self.dtypes_before.index.equals(self.clean_df.columns):
+            # the schema was already applied, the columns are converted back to measure the memory they used before
+            before_df = self.clean_df.astype(self.dtypes_before.to_dict())
+
+        report = pd.DataFrame({
+            'dtype_before': before_df.dtypes.astype(str),
+            'dtype_after': after_df.dtypes.astype(str),
+            'bytes_before': before_df.memory_usage(index=False, deep=True),
+            'bytes_after': after_df.memory_usage(index=False, deep=True),
+        })
+        report.loc['Total'] = ['', '', report['bytes_before'].sum(), report['bytes_after'].sum()]
+        total_before, total_after = report.loc['Total', 'bytes_before'], report.loc['Total', 'bytes_after']
+        print(f"{self.name} : {total_before / 2**20:.1f} MB -> {total_after / 2**20:.1f} MB with the schema "
+              f"({total_after / max(total_before, 1):.0%})")
+        return report
 
     # Checks if there are missing values in the raw data and that it conforms to the expected structure
     def check_clean_data(self):
@@ -87,11 +241,63 @@ class DataClass():
     def clean_raw_data(self):
         raise NotImplementedError
 
-    # Execute all the cleaning steps
-    def pipeline(self):
+    # Streaming mode, defined by the children classes that support it:
+    # clean_chunk cleans one chunk of the raw data on its own and returns it
+    def clean_chunk(self, chunk):
+        raise NotImplementedError(f"{self.name} : streaming is not supported by {type(self).__name__}")
+
+    # reduce_chunks receives the cleaned chunks (iterable) and sets clean_df (steps that need all the rows, e.g. group by sums)
+    def reduce_chunks(self, chunks):
+        raise NotImplementedError(f"{self.name} : streaming is not supported by {type(self).__name__}")
+
+    # Clean the raw data by chunks, the peak memory depends on the chunk size and on what reduce_chunks keeps (a running total
+    # of the counts, the cleaned rows), not on the size of the raw file
+    def stream_clean_data(self):
+        print(f"{self.name} : Cleaning the raw data by chunks of {self.chunksize} rows")
+        self.reduce_chunks(self.clean_chunk(chunk) for chunk in self.fetch_raw_chunks())
+        self.check_clean_data()
+
+    # Clean the raw data, by chunks if a chunksize was given (otherwise the raw data has to be fetched first)
+    # the clean data is then converted to the compact dtypes of the schema
+    def clean_data(self):
+        if self.chunksize is not None:
+            self.stream_clean_data()
+        else:
+            self.clean_raw_data()
+        self.apply_schema()
+
+    # Fingerprint of everything the clean data depends on: the raw file, the code of the cleaner and the parameters given
+    # (e.g. a filter applied after the cleaning)
+    def fingerprint(self, params=None):
+        raw_hash = None
+        if self.loaded:
+            raw_hash = cache_utils.hash_file(f'{self.raw_path}{self.file_name}')
+        return cache_utils.hash_object({'raw': raw_hash, 'code': cache_utils.hash_class_code(type(self)), 'params': params})
+
+    # True if the clean data was written from inputs with the given fingerprint
+    def is_up_to_date(self, fingerprint):
+        return cache_utils.is_up_to_date(f'{self.clean_path}{self.clean_file_name()}', fingerprint)
+
+    # Write the manifest next to the clean data, has to be called after write_clean_data
+    def write_manifest(self, fingerprint, params=None):
+        cache_utils.write_manifest(f'{self.clean_path}{self.clean_file_name()}', fingerprint, {'name': self.name, 'file_name': self.file_name, 'params': params})
+
+    # Execute all the cleaning steps, skipped if the raw data and the cleaning code did not change since the last run
+    # returns the fingerprint of the clean data (can be used as an input of the next steps)
+    def pipeline(self, params=None, use_cache=True):
         if not self.loaded:
             print(f"{self.name} : This object does not come from a local file, the pipeline cannot be executed")
             return
-        self.fetch_raw_data()
-        self.clean_raw_data()
-        self.write_clean_data()
\ No newline at end of file
+
+        fingerprint = self.fingerprint(params)
+        if use_cache and self.is_up_to_date(fingerprint):
+            print(f"{self.name} : Raw data and cleaning code did not change, using the saved clean data")
+            self.load_clean_data()
+            return fingerprint
+
+        if self.chunksize is None:
+            self.fetch_raw_data()
+        self.clean_data()
+        self.write_clean_data()
+        self.write_manifest(fingerprint, params)
+        return fingerprint
\ No newline at end of file
@@ -0,0 +1,173 @@
+# Description: Sparse (row x genre) indicator matrix of the genres of the movies. The Genres column is a comma-joined
+# string, splitting and exploding it for every analysis multiplies the number of rows by the number of genres of each
+# movie: the genres are encoded once in a vocabulary and a CSR matrix, and the aggregations per genre become products
+# of this matrix with the values of the rows.
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class GenreMatrix():
+
+    def __init__(self, genres, matrix, ids=None):
+
+        # genres[j] is the genre of the column j of the matrix (ordered by first appearance)
+        self.genres = pd.Index(np.asarray(genres, dtype=object), name='Genres')
+        # matrix[i, j] is 1 if the row i has the genre j (csr, one row per movie or per row of the analysed dataframe)
+        self.matrix = sparse.csr_matrix(matrix)
+        # identifier of each row (Wikipedia_movie_ID for the movies), optional
+        self.ids = None if ids is None else np.asarray(ids)
+
+    @classmethod
+    def from_lists(cls, genre_lists, ids=None):
+        """
+        Build the matrix from the genres of each row
+        :param genre_lists: iterable of lists/tuples of genres, None (or NaN) for the rows without genres
+        :param ids: list/Series : identifier of each row (optional)
+        :return: GenreMatrix
+        """
+        # a genre appearing twice in a row is only counted once
+        genre_lists = [list(dict.fromkeys(genres)) if isinstance(genres, (list, tuple, np.ndarray)) else []
+                       for genres in genre_lists]
+        lengths = np.fromiter((len(genres) for genres in genre_lists), dtype=np.int64, count=len(genre_lists))
+        flat = [genre for genres in genre_lists for genre in genres]
+
+        columns, genres = pd.factorize(pd.Series(flat, dtype=object))
+        indptr = np.zeros(len(genre_lists) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        matrix = sparse.csr_matrix((np.ones(len(flat), dtype=np.int8), columns, indptr),
+                                   shape=(len(genre_lists), len(genres)))
+        return cls(genres, matrix, ids)
+
+    @classmethod
+    def from_strings(cls, genres, separator=', ', ids=None):
+        """
+        Build the matrix from a column of joined genres ("Drama, Comedy"), every distinct string is split only once
+        :param genres: Series : the joined genres, NaN for the rows without genres
+        :param separator: str : separator of the genres, the spaces around the genres are removed
+        :param ids: list/Series : identifier of each row (optional)
+        :return: GenreMatrix
+        """
+        codes, uniques = pd.factorize(pd.Series(genres, dtype=object))
+        lists = [[genre.strip() for genre in joined.split(separator) if genre.strip()] for joined in uniques]
+
+        # the code -1 (missing value) takes the last row -> no genre
+        unique_matrix = cls.from_lists(lists + [None])
+        return cls(unique_matrix.genres, unique_matrix.matrix[codes], ids)
+
+    def save(self, path):
+        """
+        Save the matrix in a .npz file
+        :param path: str : path of the file
+        """
+        arrays = {'genres': self.genres.to_numpy(dtype=str), 'data': self.matrix.data, 'indices': self.matrix.indices,
+                  'indptr': self.matrix.indptr, 'shape': np.array(self.matrix.shape)}
+        if self.ids is not None:
+            arrays['ids'] = self.ids
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a matrix saved with save
+        :param path: str : path of the file
+        :return: GenreMatrix
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']))
+            ids = arrays['ids'] if 'ids' in arrays else None
+            return cls(arrays['genres'].astype(object), matrix, ids)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def rows_of_ids(self, ids):
+        """
+        Rows of many identifiers at once
+        :param ids: list/Series : the identifiers
+        :return: np.array : the rows, -1 for the identifiers that are not in the matrix
+        """
+        return pd.Index(self.ids).get_indexer(ids)
+
+    def take(self, rows):
+        """
+        Matrix of some rows, the genres that no longer appear are removed
+        :param rows: np.array : positions of the rows (a boolean mask is also accepted)
+        :return: GenreMatrix
+        """
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        matrix = self.matrix[rows]
+        used = np.flatnonzero(matrix.getnnz(axis=0))
+        ids = None if self.ids is None else self.ids[rows]
+        return GenreMatrix(self.genres[used], matrix[:, used], ids)
+
+    def drop(self, genres):
+        """
+        Matrix without some genres (the rows are kept)
+        :param genres: list : the genres to remove
+        :return: GenreMatrix
+        """
+        kept = np.flatnonzero(~self.genres.isin(genres))
+        return GenreMatrix(self.genres[kept], self.matrix[:, kept], self.ids)
+
+    def rows_of_genre(self, genre):
+        """
+        :return: np.array : the positions of the rows having the genre (empty if the genre is not in the matrix)
+        """
+        if genre not in self.genres:
+            return np.array([], dtype=np.int64)
+        return self.matrix[:, self.genres.get_loc(genre)].nonzero()[0]
+
+    def counts(self):
+        """
+        Number of rows of each genre (value_counts of the exploded genres)
+        :return: Series : indexed by the genres, in the order of the vocabulary
+        """
+        return pd.Series(self.matrix.getnnz(axis=0), index=self.genres, name='Count')
+
+    def sums(self, values):
+        """
+        Sum of the values of the rows of each genre (groupby sum of the exploded genres, NaN are skipped)
+        :param values: Series/np.array : one value per row
+        :return: Series : indexed by the genres, in the order of the vocabulary
+        """
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+        return pd.Series(self.matrix.T @ values, index=self.genres)
+
+    def grouped_sums(self, keys, values=None):
+        """
+        Sum of the values of the rows of each (genre, key) (groupby [Genres, key] of the exploded genres)
+        :param keys: np.array : integer code of the key of each row (e.g. from factorize or ngroup), -1 to skip the row
+        :param values: Series/np.array : one value per row, None to count the rows
+        :return: sparse matrix : (genres x keys), the key k is the column k
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        if values is None:
+            values = np.ones(len(keys), dtype=np.int64)
+        else:
+            values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+
+        valid = keys >= 0
+        n_keys = int(keys.max()) + 1 if valid.any() else 0
+        # one-hot encoding of the keys, weighted by the values
+        one_hot = sparse.csr_matrix((values[valid], (np.flatnonzero(valid), keys[valid])), shape=(len(keys), n_keys))
+        return (self.matrix.T @ one_hot).tocsr()
+
+    def explode(self, df, genres=None):
+        """
+        Rows of df repeated once per genre, with the genre in the Genres column (only for the given genres)
+        :param df: DataFrame : the rows of the matrix
+        :param genres: list : the genres to keep, all by default
+        :return: DataFrame : same index as df (repeated)
+        """
+        matrix = self.matrix if genres is None else self.matrix[:, np.flatnonzero(self.genres.isin(genres))]
+        vocabulary = self.genres if genres is None else self.genres[self.genres.isin(genres)]
+        coo = matrix.tocoo()
+        # keep the order of the rows of df
+        order = np.lexsort((coo.col, coo.row))
+        exploded = df.iloc[coo.row[order]].copy()
+        exploded['Genres'] = vocabulary.to_numpy()[coo.col[order]]
+        return exploded
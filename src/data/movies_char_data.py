@@ -1,8 +1,10 @@
 import json
+import numpy as np
 import pandas as pd
 import os
-from src.data.data_class import DataClass
-from unidecode import unidecode
+from src.data.data_class import DataClass, is_text_column
+from src.data.genre_matrix import GenreMatrix
+from src.utils.general_utils import transliterate
 
 
 # All the cleaned dataframes will follow the same structure:
@@ -18,61 +20,118 @@ CLEAN_DATA_PATH = 'data/clean/movies_char/'
 # Create the clean data directory if it does not exist
 os.makedirs(CLEAN_DATA_PATH, exist_ok=True)
 
+# orjson parses the JSON columns faster, the standard json module is used if it is not installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+def parse_json_values(data):
+    """
+    Parse a Freebase dictionary {"/m/id": "value", ...} and return its values.
+    The string is parsed as JSON first, and only if it fails with the ' replaced by " (the dictionaries written with
+    single quotes). The old parser only tried the replaced string: it could not parse the values containing an apostrophe
+    ({"/m/id": "Children's"} -> None), they are now parsed. The other strings give the same values as before.
+    :param data: str : the JSON dictionary
+    :return: list : the values, None if the data is missing or can not be parsed
+    """
+    if not isinstance(data, str):
+        return None
+
+    # The dictionaries are valid JSON, the ' are only replaced by " as a fallback (see above)
+    for text in (data, data.replace("'", '"')):
+        try:
+            data_dict = json_loads(text)
+        except ValueError:
+            continue
+        if isinstance(data_dict, dict):
+            return list(data_dict.values())
+    return None
+
+
+def format_json_value(value, column_name):
+    """
+    Format a value of the Languages, Countries or Genres columns ("Hindi Language" -> "Hindi", "Japanese Movies: Anime" -> "Anime")
+    """
+    if column_name in ['Languages', 'Countries']:
+        return value.replace(" Language", "").replace(" Country", "")
+    elif column_name == 'Genres':
+        return value.split(': ')[-1] if ': ' in value else value
+    return value
+
 # Class for Character data from 
 class CharacterData(DataClass):
 
+    # Compact dtypes: the names and genders are repeated a lot -> dictionary encoded
+    schema = {'Character_name': 'category', 'Actor_gender': 'category', 'Actor_name': 'category'}
+
+    # transliterate
+    code_dependencies = ['src.utils.general_utils']
+
     # Initialize the class and call the parent class constructor
-    def __init__(self, name, file_name, loaded=True, output_name=None):
+    def __init__(self, name, file_name, loaded=True, output_name=None, storage_format='parquet', chunksize=None):
 
         self.regex = '^[A-Z-\s\']+$'
         separator='\t'
         columns = ['Wikipedia_movie_ID', 'Freebase_movie_ID', 'Release_date', 'Character_name', 'Actor_DOB', 'Actor_gender', 'Actor_height', 'Actor_ethnicity', 'Actor_name', 'Actor_age', 'Freebase_character_map', 'Freebase_character_ID', 'Freebase_actor_ID']
-        super().__init__(name, file_name, None, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH, output_name)
+        super().__init__(name, file_name, None, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH, output_name, storage_format, chunksize)
 
     # Load and clean the raw data
     def clean_raw_data(self):
         print(f"{self.name} : Cleaning the raw data")
-        self.clean_df = self.raw_df.copy()
+        # The whole raw data is cleaned as a single chunk
+        self.reduce_chunks([self.clean_chunk(self.raw_df)])
+
+        # Check the cleaned data
+        self.check_clean_data()
+
+    # Every cleaning step is done row by row, so a chunk can be cleaned on its own
+    def clean_chunk(self, chunk):
         # Correct any misalignments in column names due to spaces
-        self.clean_df.columns = [col.strip() for col in self.columns]
+        df = chunk.set_axis([col.strip() for col in self.columns], axis=1)
 
         # Check the good type format for the columns
         # Convert DOB and Release date to datetime
-        self.clean_df['Actor_DOB'] = pd.to_datetime(self.clean_df['Actor_DOB'], errors='coerce', format='%Y-%m-%d')
-        self.clean_df['Release_date'] = pd.to_datetime(self.clean_df['Release_date'], errors='coerce', format='%Y-%m-%d')
+        df['Actor_DOB'] = pd.to_datetime(df['Actor_DOB'], errors='coerce', format='%Y-%m-%d')
+        df['Release_date'] = pd.to_datetime(df['Release_date'], errors='coerce', format='%Y-%m-%d')
         
         # Fill missing values with NaT
-        self.clean_df['Actor_DOB'] = self.clean_df['Actor_DOB'].fillna(pd.NaT)
-        self.clean_df['Release_date'] = self.clean_df['Release_date'].fillna(pd.NaT)
+        df['Actor_DOB'] = df['Actor_DOB'].fillna(pd.NaT)
+        df['Release_date'] = df['Release_date'].fillna(pd.NaT)
 
         # Convert Character_name and Actor_name to object type
-        self.clean_df['Character_name'] = self.clean_df['Character_name'].astype('object')
-        self.clean_df['Actor_name'] = self.clean_df['Actor_name'].astype('object')
+        df['Character_name'] = df['Character_name'].astype('object')
+        df['Actor_name'] = df['Actor_name'].astype('object')
 
         # We need to homogenize the name of the character and the actor
         # They need to comply to the following REGEX : '^[A-Z-\s\']+$' -> space and - are allowed and ' in case of names like O'Brien
         ### 1. Uppercase
-        self.clean_df['Character_name'] = self.clean_df['Character_name'].str.upper()
-        self.clean_df['Actor_name'] = self.clean_df['Actor_name'].str.upper()
+        df['Character_name'] = df['Character_name'].str.upper()
+        df['Actor_name'] = df['Actor_name'].str.upper()
         ### 2. Remove accents using unidecode
-        self.clean_df['Character_name'] = self.clean_df['Character_name'].astype(str)
-        self.clean_df['Actor_name'] = self.clean_df['Actor_name'].astype(str)
-        self.clean_df['Character_name'] = self.clean_df['Character_name'].apply(lambda x: unidecode(x))
-        self.clean_df['Actor_name'] = self.clean_df['Actor_name'].apply(lambda x: unidecode(x))
+        df['Character_name'] = df['Character_name'].astype(str)
+        df['Actor_name'] = df['Actor_name'].astype(str)
+        df['Character_name'] = transliterate(df['Character_name'])
+        df['Actor_name'] = transliterate(df['Actor_name'])
         ### 3. Remove special characters that doesn't comply to the regex (remove the row since the name will never match a real one)
-        self.clean_df = self.clean_df[self.clean_df['Character_name'].str.match(self.regex)]
-        self.clean_df = self.clean_df[self.clean_df['Actor_name'].str.match(self.regex)]
+        df = df[df['Character_name'].str.match(self.regex)]
+        df = df[df['Actor_name'].str.match(self.regex)]
 
         # Convert Actor_age to integer type
-        self.clean_df['Actor_age'] = pd.to_numeric(self.clean_df['Actor_age'], errors='coerce')
+        df['Actor_age'] = pd.to_numeric(df['Actor_age'], errors='coerce')
         #Convert Actor_height to float
-        self.clean_df['Actor_height'] = pd.to_numeric(self.clean_df['Actor_height'], errors='coerce')
+        df['Actor_height'] = pd.to_numeric(df['Actor_height'], errors='coerce')
  
         # Drop Freebase_movie_ID, Freebase_actor_ID, Freebas_character_map, Freebase_character_ID columns because they are not useful
-        self.clean_df.drop(columns=['Freebase_movie_ID', 'Freebase_actor_ID', 'Freebase_character_map','Freebase_character_ID', 'Actor_ethnicity'], inplace=True)
+        df.drop(columns=['Freebase_movie_ID', 'Freebase_actor_ID', 'Freebase_character_map','Freebase_character_ID', 'Actor_ethnicity'], inplace=True)
 
-        # Check the cleaned data
-        self.check_clean_data()
+        return df
+
+    # Nothing has to be done across the chunks, we only put them back together
+    def reduce_chunks(self, chunks):
+        self.clean_df = pd.concat(chunks)
 
     def check_clean_data(self):    
          #Check the number of columns (9)
@@ -85,16 +144,16 @@ class CharacterData(DataClass):
         assert self.clean_df['Wikipedia_movie_ID'].dtype == 'int64', f'{self.name} : Wikipedia_movie_ID column is not of type int64'
         ## Release_date : datetime64
         assert pd.api.types.is_datetime64_any_dtype(self.clean_df['Release_date']), f'{self.name} : Release_date column is not of type datetime64'
-        ## Character_name : object
-        assert self.clean_df['Character_name'].dtype == 'object', f'{self.name} : Character_name column is not of type object'
+        ## Character_name : object or category
+        assert is_text_column(self.clean_df['Character_name']), f'{self.name} : Character_name column is not of type object or category'
         ## Actor_DOB : datetime64
         assert pd.api.types.is_datetime64_any_dtype(self.clean_df['Actor_DOB']), f'{self.name} : Actor_DOB column is not of type datetime64'
-        ## Actor_gender : object
-        assert self.clean_df['Actor_gender'].dtype == 'object', f'{self.name} : Actor_gender column is not of type object'
+        ## Actor_gender : object or category
+        assert is_text_column(self.clean_df['Actor_gender']), f'{self.name} : Actor_gender column is not of type object or category'
         ## Actor_height : float64
         assert self.clean_df['Actor_height'].dtype == 'float64', f'{self.name} : Actor_height column is not of type float64'
-        ## Actor_name : object
-        assert self.clean_df['Actor_name'].dtype == 'object', f'{self.name} : Actor_name column is not of type object'
+        ## Actor_name : object or category
+        assert is_text_column(self.clean_df['Actor_name']), f'{self.name} : Actor_name column is not of type object or category'
         ## Actor_age : float64
         assert self.clean_df['Actor_age'].dtype == 'float64', f'{self.name} : Actor_age column is not of type float64'
 
@@ -110,11 +169,22 @@ class CharacterData(DataClass):
 # Class for Movie data from movie metadata
 class MovieData(DataClass):
 
+    # Compact dtypes: the same lists of languages, countries and genres are shared by many movies -> dictionary encoded
+    schema = {'Languages': 'category', 'Countries': 'category', 'Genres': 'category'}
+
+    # GenreMatrix (the genre matrix is written with the clean data)
+    code_dependencies = ['src.data.genre_matrix']
+
     # Initialize the class and call the parent class constructor
-    def __init__(self, name, file_name, loaded=True, output_name=None):
+    def __init__(self, name, file_name, loaded=True, output_name=None, storage_format='parquet'):
         separator = '\t'
         columns = ['Wikipedia_movie_ID', 'Freebase_movie_ID', 'Movie_name', 'Release_date', 'Revenue','Runtime', 'Languages', 'Countries', 'Genres']
-        super().__init__(name, file_name, None, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH, output_name)
+        super().__init__(name, file_name, None, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH, output_name, storage_format)
+        # Values of the JSON columns as tuples (one per row), and number of rows that could not be parsed (filled by clean_raw_data)
+        self.json_lists = {}
+        self.parse_failures = {}
+        # Sparse (movie x genre) matrix, rows in the order of clean_df (filled by clean_raw_data or load_clean_data)
+        self.genres = None
     
     # Clean the raw data
     def clean_raw_data(self):
@@ -126,26 +196,12 @@ class MovieData(DataClass):
         # Correct any misalignments in column names due to spaces
         self.clean_df.columns = [col.strip() for col in self.clean_df.columns]
 
-        # Ensure the 'Languages' column exists before processing
-        if 'Languages' in self.clean_df.columns:
-            self.clean_df['Languages'] = self.clean_df['Languages'].apply(
-                lambda data: self.parse_json_column(data, 'Languages'))
-        else:
-            print("Warning: 'Languages' column not found in the data")
-
-        # Ensure the 'Countries' column exists before processing
-        if 'Countries' in self.clean_df.columns:
-            self.clean_df['Countries'] = self.clean_df['Countries'].apply(
-                lambda data: self.parse_json_column(data, 'Countries'))
-        else:
-            print("Warning: 'Countries' column not found in the data")
-
-        # Ensure the 'Genres' column exists before processing
-        if 'Genres' in self.clean_df.columns:
-            self.clean_df['Genres'] = self.clean_df['Genres'].apply(
-                lambda data: self.parse_json_column(data, 'Genres'))
-        else:
-            print("Warning: 'Genres' column not found in the data")
+        # Parse the JSON dictionaries of the Languages, Countries and Genres columns (each distinct string is parsed once)
+        for column_name in ['Languages', 'Countries', 'Genres']:
+            if column_name in self.clean_df.columns:
+                self.clean_df[column_name] = self.parse_json_series(self.clean_df[column_name], column_name)
+            else:
+                print(f"Warning: '{column_name}' column not found in the data")
 
         # Checking the data types of the columns
         # Release date to datetime
@@ -170,33 +226,79 @@ class MovieData(DataClass):
         # Drop the 'Freebase_movie_ID' column because not useful
         self.clean_df.drop(columns=['Freebase_movie_ID'], inplace=True)
 
+        # Genres of the movies as a sparse matrix, built from the parsed lists (no need to split the joined strings again)
+        self.genres = GenreMatrix.from_lists(self.json_lists['Genres'], ids=self.clean_df['Wikipedia_movie_ID'])
+
         # Check the cleaned data
         self.check_clean_data()
 
+    # Path of the genre matrix, next to the clean data
+    def genres_path(self):
+        return f'{self.clean_path}{os.path.splitext(self.clean_file_name())[0]}_genres.npz'
+
+    # Writes the cleaned data and the genre matrix
+    def write_clean_data(self):
+        super().write_clean_data()
+        if self.genres is not None:
+            self.genres.save(self.genres_path())
+            print(f"{self.name} : Genre matrix has been saved to {self.genres_path()} ({len(self.genres.genres)} genres)")
+
+    # Loads the cleaned data and the genre matrix (built from the Genres column if it was not saved)
+    def load_clean_data(self, columns=None):
+        super().load_clean_data(columns)
+        if os.path.exists(self.genres_path()):
+            self.genres = GenreMatrix.load(self.genres_path())
+        elif 'Genres' in self.clean_df.columns:
+            self.genres = GenreMatrix.from_strings(self.clean_df['Genres'], ids=self.clean_df.get('Wikipedia_movie_ID'))
+
     def parse_json_column(self, data, column_name):
         '''
         Parse the JSON data in the column and return a string representation of the values
         param data: JSON data in the column
         param column_name: Name of the column
-        return: String representation of the values
+        return: String representation of the values, None if the data is missing or can not be parsed
         
         '''
-        if pd.notna(data):
-            try:
-                # Convert string representation of a dictionary to an actual dictionary
-                data_dict = json.loads(data.replace("'", '"'))
-            except Exception as e:
-                return None  # Handle cases where conversion fails
-
-            # Extract and process data based on the column type
-            if column_name in ['Languages', 'Countries']:
-                return ', '.join(
-                    value.replace(" Language", "").replace(" Country", "") for value in data_dict.values())
-            elif column_name == 'Genres':
-                return ', '.join(genre.split(': ')[-1] if ': ' in genre else genre for genre in data_dict.values())
+        values = parse_json_values(data)
+        if values is None:
+            return None
+        return ', '.join(format_json_value(value, column_name) for value in values)
+
+    def parse_json_series(self, column, column_name):
+        '''
+        Parse a whole JSON column: every distinct string is parsed only once (the same dictionaries are repeated a lot).
+        The lists of values are kept in self.json_lists[column_name] and the number of strings that could not be parsed
+        in self.parse_failures[column_name]
+        param column: Series with the JSON data
+        param column_name: Name of the column
+        return: Series with the string representation of the values (None if missing or not parsed)
+        '''
+        codes, uniques = pd.factorize(column)
+
+        joined, lists, failures = [], [], 0
+        for data in uniques:
+            values = parse_json_values(data)
+            if values is None:
+                failures += 1
+                joined.append(None)
+                lists.append(None)
             else:
-                return ', '.join(data_dict.values())
-        return None
+                values = tuple(format_json_value(value, column_name) for value in values)
+                joined.append(', '.join(values))
+                lists.append(values)
+
+        # the code -1 (missing value) takes the last element -> None
+        joined = np.array(joined + [None], dtype=object)
+        lists = np.array(lists + [None], dtype=object)
+
+        self.json_lists[column_name] = pd.Series(lists.take(codes), index=column.index, name=column_name)
+        # number of rows whose string could not be parsed (the missing values are not failures)
+        failed = np.array([values is None for values in lists[:-1]], dtype=bool)
+        self.parse_failures[column_name] = int(failed[codes[codes >= 0]].sum())
+        if self.parse_failures[column_name] > 0:
+            print(f"{self.name} : {self.parse_failures[column_name]} rows of {column_name} could not be parsed ({failures} distinct strings)")
+
+        return pd.Series(joined.take(codes), index=column.index, name=column_name)
 
         # Check the cleaned data
 
@@ -227,12 +329,12 @@ class MovieData(DataClass):
         assert self.clean_df['Revenue'].dtype == 'float64', f'{self.name}: Revenue column is not of type float64'
         # Runtime : timedelta
         assert pd.api.types.is_timedelta64_dtype(self.clean_df['Runtime']), f'{self.name}: Runtime column is not of type timedelta'
-        # Languages : object
-        assert self.clean_df['Languages'].dtype == 'object', f'{self.name}: Languages column is not of type object'
-        # Countries : object
-        assert self.clean_df['Countries'].dtype == 'object', f'{self.name}: Countries column is not of type object'
-        # Genres : object
-        assert self.clean_df['Genres'].dtype == 'object', f'{self.name}: Genres column is not of type object'
+        # Languages : object or category
+        assert is_text_column(self.clean_df['Languages']), f'{self.name}: Languages column is not of type object or category'
+        # Countries : object or category
+        assert is_text_column(self.clean_df['Countries']), f'{self.name}: Countries column is not of type object or category'
+        # Genres : object or category
+        assert is_text_column(self.clean_df['Genres']), f'{self.name}: Genres column is not of type object or category'
 
         # Check for duplicates
         #duplicates = self.clean_df.duplicated().sum()
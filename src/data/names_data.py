@@ -1,6 +1,11 @@
 
+import re
+import numpy as np
 import pandas as pd
-from src.data.data_class import DataClass
+from scipy import sparse
+from src.data.data_class import DataClass, is_text_column
+from src.utils.cache_utils import hash_frame
+from src.utils.general_utils import transliterate
 
 # All the cleaned dataframes will follow the same structure:
 # 1. Year
@@ -12,58 +17,180 @@ from src.data.data_class import DataClass
 RAW_DATA_PATH = 'data/raw/names/'
 CLEAN_DATA_PATH = 'data/clean/names/'
 
+# Allowed values of the clean data, compiled once
+# name : '^[A-Z-\s\']+$' -> space and - are allowed and ' in case of names like O'Brien
+NAME_REGEX = re.compile(r"^[A-Z-\s']+$")
+# sex : only M/F
+SEX_REGEX = re.compile('^[MF]$')
+
+# Modes of NamesData.check_clean_data
+CHECK_MODES = ('full', 'sample', 'skip-if-unchanged')
+
+def distinct_values(column):
+    """
+    Distinct non-missing values of a column, so that the checks on the strings run once per value and not once per row
+    :param column: Series
+    :return: np.array : the values (for a categorical column : the categories used by at least one row)
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.codes.to_numpy()
+        used = np.bincount(codes[codes >= 0], minlength=len(column.cat.categories)) > 0
+        return column.cat.categories.to_numpy()[used]
+    values = pd.unique(column.to_numpy())
+    return values[~pd.isna(values)]
+
+def all_match(values, regex):
+    """
+    :return: bool : True if all the values are strings matching the compiled regex
+    """
+    return all(isinstance(value, str) and regex.match(value) is not None for value in values)
+
+def integer_codes(column):
+    """
+    Integer code of the value of each row (the codes of a categorical column are used directly)
+    :return: np.array, int : the codes and the number of distinct codes
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(dtype=np.int64), len(column.cat.categories)
+    codes, uniques = pd.factorize(column)
+    return codes.astype(np.int64), len(uniques)
+
+def most_frequent_sex_mask(df):
+    """
+    Mask of the rows of the most frequent sex of each (Year, Name), in a single pass over the table: the (Year, Name) pairs
+    and the sexes are encoded as integers and the counts are summed per (pair, sex) with bincount.
+    On a tie, the first sex in alphabetical order is kept (like groupby + idxmax).
+    :param df: DataFrame : with the columns Year, Name, Sex and Count
+    :return: np.array : True for the rows to keep, the rows with a missing Year, Name or Sex are dropped
+    """
+    # -1 for the rows with a missing Year or Name
+    pairs = df.groupby(['Year', 'Name'], sort=False, observed=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    sex_codes, sexes = pd.factorize(df['Sex'], sort=True)
+    valid = (pairs >= 0) & (sex_codes >= 0)
+    if not valid.any():
+        return valid
+
+    n_pairs, n_sexes = pairs.max() + 1, len(sexes)
+    flat = pairs[valid] * n_sexes + sex_codes[valid]
+    counts = np.nan_to_num(df['Count'].to_numpy(dtype=np.float64)[valid])
+
+    # total count of each (pair, sex), -inf when the sex does not appear for this pair
+    totals = np.bincount(flat, weights=counts, minlength=n_pairs * n_sexes)
+    present = np.bincount(flat, minlength=n_pairs * n_sexes) > 0
+    totals = np.where(present, totals, -np.inf).reshape(n_pairs, n_sexes)
+
+    # argmax keeps the first maximum -> alphabetical order of the sexes on a tie
+    winners = totals.argmax(axis=1)
+
+    mask = np.zeros(len(df), dtype=bool)
+    mask[valid] = sex_codes[valid] == winners[pairs[valid]]
+    return mask
+
+def sum_counts(chunks, keys, count, sort=True):
+    """
+    Sum the counts of the chunks per keys, chunk after chunk: each chunk is added to a running total, so that only the
+    total and one chunk are in memory (the total has one row per distinct keys, not one per row of the chunks)
+    :param chunks: iterable of DataFrame : the chunks, with the keys and count columns
+    :param keys: list of str : the columns to group by
+    :param count: str : the column to sum
+    :param sort: bool : if False, the keys are kept in order of first appearance
+    :return: DataFrame : the keys and count columns
+    """
+    total = None
+    for chunk in chunks:
+        df = chunk if total is None else pd.concat([total, chunk], ignore_index=True)
+        total = df.groupby(keys, as_index=False, sort=sort)[count].sum()
+    return total if total is not None else pd.DataFrame(columns=keys + [count])
+
 # Class for all the data cleaners
 class NamesData(DataClass):
 
-    def __init__(self, name, file_name, credits=None, separator=',', loaded=True):
+    # Compact dtypes: the names and the sexes are dictionary encoded, the years and counts are small integers
+    schema = {'Year': 'int16', 'Name': 'category', 'Sex': 'category', 'Count': 'uint32'}
+
+    # transliterate
+    code_dependencies = ['src.utils.general_utils']
+
+    # Default mode of check_clean_data : the data is checked fully, and again only when it changed
+    check_mode = 'skip-if-unchanged'
+    # Number of rows checked in the 'sample' mode
+    check_sample_size = 100_000
+
+    def __init__(self, name, file_name, credits=None, separator=',', loaded=True, storage_format='parquet', chunksize=None):
 
         columns = ['Year', 'Name', 'Sex', 'Count']
         # Call the parent class constructor
-        super().__init__(name, file_name, credits, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH)
+        super().__init__(name, file_name, credits, separator, loaded, columns, RAW_DATA_PATH, CLEAN_DATA_PATH, storage_format=storage_format, chunksize=chunksize)
+
+        # Fingerprint of the data of the last successful check (mode 'skip-if-unchanged')
+        self.checked_fingerprint = None
 
     # Checks if there are missing values in the raw data and that it conforms to the expected structure
-    def check_clean_data(self):
+    # mode (check_mode of the object by default) :
+    #   'full' : every row is checked
+    #   'sample' : the structure is checked, the values only on check_sample_size random rows (fixed seed)
+    #   'skip-if-unchanged' : like 'full', but nothing is checked again if the data has the fingerprint of the last successful check
+    def check_clean_data(self, mode=None):
+        mode = self.check_mode if mode is None else mode
+        if mode not in CHECK_MODES:
+            raise ValueError(f"{self.name} : unknown check mode {mode}, expected one of {CHECK_MODES}")
+
+        fingerprint = None
+        if mode == 'skip-if-unchanged':
+            fingerprint = hash_frame(self.clean_df)
+            if fingerprint == self.checked_fingerprint:
+                print(f"{self.name} : Data did not change since the last check, it is still clean")
+                return
+
         # Number of Columns if equal to 4
         assert self.clean_df.shape[1] == 4, f'{self.name} has {self.clean_df.shape[1]} columns, 4 are excepted'
         # Expected column names are ['Year', 'Name', 'Sex', 'Count']
         assert all(col in self.clean_df.columns for col in self.columns), f'{self.name} has not the right column names : {self.columns}'
 
-        # Missing values in the cleaned data
-        missing_values = self.clean_df.isnull().sum().sum()
-        missing_values += self.clean_df.isna().sum().sum()
-        # for the string
-        missing_values += self.clean_df.isin(['']).sum().sum()
-        assert missing_values == 0, f'{self.name} has missing values!'
+        df = self.clean_df
+        if mode == 'sample' and len(df) > self.check_sample_size:
+            df = df.sample(n=self.check_sample_size, random_state=0)
+
+        # Distinct values of the string columns, the checks on the strings are done on them only
+        distinct = {col: distinct_values(df[col]) for col in df.columns if is_text_column(df[col])}
+
+        # Missing values in the cleaned data (and empty strings)
+        missing_values = any(df[col].isna().any() for col in df.columns)
+        missing_values = missing_values or any((values == '').any() for values in distinct.values())
+        assert not missing_values, f'{self.name} has missing values!'
 
         # Check the tyoe of the columns
-        ## Year column should be int64
-        assert (self.clean_df['Year'].dtype == 'int64' or self.clean_df['Year'].dtype == 'int32'), f'{self.name} : Year column is not of type int64'
-        ## Name column : String -> object in pandas
-        assert self.clean_df['Name'].dtype == 'object', f'{self.name} : Name column is not of type object (string)'
-        ## Sex column : String -> object in pandas
-        assert self.clean_df['Sex'].dtype == 'object', f'{self.name} : Sex column is not of type object (string)'
-        ## Count column : int64
-        assert (self.clean_df['Count'].dtype == 'int64' or self.clean_df['Year'].dtype == 'int32'), f'{self.name} : Count column is not of type int64'
+        ## Year column should be an integer (int16 with the schema)
+        assert pd.api.types.is_integer_dtype(df['Year']), f'{self.name} : Year column is not of type int'
+        ## Name column : String -> object or category in pandas
+        assert is_text_column(df['Name']), f'{self.name} : Name column is not of type object or category (string)'
+        ## Sex column : String -> object or category in pandas
+        assert is_text_column(df['Sex']), f'{self.name} : Sex column is not of type object or category (string)'
+        ## Count column : integer (uint32 with the schema)
+        assert pd.api.types.is_integer_dtype(df['Count']), f'{self.name} : Count column is not of type int'
 
         # Check for duplicates -> same name, same sex, same year, but different count
-        wo_count = self.clean_df.drop(columns=['Count'])
-        duplicates = wo_count.duplicated().sum()
+        # a single integer key per (Year, Name, Sex) instead of comparing the rows
+        year_codes, _ = integer_codes(df['Year'])
+        name_codes, n_names = integer_codes(df['Name'])
+        sex_codes, n_sexes = integer_codes(df['Sex'])
+        keys = (year_codes * n_sexes + sex_codes) * n_names + name_codes
+        duplicates = len(keys) - len(pd.unique(keys))
         assert duplicates == 0, f'{self.name} has {duplicates} duplicates !'
 
-        # Check that the names contain only letters
-        # allowed regex for name : '^[A-Z-\s\']+$' -> space and - are allowed and ' in case of names like O'Brien
-        # allowed regex for sexe (only M/F) : '^[MF]$'
-
-        assert all(self.clean_df['Name'].str.match("^[A-Z-\s\']+$")), f'{self.name} : Not all the names are composed of uppercased letters'
-        assert all(self.clean_df['Sex'].str.match('^[MF]$')), f'{self.name} : The sex column contains values different from M/F'
+        # Check that the names contain only letters and that the sex is M/F
+        assert all_match(distinct['Name'], NAME_REGEX), f'{self.name} : Not all the names are composed of uppercased letters'
+        assert all_match(distinct['Sex'], SEX_REGEX), f'{self.name} : The sex column contains values different from M/F'
 
         # Check that the year is positive, less than 2024 and bigger than 1750
-        assert all(self.clean_df['Year'] > 1750), f'{self.name} : The year is lower than 1750'
-        assert all(self.clean_df['Year'] < 2024), f'{self.name} : The year is bigger than 2024'
+        assert len(df) == 0 or df['Year'].min() > 1750, f'{self.name} : The year is lower than 1750'
+        assert len(df) == 0 or df['Year'].max() < 2024, f'{self.name} : The year is bigger than 2024'
 
         # Check that the count is positive
-        assert all(self.clean_df['Count'] >= 0), f'{self.name} : The count is negative'
+        assert len(df) == 0 or df['Count'].min() >= 0, f'{self.name} : The count is negative'
 
+        if fingerprint is not None:
+            self.checked_fingerprint = fingerprint
         print(f"{self.name} : Data is clean and conforms to the expected structure !")
 
     # Function that will be defined by children classes
@@ -72,68 +199,42 @@ class NamesData(DataClass):
     
     # If a name appears as both M and F in the same year, we will keep only the most frequent 
     def sex_handling(self):
-        # Group by Year, Name, and Sex, and sum the counts to find total occurrences
-        group = self.clean_df.groupby(['Year', 'Name', 'Sex'], as_index=False)['Count'].sum()
-
-        # For each (Year, Name), find the sex with the maximum count
-        # idxmax finds the index of the maximum Count per (Year, Name) group
-        winners = group.loc[group.groupby(['Year', 'Name'])['Count'].idxmax()]
-
-        # 'winners' now contains the (Year, Name, Sex) combination for the most frequent sex in that year-name pair.
-        # Merge back to self.clean_df to keep only the winning sex rows
-        self.clean_df = pd.merge(self.clean_df, winners[['Year', 'Name', 'Sex']], on=['Year','Name','Sex'], how='inner')
+        # Mask of the rows of the most frequent sex of each (Year, Name), the order of the rows is kept
+        self.clean_df = self.clean_df[most_frequent_sex_mask(self.clean_df)].reset_index(drop=True)
 
         return self.clean_df
 
     # Fill missing years with 0 count (1917, ..., 1919 has to be filled in 1918 with a 0) ! /!\ HAS TO BE CALLED AFTER SEX HANDLING
+    # The counts are pivoted straight into a sparse (name x year) frame: the missing years are implicit zeros, so the memory
+    # is proportional to the rows of clean_df and not to the number of names times the number of years.
+    # It reads as a dense table (frame.loc[name] is the gap-free series of a name, frame[year] the counts of a year),
+    # .sparse.to_dense() gives the dense table. clean_df is not modified (the sex of each observed year stays there)
     def fill_missing_years(self):
+        df = self.clean_df.dropna(subset=['Name'])
 
-        # Determine min and max year
-        min_year = self.clean_df['Year'].min()
-        max_year = self.clean_df['Year'].max()
-
-        # Get all unique names
-        unique_names = self.clean_df['Name'].dropna().unique()
-
-        # Create a DataFrame with a full range of years
-        all_years = pd.DataFrame({'Year': range(min_year, max_year + 1)})
-
-        # Create all combinations of (Year, Name)
-        all_combinations = (
-            all_years.assign(key=1)
-            .merge(pd.DataFrame({'Name': unique_names, 'key': 1}), on='key', how='outer')
-            .drop('key', axis=1)
-        )
+        # Dictionary encoding of the names (in order of appearance) and of the years
+        name_codes, names = pd.factorize(df['Name'])
+        years = df['Year'].to_numpy(dtype=np.int64)
+        min_year = int(years.min()) if len(years) > 0 else 0
+        n_years = int(years.max()) - min_year + 1 if len(years) > 0 else 0
 
-        # Merge to ensure all (Year, Name) pairs are present
-        self.clean_df = pd.merge(
-            all_combinations, 
-            self.clean_df, 
-            on=['Year', 'Name'], 
-            how='left',
-            validate='one_to_one'
-        )
+        # the duplicated (name, year) are summed when the coordinates are converted -> less stored values than rows
+        counts = sparse.csr_matrix((df['Count'].to_numpy(dtype=np.int64), (name_codes, years - min_year)),
+                                   shape=(len(names), n_years))
+        if counts.nnz != len(df):
+            raise ValueError(f"{self.name} : (Year, Name) is not unique, call sex_handling first")
+        # the rows with a 0 count are zeros as well
+        counts.eliminate_zeros()
 
-        # Fill missing Count with 0
-        self.clean_df['Count'] = self.clean_df['Count'].fillna(0)
-
-        # Now, fill the Sex column by propagating existing values. (This is possible due to sex_handling)
-        self.clean_df['Sex'] = self.clean_df.groupby('Name')['Sex'].ffill().bfill()
-
-        # This changed the type of the column to float -> cast to int64
-        self.clean_df['Count'] = self.clean_df['Count'].astype('int64')
-        
-        # same for the year
-        self.clean_df['Year'] = self.clean_df['Year'].astype('int64')
-
-        return self.clean_df
+        return pd.DataFrame.sparse.from_spmatrix(counts, index=pd.Index(names, name='Name'),
+                                                 columns=pd.RangeIndex(min_year, min_year + n_years, name='Year'))
 
-    def load_clean_data(self):
+    def load_clean_data(self, columns=None):
 
         # call the parent class method
-        super().load_clean_data()
+        super().load_clean_data(columns)
 
-        #Drop NaN -> pandas bug (I manually checked that there are no NaN in the dataset, and still one is added when reading the big files)
+        #Drop NaN -> only happens with the csv format (the name "NA" is read as a missing value), parquet keeps it as a string
         self.clean_df = self.clean_df.dropna()
 
 # Class for the US data
@@ -141,17 +242,27 @@ class USNamesData(NamesData):
     
     # Clean the raw data
     def clean_raw_data(self):
-         
-        self.clean_df = self.raw_df.copy()
+
+        # The whole raw data is cleaned as a single chunk
+        self.reduce_chunks([self.clean_chunk(self.raw_df)])
+        # Check the data
+        self.check_clean_data() #Nothing more has to be done, this dataset is already clean and of good quality
+
+    # Clean a chunk of the raw data (row by row operations only)
+    def clean_chunk(self, chunk):
         # Change the column names
-        self.clean_df.columns = self.columns
+        df = chunk.set_axis(self.columns, axis=1)
         # Rewrite the names in upper case
-        self.clean_df['Name'] = self.clean_df['Name'].str.upper()
+        df['Name'] = df['Name'].str.upper()
+        return df
+
+    # Put the cleaned chunks together, the counts are summed per (Year, Name, Sex) into a running total (in the order of the
+    # raw file, the raw data already has one row per (Year, Name, Sex)), the sex handling needs all the rows of a year
+    def reduce_chunks(self, chunks):
+        self.clean_df = sum_counts(chunks, ['Year', 'Name', 'Sex'], 'Count', sort=False)
 
         self.sex_handling()      
-        #self.fill_missing_years()
-        # Check the data
-        self.check_clean_data() #Nothing more has to be done, this dataset is already clean and of good quality
+        #self.fill_missing_years() # see FranceNamesData
 
 # Class for the UK data
 class UKNamesData(NamesData):
@@ -159,8 +270,6 @@ class UKNamesData(NamesData):
     # Clean the raw data
     def clean_raw_data(self):
 
-        from unidecode import unidecode
-
         # 1. drop the the columns that we don't need
         self.clean_df = self.raw_df.drop(columns=['rank', 'nation'])
         # invert columns 1 and 2
@@ -175,14 +284,14 @@ class UKNamesData(NamesData):
         # The dataset contained both values in uppercase and lowercase, but with different count -> group them
         self.clean_df = self.clean_df.groupby(['Year', 'Name', 'Sex']).sum().reset_index()
         # Replace accents on letters
-        self.clean_df['Name'] = self.clean_df['Name'].apply(lambda x: unidecode(x))
+        self.clean_df['Name'] = transliterate(self.clean_df['Name'])
         # 31 entries are not complying with the regex -> drop them
         self.clean_df = self.clean_df[self.clean_df['Name'].str.match('^[A-Z-\s\']+$')]
         # Dataset contains 1 missing values out of 565817 rows -> drop the row
         self.clean_df.dropna(inplace=True)
 
         #self.sex_handling()
-        #self.fill_missing_years() # Nice idea but makes the computation way too long
+        #self.fill_missing_years() # Not needed: the models read gap-free series from the NameSeriesIndex (and the filled 0 would count as observed years in the means)
         # Check the data
         self.check_clean_data()
 
@@ -192,19 +301,31 @@ class FranceNamesData(NamesData):
     # Clean the raw data
     def clean_raw_data(self):
 
-        # Latin language use accents in the name, this function will help to remove them
-        from unidecode import unidecode
+        # The whole raw data is cleaned as a single chunk
+        self.reduce_chunks([self.clean_chunk(self.raw_df)])
+        # Check the data
+        self.check_clean_data()
+
+    # Clean a chunk of the raw data, the counts are already summed inside the chunk to keep it small
+    def clean_chunk(self, chunk):
 
-        self.clean_df = self.raw_df.drop(columns=['dpt'])
+        df = chunk.drop(columns=['dpt'])
 
         # the null value for the departement is XX, and the null value for the year is XXXX, we will remove these entries
-        self.clean_df = self.clean_df[self.clean_df['annais'] != 'XXXX']
+        # (a chunk without XXXX is read as integers, so we compare the strings)
+        df = df[df['annais'].astype(str) != 'XXXX']
+        df['annais'] = df['annais'].astype(int)
 
-        # Remove the accents from the names (might take some time)
-        self.clean_df['preusuel'] = self.clean_df['preusuel'].astype(str)
-        self.clean_df['preusuel'] = self.clean_df['preusuel'].apply(lambda x: unidecode(x))
+        # Remove the accents from the names (Latin language use accents in the name), once per distinct name
+        df['preusuel'] = df['preusuel'].astype(str)
+        df['preusuel'] = transliterate(df['preusuel'])
         # this might have created some duplicates -> we need to group them and sum the counts
-        self.clean_df = self.clean_df.groupby(['annais', 'preusuel', 'sexe']).sum().reset_index()
+        return df.groupby(['annais', 'preusuel', 'sexe'], as_index=False)['nombre'].sum()
+
+    # Put the cleaned chunks together, a (year, name, sex) can appear in several chunks -> summed into a running total
+    def reduce_chunks(self, chunks):
+
+        self.clean_df = sum_counts(chunks, ['annais', 'preusuel', 'sexe'], 'nombre')
 
         # the sex is 1 if it is a boy, 2 if it is a girl -> replace by M/F
         self.clean_df['sexe'] = self.clean_df['sexe'].replace(1, 'M')
@@ -227,8 +348,6 @@ class FranceNamesData(NamesData):
 
         #self.sex_handling()
         #self.fill_missing_years()
-        # Check the data
-        self.check_clean_data()
 
 
 class NovergianNamesData(NamesData):
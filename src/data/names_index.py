@@ -0,0 +1,240 @@
+# Description: Dense (name x year) index of the names data. It is built once from a NamesData so that the yearly counts
+# of a name can be read directly, instead of filtering and grouping the whole names table for every name we look at.
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+
+class NameSeriesIndex():
+
+    def __init__(self, names, first_year, counts, observed):
+
+        # names[i] is the name of the row i of the arrays
+        self.names = np.asarray(names, dtype=object)
+        # dictionary encoding of the names -> row
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        # the column j of the arrays is the year first_year + j
+        self.first_year = int(first_year)
+        self.last_year = self.first_year + counts.shape[1] - 1
+        # counts of each name per year (summed over the sexes), missing years are filled with 0
+        self.counts = counts
+        # True if the year appears in the names data for this name (to know which 0 were filled)
+        self.observed = observed
+
+        # the series returned are views on these arrays, they should not be modified
+        self.counts.flags.writeable = False
+        self.observed.flags.writeable = False
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Build the index from a DataFrame with the columns Year, Name and Count
+        :param df: DataFrame : the names data
+        :return: NameSeriesIndex
+        """
+        df = df.dropna(subset=['Name'])
+        codes, names = pd.factorize(df['Name'])
+
+        if len(names) == 0:
+            return cls(names, 0, np.zeros((0, 0), dtype=np.int32), np.zeros((0, 0), dtype=bool))
+
+        years = df['Year'].to_numpy(dtype=np.int64)
+        first_year = years.min()
+        n_years = years.max() - first_year + 1
+
+        # position of each row in the flattened (names, years) array
+        flat = codes.astype(np.int64) * n_years + (years - first_year)
+        # bincount sums the counts of the rows with the same (name, year) -> the sexes are added together
+        counts = np.bincount(flat, weights=df['Count'].to_numpy(dtype=np.float64), minlength=len(names) * n_years)
+        counts = counts.astype(np.int32).reshape(len(names), n_years)
+
+        observed = np.zeros(len(names) * n_years, dtype=bool)
+        observed[flat] = True
+
+        return cls(names, first_year, counts, observed.reshape(len(names), n_years))
+
+    @classmethod
+    def from_names_data(cls, names_data):
+        """
+        Build the index from a NamesData
+        :param names_data: NamesData
+        :return: NameSeriesIndex
+        """
+        return cls.from_frame(names_data())
+
+    def save(self, directory):
+        """
+        Save the arrays of the index in a directory (.npy files), so that other processes can map them with load
+        :param directory: str : existing directory
+        """
+        np.save(os.path.join(directory, 'counts.npy'), self.counts)
+        np.save(os.path.join(directory, 'observed.npy'), self.observed)
+        np.save(os.path.join(directory, 'names.npy'), self.names.astype(str))
+        np.save(os.path.join(directory, 'first_year.npy'), np.array([self.first_year]))
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load an index saved with save
+        :param directory: str : directory of the index
+        :param mmap_mode: str : the counts are memory-mapped by default -> the processes reading the same index share its pages
+        :return: NameSeriesIndex
+        """
+        counts = np.load(os.path.join(directory, 'counts.npy'), mmap_mode=mmap_mode)
+        observed = np.load(os.path.join(directory, 'observed.npy'), mmap_mode=mmap_mode)
+        names = np.load(os.path.join(directory, 'names.npy'))
+        first_year = np.load(os.path.join(directory, 'first_year.npy'))[0]
+        return cls(names, first_year, counts, observed)
+
+    def fingerprint(self):
+        """
+        Hash of the content of the index, to know if results computed from an index are still valid
+        :return: str : hexadecimal digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update('\n'.join(self.names.astype(str)).encode('utf-8'))
+        digest.update(np.int64(self.first_year).tobytes())
+        digest.update(np.ascontiguousarray(self.counts).tobytes())
+        digest.update(np.ascontiguousarray(self.observed).tobytes())
+        return digest.hexdigest()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def years(self):
+        """
+        :return: np.array : the years of the columns of the index
+        """
+        return np.arange(self.first_year, self.last_year + 1)
+
+    def row(self, name):
+        """
+        :return: int : the row of the name in the index, None if the name is not in the index
+        """
+        return self.rows.get(name)
+
+    def series(self, name):
+        """
+        Counts of a name for every year of the index (view, no copy)
+        :param name: str : the name
+        :return: np.array : counts from first_year to last_year, None if the name is not in the index
+        """
+        row = self.row(name)
+        if row is None:
+            return None
+        return self.counts[row]
+
+    def window(self, name, start_year, stop_year):
+        """
+        Counts of a name from start_year to stop_year (included), the years outside of the index are filled with 0
+        :param name: str : the name
+        :param start_year: int : first year of the window
+        :param stop_year: int : last year of the window
+        :return: np.array : the counts (view when the window is inside the index)
+        """
+        row = self.row(name)
+        start = start_year - self.first_year
+        stop = stop_year - self.first_year + 1
+
+        if row is not None and start >= 0 and stop_year <= self.last_year:
+            return self.counts[row, start:stop]
+
+        out = np.zeros(max(stop_year - start_year + 1, 0), dtype=np.int32)
+        if row is not None:
+            lo, hi = max(start, 0), min(stop, self.counts.shape[1])
+            if lo < hi:
+                out[lo - start:hi - start] = self.counts[row, lo:hi]
+        return out
+
+    def rows_of(self, names):
+        """
+        Rows of many names at once
+        :param names: list/Series : the names
+        :return: np.array : the rows, -1 for the names that are not in the index
+        """
+        return pd.Index(self.names).get_indexer(names)
+
+    def window_sums(self, rows, start_years, stop_years):
+        """
+        Sum of the counts and number of observed years in many windows at once (one window per row), using prefix sums
+        over the years: the sum over a window is the difference of two prefix sums
+        :param rows: np.array : rows of the names (-1 for a name that is not in the index)
+        :param start_years: np.array : first year of each window
+        :param stop_years: np.array : last year of each window (included)
+        :return: np.array, np.array : the sums of the counts and the numbers of observed years in the windows
+        """
+        rows = np.asarray(rows)
+        n_years = self.counts.shape[1]
+        sums = np.zeros(len(rows), dtype=np.int64)
+        n_observed = np.zeros(len(rows), dtype=np.int64)
+
+        valid = rows >= 0
+        if not valid.any():
+            return sums, n_observed
+
+        # prefix sums only for the rows we need, with a leading 0 -> prefix[:, j] is the sum of the j first years
+        unique_rows, inverse = np.unique(rows[valid], return_inverse=True)
+        count_prefix = np.zeros((len(unique_rows), n_years + 1), dtype=np.int64)
+        np.cumsum(self.counts[unique_rows], axis=1, out=count_prefix[:, 1:])
+        observed_prefix = np.zeros((len(unique_rows), n_years + 1), dtype=np.int64)
+        np.cumsum(self.observed[unique_rows], axis=1, out=observed_prefix[:, 1:])
+
+        # windows clipped to the years of the index
+        lo = np.clip(np.asarray(start_years, dtype=np.int64)[valid] - self.first_year, 0, n_years)
+        hi = np.clip(np.asarray(stop_years, dtype=np.int64)[valid] - self.first_year + 1, 0, n_years)
+        hi = np.maximum(hi, lo)
+
+        sums[valid] = count_prefix[inverse, hi] - count_prefix[inverse, lo]
+        n_observed[valid] = observed_prefix[inverse, hi] - observed_prefix[inverse, lo]
+        return sums, n_observed
+
+    def first_observed_year(self, name):
+        """
+        :return: int : the first year where the name appears in the names data, None if it never appears
+        """
+        row = self.row(name)
+        if row is None or not self.observed[row].any():
+            return None
+        return self.first_year + int(self.observed[row].argmax())
+
+    def n_observed(self, name, start_year, stop_year):
+        """
+        :return: int : the number of years between start_year and stop_year (included) where the name appears in the names data
+        """
+        row = self.row(name)
+        if row is None:
+            return 0
+        lo = max(start_year - self.first_year, 0)
+        hi = min(stop_year - self.first_year + 1, self.observed.shape[1])
+        return int(self.observed[row, lo:hi].sum()) if lo < hi else 0
+
+    def observed_mean(self, name, start_year, stop_year):
+        """
+        Mean count of a name over the years of the window where it appears in the names data (the filled 0 are not counted)
+        :return: float : the mean, np.nan if the name never appears in the window
+        """
+        n = self.n_observed(name, start_year, stop_year)
+        if n == 0:
+            return np.nan
+        return self.window(name, start_year, stop_year).sum() / n
+
+
+def get_names_index(data, name=None):
+    """
+    Get a NameSeriesIndex from the names data
+    :param data: NameSeriesIndex, NamesData or DataFrame : the names data
+    :param name: str : if given and data is not already an index, only this name is indexed (costs a single scan of the table)
+    :return: NameSeriesIndex : data itself if it is already an index
+    """
+    if isinstance(data, NameSeriesIndex):
+        return data
+
+    df = data if isinstance(data, pd.DataFrame) else data()
+    if name is not None:
+        df = df[df['Name'] == name]
+    return NameSeriesIndex.from_frame(df)
@@ -1,6 +1,7 @@
 import pmdarima as pm
 import pandas as pd
 from src.data.names_data import NamesData
+from src.data.names_index import NameSeriesIndex, get_names_index
 import matplotlib.pyplot as plt
 from prophet import Prophet
 from causalimpact import CausalImpact
@@ -10,49 +11,33 @@ import plotly.graph_objects as go
 
 
 
-def predict_naming_ARIMA(data: NamesData, name: str, stop_year: int, nb_years: int, plot=False) -> pd.DataFrame:
+def predict_naming_ARIMA(data: NamesData | NameSeriesIndex, name: str, stop_year: int, nb_years: int, plot=False) -> pd.DataFrame:
     """
     Predict the evolution of a name's count by year using a SARIMA model.
-    :param data: the name dataset
+    :param data: the name dataset, or its NameSeriesIndex (much faster when called for many names)
     :param name: the name from which we predict the evolution
     :param stop_year: the year of the event, we will predict the evolution from stop_year + 1
     :param nb_years: the number of years we want to predict
     :param plot: if True, displays diagnostic plots
     :return: a dataframe with the predictions (starting from stop_year + 1)
     """
-    input_data = data().copy()
-
-    # Filter for the specified name and aggregate counts if needed
-    name_data = input_data[input_data['Name'] == name]
-    name_data = name_data.groupby(['Year']).sum().reset_index()
-    name_data = name_data.drop(columns=['Name'])
-
-    # Split the dataset at the stop_year
-    train_data = name_data[name_data['Year'] <= stop_year]
-    true_data = name_data[name_data['Year'] >= stop_year]
-    true_data = true_data[true_data['Year'] <= stop_year + nb_years]
+    # Yearly counts of the name (summed over the sexes)
+    index = get_names_index(data, name)
 
     # Check if there is data to train the model (since some odd names might not have enough data)
-    # we want to have more than 10 years of data
-    if len(train_data) < 5:
+    # we want to have more than 5 years of data before the stop year
+    first_year = index.first_observed_year(name)
+    if first_year is None or index.n_observed(name, first_year, stop_year) < 5:
         return None
 
     # An issue is that the data might have some missing years, we need to fill them with 0! -> 1915, 1917, 1918, 1919, 1920 -> 1916 is missing and should be filled with 0
-    # We will create a new dataframe with all the years from the first year to the stop year
-    # Then we will merge the two dataframes and fill the missing values with 0
-    all_years = pd.DataFrame({'Year': range(train_data['Year'].min(), stop_year + 1)})
-    train_data = pd.merge(all_years, train_data, on='Year', how='left').fillna(0)
-    
-    # We do the same for the true data, it can also be completely empty -> we fill it from the stop year to the stop year + nb_years -> it should always have this shape
-    all_years = pd.DataFrame({'Year': range(stop_year, stop_year + nb_years + 1)})
-    true_data = pd.merge(all_years, true_data, on='Year', how='left').fillna(0)
+    # The index already contains the missing years filled with 0, we take the years from the first year of the name to the stop year
+    x_train = np.arange(first_year, stop_year + 1)
+    y_train = index.window(name, first_year, stop_year)
 
-    # Split into x and y as an array
-    x_train = train_data['Year'].values
-    y_train = train_data['Count'].values
-
-    x_true = true_data['Year'].values
-    y_true = true_data['Count'].values
+    # We do the same for the true data, it can also be completely empty -> we fill it from the stop year to the stop year + nb_years -> it should always have this shape
+    x_true = np.arange(stop_year, stop_year + nb_years + 1)
+    y_true = index.window(name, stop_year, stop_year + nb_years)
 
     try:
         # Fit the model
@@ -116,19 +101,18 @@ def predict_naming_ARIMA(data: NamesData, name: str, stop_year: int, nb_years: i
     })
     return prediction
 
-def difference_in_means(names_data: NamesData, name: str, stop_year: int, nb_year: int, progress : np.array):
+def difference_in_means(names_data: NamesData | NameSeriesIndex, name: str, stop_year: int, nb_year: int, progress : np.array):
     """
     Compute the difference in means between the period before and after the stop year.
-    :param names_data: the name dataset
+    :param names_data: the name dataset, or its NameSeriesIndex (much faster when called for many names)
     :param name: the name from which we compute the difference in means
     :param stop_year: the year of the event
     :param nb_year: the number of years to consider before and after the event
     :param progress: an array to store the progress of the computation
     :return: the difference in means or np.inf if the name was invented by a movie
     """
-    # Filter for the specified name and aggregate counts if needed
-    name_data = names_data()[names_data()['Name'] == name]
-    name_data = name_data.groupby(['Year']).sum().reset_index()
+    # Yearly counts of the name (summed over the sexes)
+    index = get_names_index(names_data, name)
 
     progress[0] += 1
     # print the progress
@@ -141,18 +125,13 @@ def difference_in_means(names_data: NamesData, name: str, stop_year: int, nb_yea
     elif progress[0] == progress[1]:
         print("100%")
 
-    # Split the dataset at the stop_year
-    pre_period = name_data[(name_data['Year'] >= stop_year - nb_year) & (name_data['Year'] < stop_year)]
-    post_period = name_data[(name_data['Year'] >= stop_year) & (name_data['Year'] <= stop_year + nb_year)]
-
-    # Compute the difference in means
-    pre_mean = pre_period['Count'].mean()
-    post_mean = post_period['Count'].mean()
+    # Split the dataset at the stop_year and compute the means (over the years where the name appears in the data)
+    pre_mean = index.observed_mean(name, stop_year - nb_year, stop_year - 1)
+    post_mean = index.observed_mean(name, stop_year, stop_year + nb_year)
 
     # If the pre_mean is 0, we check if the name was invented by a movie
     if pre_mean == 0 or np.isnan(pre_mean):
-        two_years_after = name_data[(name_data['Year'] <= stop_year + 2) & (name_data['Year'] >= stop_year)]
-        created = two_years_after['Count'].mean()
+        created = index.observed_mean(name, stop_year, stop_year + 2)
 
         if created >= 0:
             return np.inf
@@ -164,14 +143,65 @@ def difference_in_means(names_data: NamesData, name: str, stop_year: int, nb_yea
     diff = post_mean - pre_mean
     return diff
 
-def predict_naming_prophet(data: NamesData, name: str, stop_year: int, nb_years: int, plot=False) -> pd.DataFrame:
+def batch_difference_in_means(names_data: NamesData | NameSeriesIndex, names, years, nb_year: int) -> np.ndarray:
+    """
+    Vectorized difference_in_means for many (name, year) at once, the means of all the windows are computed in a single pass.
+    :param names_data: the name dataset, or its NameSeriesIndex
+    :param names: the names from which we compute the difference in means (list or Series)
+    :param years: the year of the event for each name (list or Series)
+    :param nb_year: the number of years to consider before and after the event
+    :return: an array with the difference in means of each (name, year), np.inf if the name was invented by a movie
+             and -np.inf if the name disappeared (same rules as difference_in_means)
+    """
+    index = get_names_index(names_data)
+    rows = index.rows_of(names)
+    years = np.asarray(years, dtype=np.int64)
+
+    # Mean over the years where the name appears in the data, nan if it never appears in the window
+    def observed_means(start_years, stop_years):
+        sums, n_observed = index.window_sums(rows, start_years, stop_years)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n_observed > 0, sums / n_observed, np.nan)
+
+    pre_mean = observed_means(years - nb_year, years - 1)
+    post_mean = observed_means(years, years + nb_year)
+    created = observed_means(years, years + 2)
+
+    diff = post_mean - pre_mean
+    # The name disappeared after the event
+    diff[(post_mean == 0) | np.isnan(post_mean)] = -np.inf
+    # If the pre_mean is 0, we check if the name was invented by a movie (checked first in difference_in_means -> overwrites)
+    no_pre = (pre_mean == 0) | np.isnan(pre_mean)
+    diff[no_pre & np.isnan(created)] = -np.inf
+    diff[no_pre & (created >= 0)] = np.inf
+
+    return diff
+
+# Stan backend of the process, loading it (compiled model) is slower than fitting a small series
+_stan_backend = None
+
+
+class _SharedBackendProphet(Prophet):
+    """
+    Prophet model reusing the stan backend of the process instead of loading a new one for every model
+    """
+    def _load_stan_backend(self, stan_backend):
+        global _stan_backend
+        if _stan_backend is None:
+            super()._load_stan_backend(stan_backend)
+            _stan_backend = self.stan_backend
+        self.stan_backend = _stan_backend
+
+
+def predict_naming_prophet(data: NamesData | NameSeriesIndex, name: str, stop_year: int, nb_years: int, plot=False, timeout=None) -> pd.DataFrame:
     """
     Predict the evolution of a name's count by year using Facebook's Prophet model.
-    :param data: the name dataset
+    :param data: the name dataset, or its NameSeriesIndex (much faster when called for many names)
     :param name: the name from which we predict the evolution
     :param stop_year: the year of the event, we will predict the evolution from stop_year + 1
     :param nb_years: the number of years we want to predict
     :param plot: if True, displays diagnostic plots
+    :param timeout: maximum number of seconds for the fit, the Stan process is stopped and a TimeoutError is raised after (optional)
     :return: a dataframe with the predictions (starting from stop_year + 1)
     """
 
@@ -179,21 +209,17 @@ def predict_naming_prophet(data: NamesData, name: str, stop_year: int, nb_years:
     import logging
     logging.getLogger('cmdstanpy').setLevel(logging.ERROR)
 
-    input_data = data().copy()
+    # Yearly counts of the name (summed over the sexes)
+    index = get_names_index(data, name)
+    first_year = index.first_observed_year(name)
+    if first_year is None:
+        raise ValueError(f"{name} is not in the names data")
 
-    # Filter for the specified name and aggregate counts if needed
-    name_data = input_data[input_data['Name'] == name]
-    name_data = name_data.groupby(['Year']).sum().reset_index()
-    name_data = name_data.drop(columns=['Name', 'Sex']) # no need for them
-
-    
-    # Fill missing values in the interval with 0
-    full_years = range(name_data['Year'].min(), stop_year + nb_years + 1)
-    name_data = name_data.set_index('Year').reindex(full_years)
-    name_data = name_data.reset_index().rename(columns={'index': 'Year'})
-    name_data["Count"] = name_data["Count"].fillna(0)
-    # Set the type back to int
-    name_data['Count'] = name_data['Count'].astype(int)
+    # Missing values in the interval are already filled with 0 by the index
+    name_data = pd.DataFrame({
+        'Year': np.arange(first_year, stop_year + nb_years + 1),
+        'Count': index.window(name, first_year, stop_year + nb_years).astype(int)
+    })
 
     # Split the dataset at the stop_year
     train_data = name_data[name_data['Year'] <= stop_year].rename(columns={'Year': 'ds', 'Count': 'y'})
@@ -206,8 +232,11 @@ def predict_naming_prophet(data: NamesData, name: str, stop_year: int, nb_years:
     train_data['ds'] = pd.to_datetime(train_data['ds'], format='%Y')
 
     # Fit the model
-    model = Prophet(interval_width=0.95, changepoint_prior_scale=0.001) # 95% confidence interval
-    model.fit(train_data)
+    model = _SharedBackendProphet(interval_width=0.95, changepoint_prior_scale=0.001) # 95% confidence interval
+    # the timeout is given to the optimization of cmdstanpy: it terminates the Stan process (no orphan process left) and
+    # raises a TimeoutError, from any thread and without signals
+    fit_args = {} if timeout is None else {'timeout': timeout}
+    model.fit(train_data, **fit_args)
 
     prediction = model.make_future_dataframe(periods=nb_years+1, freq='YE')
     forecast = model.predict(prediction)
@@ -318,8 +347,7 @@ def predict_naming_ARIMA_with_plotly(data, movname:str, name: str, stop_year: in
 
     # Filter for the specified name and aggregate counts if needed
     name_data = input_data[input_data['Name'] == name]
-    name_data = name_data.groupby(['Year']).sum().reset_index()
-    name_data = name_data.drop(columns=['Name'])
+    name_data = name_data.groupby(['Year'], as_index=False)['Count'].sum()
 
     # Split the dataset at the stop_year
     train_data = name_data[name_data['Year'] <= stop_year]
@@ -1,6 +1,8 @@
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import matplotlib.pyplot as plt
+from src.data.genre_matrix import GenreMatrix
 
 def clean_valid_names(global_names, names_to_remove=["M", "DOCTOR"]):
     """
@@ -18,21 +20,48 @@ def clean_valid_names(global_names, names_to_remove=["M", "DOCTOR"]):
 
 def process_genres(df, subset_cols=None):
     """
-    Splits and explodes the Genres column for analysis.
+    Encodes the Genres column as a sparse (row x genre) matrix for analysis (the rows are not exploded).
     """
     if subset_cols:
         df = df.drop_duplicates(subset=subset_cols)
-    return df.assign(Genres=df["Genres"].str.split(", ")).explode("Genres")
+    return df, genre_matrix_of(df)
+
+
+def genre_matrix_of(df):
+    """
+    Genres of the rows of df, encoded from its own Genres column (every distinct string is split once).
+    The saved matrix of the clean movies is not used: the analysed files may have been written from another version
+    of the movies (e.g. other parsed genres), the results have to follow the data that is given.
+    """
+    return GenreMatrix.from_strings(df['Genres'])
+
+
+def top_per_genre(genre_sums, genres, selected, top_n):
+    """
+    For each selected genre (in alphabetical order), the top N keys of a (genre x key) sparse matrix of sums.
+    The ties are broken by the order of the keys, as nlargest on a sorted groupby.
+    Returns a list of (genre, key, value).
+    """
+    genre_sums = genre_sums.tocsr()
+    genre_sums.sort_indices()
+    top = []
+    for genre in sorted(set(selected) & set(genres)):
+        row = genres.get_loc(genre)
+        start, stop = genre_sums.indptr[row], genre_sums.indptr[row + 1]
+        keys, values = genre_sums.indices[start:stop], genre_sums.data[start:stop]
+        for position in np.argsort(-values, kind='stable')[:top_n]:
+            top.append((genre, keys[position], values[position]))
+    return top
 
 
 def get_top_10_genres(expanded_imdb_mov_char_data,):
     """
     Determines the top 10 movie genres based on unique movie occurrences.
     """
-    unique_movies_genres = process_genres(expanded_imdb_mov_char_data, subset_cols=["Movie_name"])
+    _, genres = process_genres(expanded_imdb_mov_char_data, subset_cols=["Movie_name"])
     
     # Obtenir les 10 genres principaux
-    top_10_genres = unique_movies_genres["Genres"].value_counts().head(10).index.tolist()
+    top_10_genres = genres.counts().sort_values(ascending=False, kind='stable').head(10).index.tolist()
     print("Top 10 genres:", top_10_genres)
     return top_10_genres
 
@@ -41,8 +70,9 @@ def filter_data_by_top_genres(expanded_imdb_mov_char_data, top_10_genres):
     """
     Filters movie data to include only rows from the top 10 genres.
     """
-    expanded_data_genres = process_genres(expanded_imdb_mov_char_data)
-    return expanded_data_genres[expanded_data_genres["Genres"].isin(top_10_genres)]
+    df, genres = process_genres(expanded_imdb_mov_char_data)
+    # only the rows of the top genres are exploded
+    return genres.explode(df, top_10_genres)
 
 
 def merge_and_analyze_names(filtered_data, valid_names_df):
@@ -88,22 +118,21 @@ def visualize_top_names(top_names_df):
 
 def load(filepath):
     """
-    Load the dataset, clean it, and explode the Genres column.
+    Load the dataset and clean it, the Genres column is encoded as a sparse matrix aligned with the rows.
+    Returns the DataFrame (one row per name and movie) and its GenreMatrix.
     """
     # Load the data
     df = pd.read_csv(filepath)
     
     # Rename the column and drop unnecessary ones
     df = df.rename(columns={"Movie Name": "Movie_name"})
-    df = df.drop(columns=['Influenced', 'Character Name', 'Wikipedia_movie_ID'])
     df = df[df['Genres'] != 'Action/Adventure']
 
-    
-    # Explode Genres
-    df['Genres'] = df['Genres'].str.split(', ')
-    exploded_df = df.explode('Genres')
-    
-    return exploded_df
+    # Genres of the rows
+    genres = genre_matrix_of(df)
+    df = df.drop(columns=['Influenced', 'Character Name', 'Wikipedia_movie_ID'])
+
+    return df, genres
 
 
 
@@ -111,12 +140,12 @@ def load(filepath):
 #####  Based on proportion of influence (count) ######
 
 
-def count_top_genres(df, top_n=10):
+def count_top_genres(genres, top_n=10):
     """
    Determine the top N genres by count
     """
-   # Count occurrences of each genre
-    genre_counts = df['Genres'].value_counts()
+   # Count occurrences of each genre (number of rows of each column of the genre matrix)
+    genre_counts = genres.counts().sort_values(ascending=False, kind='stable')
     
     # Get the top N genres
     top_genres = genre_counts.head(top_n)
@@ -156,71 +185,63 @@ def plot_top_genres(genre_influence, metric):
 
     fig.show()
 
-def find_top_names_for_top_genres(df, top_genres, top_n_names=3):
+def find_top_names_for_top_genres(df, genres, top_genres, top_n_names=3):
     """
     Determine the top N normalized names for each of the top genres.
 
     Parameters:
-        df (DataFrame): The dataset with 'Genres' and 'Normalized_name'.
+        df (DataFrame): The dataset with 'Normalized_name'.
+        genres (GenreMatrix): The genres of the rows of df.
         top_genres (DataFrame): The DataFrame containing top genres with their counts.
         top_n_names (int): Number of top names to retrieve per genre.
 
     Returns:
         DataFrame: Top N names for each genre.
     """
-    # Filter the dataset to include only rows with the top genres
-    filtered_df = df[df['Genres'].isin(top_genres['Genres'])]
-
-    # Group by genre and name, and count occurrences
-    name_counts = (
-        filtered_df.groupby(['Genres', 'Normalized_name'])
-        .size()
-        .reset_index(name='Count')
-    )
+    # Count the occurrences of each (genre, name): product of the genre matrix with the one-hot encoded names
+    codes, names = pd.factorize(df['Normalized_name'], sort=True)
+    name_counts = genres.grouped_sums(codes)
 
     # Find the top N names for each genre
-    top_names = (
-        name_counts.groupby('Genres')
-        .apply(lambda x: x.nlargest(top_n_names, 'Count'))
-        .reset_index(drop=True)
-    )
+    top = top_per_genre(name_counts, genres.genres, top_genres['Genres'], top_n_names)
+    top_names = pd.DataFrame({
+        'Genres': [genre for genre, _, _ in top],
+        'Normalized_name': [names[key] for _, key, _ in top],
+        'Count': np.array([count for _, _, count in top], dtype=np.int64),
+    })
 
     return top_names
 
 
 
-def find_top_names_with_movies(df, top_genres, top_n_names=3):
+def find_top_names_with_movies(df, genres, top_genres, top_n_names=3):
     """
     Determine the top N normalized names for each genre, with a list of movie names.
 
     Parameters:
-        df (DataFrame): The dataset with 'Genres', 'Normalized_name', and 'Movie Name'.
+        df (DataFrame): The dataset with 'Normalized_name', and 'Movie_name'.
+        genres (GenreMatrix): The genres of the rows of df.
         top_genres (DataFrame): The DataFrame containing top genres with their counts.
         top_n_names (int): Number of top names to retrieve per genre.
 
     Returns:
         DataFrame: Top N names for each genre with a list of associated movie names.
     """
-    # Filter the dataset to include only rows with the top genres
-    filtered_df = df[df['Genres'].isin(top_genres['Genres'])]
-
-    # Group by genre and normalized name, aggregating movie names into a list
-    grouped = (
-        filtered_df.groupby(['Genres', 'Normalized_name', 'Movie_name'])
-        .agg(
-            Count=('Normalized_name', 'size'),
-            Movie_Names=('Movie_name', lambda x: list(x.unique()))
-        )
-        .reset_index()
-    )
-
+    # Count the occurrences of each (genre, name, movie): the (name, movie) pairs are numbered in sorted order
+    grouped = df.groupby(['Normalized_name', 'Movie_name'])
+    keys = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    pairs = grouped.size().index
+    pair_counts = genres.grouped_sums(keys)
 
     # Find the top N names for each genre
-    top_names = (
-        grouped.groupby('Genres')
-        .apply(lambda x: x.nlargest(top_n_names, 'Count'))
-        .reset_index(drop=True)
-    )
+    top = top_per_genre(pair_counts, genres.genres, top_genres['Genres'], top_n_names)
+    top_names = pd.DataFrame({
+        'Genres': [genre for genre, _, _ in top],
+        'Normalized_name': [pairs[key][0] for _, key, _ in top],
+        'Movie_name': [pairs[key][1] for _, key, _ in top],
+        'Count': np.array([count for _, _, count in top], dtype=np.int64),
+        'Movie_Names': [[pairs[key][1]] for _, key, _ in top],
+    })
 
     return top_names
 
@@ -255,19 +276,19 @@ def plot_treemap_with_movies(top_names_by_genre):
 
 
 
-def proportion_of_influence(df, top_n=10):
+def proportion_of_influence(genres, top_n=10):
     """
     Determine the proportion of influence for the top N genres
     """
     # Count occurrences of each genre
-    genre_counts = df['Genres'].value_counts()
+    genre_counts = genres.counts().sort_values(ascending=False, kind='stable')
     
     # Get the top N genres
     top_genres = genre_counts.head(top_n)
     print(top_genres)
 
-    # Calculate the total number of names
-    total_names = len(df)
+    # Calculate the total number of names (one per genre of each row, the rows without genre are counted once)
+    total_names = int(np.maximum(genres.matrix.getnnz(axis=1), 1).sum())
     print(total_names)
 
     # Calculate the proportion of influence for each genre in percentage
@@ -290,16 +311,18 @@ def proportion_of_influence(df, top_n=10):
 
 
 
-def get_top_genre_influence(df, top_n=10):
+def get_top_genre_influence(df, genres, top_n=10):
     """
     Group data by genres and calculate the total mean difference (influence score).
     Returns the top N influential genres.
     """
-    df = df[df['Genres'] != 'Action/Adventure']
+    genres = genres.drop(['Action/Adventure'])
 
+    # Sum of the Mean Difference of the rows of each genre (product of the genre matrix with the column)
     genre_influence = (
-        df.groupby('Genres')['Mean Difference']
-        .sum()
+        genres.sums(df['Mean Difference'])
+        .rename('Mean Difference')
+        .sort_index()
         .reset_index()
         .sort_values(by='Mean Difference', ascending=False)
     )
@@ -319,29 +342,17 @@ def plot_top_genres(genre_influence, metric):
     plt.tight_layout()
     plt.show()
 
-def get_top_names_by_genre(exploded):
+def get_top_names_by_genre(df, genres):
     """
     For each of the top genres, find the top 3 names with the highest Mean Difference.
     """
-    exploded = exploded[exploded['Genres'] != 'Action/Adventure']
+    top_10_genres = get_top_genre_influence(df, genres, top_n=10)['Genres']
 
-    top_10_genres = (
-        exploded.groupby('Genres')['Mean Difference']
-        .sum()
-        .reset_index()
-        .sort_values(by='Mean Difference', ascending=False)
-        .head(10)['Genres']
-    )
-
-
-    # Step 2: Filter the data to include only the top 10 genres
-    filtered_df = exploded[exploded['Genres'].isin(top_10_genres)]
-
-    # Step 3: For each genre, find the top 3 names with the biggest Mean Difference
-    top_names_by_genre = (
-        filtered_df.groupby('Genres', group_keys=False)
-        .apply(lambda x: x.nlargest(3, 'Mean Difference'))
-    )
+    # For each genre (alphabetical order), find the top 3 names with the biggest Mean Difference among its rows
+    top_names_by_genre = pd.concat([
+        df.iloc[genres.rows_of_genre(genre)].nlargest(3, 'Mean Difference').assign(Genres=genre)
+        for genre in sorted(top_10_genres)
+    ])
     return top_names_by_genre
 
 
@@ -13,9 +13,9 @@ def trend_eval_ranking(df_babies, df_movies):
     # Ditching entries with nan revenue 
     df_movies = df_movies.dropna(subset=['Revenue'])
     # Taking only the first name of the character name
-    df_movies.loc[:, 'Character_name'] = df_movies['Character_name'].str.split().str[0]
+    df_movies['Character_name'] = df_movies['Character_name'].str.split().str[0]
     # Putting every character name in upper case
-    df_movies.loc[:, 'Character_name'] = df_movies['Character_name'].str.upper()
+    df_movies['Character_name'] = df_movies['Character_name'].str.upper()
 
     # Taking only characters of the top 100 characters by revenue every year
     df_movies = (df_movies[df_movies["totalVotes"] >= 100000]
@@ -44,7 +44,7 @@ def trend_eval_ranking(df_babies, df_movies):
 
 
     # Apply the function to each character name
-    groupedByName =  merged_df.groupby('Character_name')
+    groupedByName =  merged_df.groupby('Character_name', observed=True)
     trend_df = groupedByName.apply(analyze_trend).reset_index()
     ranking = trend_df.sort_values('trend_increase', ascending=False)
     return ranking
@@ -1,6 +1,10 @@
 # Some statistics come in two separate files depending on the sex of the babies. We need to merge them into a single file.
 import pandas as pd
-from unidecode import unidecode # To remove accents in the names -> utf-8 encoding
+import sys, os
+
+# The script is launched directly, the root directory is needed to import src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from src.utils.general_utils import transliterate # To remove accents in the names -> utf-8 encoding
 
 
 # Function to do the merging into one file, given the two files (male, female) and the output file paths
@@ -17,7 +21,7 @@ def merge_sex_norway(male, female, output, encoding='utf-8'):
     all_data = pd.concat([males, females])
 
     # Remove accents from the names
-    all_data['first name'] = all_data['first name'].apply(lambda x: unidecode(x))
+    all_data['first name'] = transliterate(all_data['first name'])
 
     # Save the result
     all_data.to_csv(output, index=False, encoding="utf-8")
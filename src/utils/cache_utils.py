@@ -0,0 +1,236 @@
+# Description: This file contains the functions used to skip the pipeline steps whose inputs did not change.
+# Every output has a manifest next to it (<output>.manifest.json) containing the fingerprint of what it was computed from:
+# the bytes of the input files, the code of the cleaning/computing modules and the parameters.
+# It also contains the checkpoint store of the long computations (influence of the movies on the names), to resume them.
+
+import hashlib
+import importlib
+import json
+import os
+
+import pandas as pd
+
+BLOCK_SIZE = 1 << 20
+
+
+def hash_file(path):
+    """
+    Hash the bytes of a file
+    :param path: str : path of the file
+    :return: str : hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_object(obj):
+    """
+    Hash a json serializable object (dict of parameters, list of fingerprints, ...)
+    :param obj: object to hash, non serializable values are converted to str
+    :return: str : hexadecimal digest
+    """
+    dumped = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.blake2b(dumped.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def hash_frame(df):
+    """
+    Hash the content of a DataFrame (values, column names and dtypes, not the index), vectorized with pandas:
+    the categorical columns only hash their categories once
+    :param df: DataFrame
+    :return: str : hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(hash_object([list(map(str, df.columns)), list(map(str, df.dtypes))]).encode('utf-8'))
+    for column in df.columns:
+        digest.update(pd.util.hash_pandas_object(df[column], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def hash_modules(modules):
+    """
+    Hash the source files of some modules, so that a change in the code invalidates the outputs computed with it
+    :param modules: list of modules (or module names)
+    :return: str : hexadecimal digest
+    """
+    hashes = []
+    for module in modules:
+        if isinstance(module, str):
+            module = importlib.import_module(module)
+        hashes.append(hash_file(module.__file__))
+    return hash_object(hashes)
+
+
+def hash_class_code(cls):
+    """
+    Hash the code of a class and of its parents defined in this project (src.*), and of the modules of the helpers
+    they call (code_dependencies attribute of the class and of its parents, list of module names)
+    :param cls: class
+    :return: str : hexadecimal digest
+    """
+    modules = [c.__module__ for c in cls.__mro__ if c.__module__.startswith('src.')]
+    modules += [module for c in cls.__mro__ for module in getattr(c, 'code_dependencies', [])]
+    # remove duplicates but keep the order
+    return hash_object([cls.__qualname__, hash_modules(list(dict.fromkeys(modules)))])
+
+
+def manifest_path(output_path):
+    """
+    Path of the manifest of an output file
+    """
+    return f'{output_path}.manifest.json'
+
+
+def is_up_to_date(output_path, fingerprint):
+    """
+    Check if an output was computed from the inputs described by the fingerprint
+    :param output_path: str : path of the output
+    :param fingerprint: str : fingerprint of the current inputs
+    :return: bool : True if the output exists and its manifest has the same fingerprint
+    """
+    if not (os.path.exists(output_path) and os.path.exists(manifest_path(output_path))):
+        return False
+
+    with open(manifest_path(output_path), encoding='utf-8') as file:
+        try:
+            manifest = json.load(file)
+        except json.JSONDecodeError:
+            return False
+
+    return manifest.get('fingerprint') == fingerprint
+
+
+def write_manifest(output_path, fingerprint, inputs=None):
+    """
+    Write the manifest of an output, to be called once the output has been written
+    :param output_path: str : path of the output
+    :param fingerprint: str : fingerprint of the inputs
+    :param inputs: dict : description of the inputs, only kept for information (optional)
+    """
+    with open(manifest_path(output_path), 'w', encoding='utf-8') as file:
+        json.dump({'fingerprint': fingerprint, 'inputs': inputs}, file, indent=2, sort_keys=True, default=str)
+
+
+class CheckpointStore():
+    """
+    Append-only store of the results of a long computation, keyed by (Normalized_name, Year, method, params hash).
+    The results are appended to a csv file every flush_every results, so that a crashed or interrupted computation can
+    be resumed: the keys already in the store are not computed again. The failed results (is_failure) are only kept for
+    the current run, they are not written in the file so that they are computed again when the computation is resumed.
+    """
+
+    COLUMNS = ['Normalized_name', 'Year', 'method', 'params_hash', 'result']
+
+    def __init__(self, path, method, params=None, flush_every=100, is_failure=None):
+        """
+        :param path: str : path of the csv file of the store
+        :param method: str : name of the computation (sarima, prophet, ...)
+        :param params: dict : parameters of the computation, the results computed with other parameters are ignored
+        :param flush_every: int : number of results kept in memory before being appended to the file
+        :param is_failure: function result -> bool : True for the results of a failed computation (optional)
+        """
+        self.path = path
+        self.method = method
+        self.params_hash = hash_object(params)
+        self.flush_every = flush_every
+        self.is_failure = is_failure
+        self.results = {}
+        self.failures = {}
+        self.pending = []
+        self.load()
+
+    def load(self):
+        """
+        Load the results of this method and parameters from the file
+        """
+        self.results = {}
+        if not os.path.exists(self.path):
+            return
+
+        # keep_default_na=False -> names such as "NA" are not read as missing values
+        df = pd.read_csv(self.path, dtype={'Normalized_name': str, 'method': str, 'params_hash': str},
+                         keep_default_na=False, na_values={'result': ['', 'nan', 'NaN']})
+        df = df[(df['method'] == self.method) & (df['params_hash'] == self.params_hash)]
+        # the last result of a key is the most recent one
+        for name, year, result in zip(df['Normalized_name'], df['Year'], df['result']):
+            self.results[(name, int(year))] = result
+
+        print(f"{self.path} : {len(self.results)} results of {self.method} loaded from the checkpoint")
+
+    def __contains__(self, key):
+        name, year = key
+        return (name, int(year)) in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def add(self, name, year, result):
+        """
+        Add a result, the file is written every flush_every results
+        """
+        if self.is_failure is not None and self.is_failure(result):
+            self.failures[(name, int(year))] = result
+            return
+
+        self.failures.pop((name, int(year)), None)
+        self.results[(name, int(year))] = result
+        self.pending.append((name, int(year), self.method, self.params_hash, result))
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the pending results to the file
+        """
+        if not self.pending:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        write_header = not os.path.exists(self.path)
+        with open(self.path, 'a', encoding='utf-8', newline='') as file:
+            pd.DataFrame(self.pending, columns=self.COLUMNS).to_csv(file, header=write_header, index=False)
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending = []
+
+    def missing(self, names, years):
+        """
+        :param names: list/Series : the names
+        :param years: list/Series : the year of each name
+        :return: list, list : the names and years that are not in the store yet or failed (without duplicates)
+        """
+        keys = [(name, int(year)) for name, year in zip(names, years)]
+        keys = [key for key in dict.fromkeys(keys) if key not in self.results]
+        return [name for name, _ in keys], [year for _, year in keys]
+
+    def get_results(self, names, years):
+        """
+        :param names: list/Series : the names
+        :param years: list/Series : the year of each name
+        :return: list : the result of each (name, year), all of them must be in the store or have failed in this run
+        """
+        keys = [(name, int(year)) for name, year in zip(names, years)]
+        return [self.results[key] if key in self.results else self.failures[key] for key in keys]
+
+    def clear(self):
+        """
+        Remove the file and the results of the store
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.results = {}
+        self.failures = {}
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the results computed before a crash or an interruption are kept
+        self.flush()
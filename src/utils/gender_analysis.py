@@ -2,6 +2,7 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from src.models.trend_by_gender import *
+from src.data.genre_matrix import GenreMatrix
 
 def plot_gender_proportion():
     """
@@ -52,29 +53,24 @@ def plot_genre_gender_influence():
     # Drop rows where 'Genres' is NaN
     df = df.dropna(subset=['Genres'])
 
-    # If a movie can belong to multiple genres, split them
-    df['Genres'] = df['Genres'].str.split(',')
+    # A movie can belong to multiple genres: they are encoded as a sparse (row x genre) matrix (no explode)
+    genres = GenreMatrix.from_strings(df['Genres'], separator=',')
 
-    # Explode the genres so each genre has its own row
-    df_exploded = df.explode('Genres')
-
-    # Clean whitespace in genres
-    df_exploded['Genres'] = df_exploded['Genres'].str.strip()
-
-    # Group by 'Genres' and 'Gender' and sum the 'Count'
-    genre_gender_trend = df_exploded.groupby(['Genres', 'Gender'])['Count'].sum().reset_index()
+    # Sum the 'Count' by 'Genres' and 'Gender': product of the genre matrix with the one-hot encoded genders
+    gender_codes, genders_found = pd.factorize(df['Gender'], sort=True)
+    genre_gender_trend = pd.DataFrame(genres.grouped_sums(gender_codes, df['Count']).toarray(),
+                                      index=genres.genres, columns=pd.Index(genders_found, name='Gender'))
+    # only the genres of rows with a gender
+    genre_gender_trend = genre_gender_trend[genres.grouped_sums(gender_codes).getnnz(axis=1) > 0].sort_index()
 
     # Calculate total influence per genre
-    top_genres_total = genre_gender_trend.groupby('Genres')['Count'].sum().reset_index()
+    top_genres_total = genre_gender_trend.sum(axis=1).rename('Count').reset_index()
 
     # Sort genres by total influence in descending order and select top 10
     top_genres = top_genres_total.sort_values(by='Count', ascending=False).head(10)
 
-    # Filter the original genre_gender_trend for top genres
-    genre_gender_trend_top = genre_gender_trend[genre_gender_trend['Genres'].isin(top_genres['Genres'])]
-
-    # Pivot the table to have genders as separate columns
-    genre_pivot = genre_gender_trend_top.pivot(index='Genres', columns='Gender', values='Count').fillna(0)
+    # Keep the top genres, with genders as separate columns
+    genre_pivot = genre_gender_trend.loc[genre_gender_trend.index.isin(top_genres['Genres'])]
 
     # Calculate total influenced names per genre
     genre_pivot['Total'] = genre_pivot.sum(axis=1)
@@ -0,0 +1,29 @@
+# Description: This file contains general utils functions used by the data classes and the other utils.
+
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from unidecode import unidecode
+
+
+@lru_cache(maxsize=1 << 20)
+def transliterate_value(value):
+    """
+    Function to remove the accents of a string (unidecode), the results are cached
+    :param value: str : the string
+    :return: str : the ASCII transliteration
+    """
+    return unidecode(value)
+
+
+def transliterate(column):
+    """
+    Function to remove the accents of a column of strings, every distinct value is transliterated only once
+    (a names column has a few distinct names for millions of rows)
+    :param column: Series : the strings
+    :return: Series : the transliterated strings (copy, same index), the missing values stay missing
+    """
+    codes, uniques = pd.factorize(column)
+    transliterated = np.array([transliterate_value(value) for value in uniques] + [np.nan], dtype=object)
+    # the code -1 (missing value) takes the last element -> nan
+    return pd.Series(transliterated.take(codes), index=column.index, name=column.name)
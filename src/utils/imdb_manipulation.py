@@ -1,21 +1,67 @@
+import os
+import numpy as np
 import pandas as pd
 
-def get_movie_votes(datapath):
+import src.utils.cache_utils as cache_utils
+
+# Columns read from the IMDb dumps and their types, the other columns (genres, runtime, ...) are never loaded
+IMDB_BASICS_DTYPES = {'tconst': str, 'titleType': 'category', 'primaryTitle': str, 'originalTitle': str, 'startYear': str}
+IMDB_RATINGS_DTYPES = {'tconst': str, 'averageRating': 'float64', 'numVotes': 'int64'}
+# IMDb writes the missing values as \N
+IMDB_NA_VALUES = ['\\N']
+# Number of rows of title.basics.tsv read at once, only the movies of each chunk are kept
+IMDB_CHUNKSIZE = 500_000
+# IMDb dumps the movies and ratings are read from
+IMDB_FILES = ['title.basics.tsv', 'title.ratings.tsv']
+
+
+def hash_imdb_dumps(datapath):
     """
-    Function to get the votes of the movies
-    :param datapath: str
-    :return: DataFrame
+    Hash the IMDb dumps, to be computed once per run and given to the functions reading them
+    :param datapath: str : directory of the IMDb dumps
+    :return: dict : the hash of each file of IMDB_FILES
     """
+    return {file: cache_utils.hash_file(f'{datapath}/{file}') for file in IMDB_FILES}
 
-    # Reading title basics
-    title_basics = pd.read_csv(f'{datapath}/title.basics.tsv', sep='\t', low_memory=False)
 
-    # Keeping only movies
-    title_basics = title_basics[title_basics['titleType'] == 'movie']
+def read_imdb_movies(datapath, chunksize=IMDB_CHUNKSIZE):
+    """
+    Function to read the movies of title.basics.tsv, the file is streamed by chunks and only the needed columns are read
+    :param datapath: str : directory of the IMDb dumps
+    :param chunksize: int : number of rows read at once
+    :return: DataFrame : tconst, primaryTitle, originalTitle and startYear of the movies
+    """
+    chunks = pd.read_csv(f'{datapath}/title.basics.tsv', sep='\t', usecols=list(IMDB_BASICS_DTYPES), dtype=IMDB_BASICS_DTYPES,
+                         na_values=IMDB_NA_VALUES, chunksize=chunksize)
+    movies = [chunk.loc[chunk['titleType'] == 'movie'].drop(columns='titleType') for chunk in chunks]
+    return pd.concat(movies, ignore_index=True)
+
+
+def read_imdb_movies_ratings(datapath, cache_path=None, dump_hashes=None):
+    """
+    Function to read the movies of IMDb joined with their ratings
+    :param datapath: str : directory of the IMDb dumps
+    :param cache_path: str : parquet file where the joined movies are cached, it is reused while the dumps do not change (optional)
+    :param dump_hashes: dict : hashes of the dumps (hash_imdb_dumps) if they were already computed, otherwise they are computed here
+    :return: DataFrame : primaryTitle, originalTitle, numVotes, averageRating and startYear of the movies with a rating
+    """
+    if cache_path is not None:
+        dump_hashes = dump_hashes if dump_hashes is not None else hash_imdb_dumps(datapath)
+        fingerprint = cache_utils.hash_object({
+            'files': [dump_hashes[file] for file in IMDB_FILES],
+            'dtypes': [IMDB_BASICS_DTYPES, IMDB_RATINGS_DTYPES, IMDB_NA_VALUES]
+        })
+        if cache_utils.is_up_to_date(cache_path, fingerprint):
+            print(f"{cache_path} : IMDb dumps unchanged, loading the movies and ratings from the cache")
+            return pd.read_parquet(cache_path)
+
+    # Reading title basics, keeping only movies
+    title_basics = read_imdb_movies(datapath)
     print(f"There are {len(title_basics)} movies in the IMDB basic dataset.")
     
     # Reading title ratings
-    title_ratings = pd.read_csv(f'{datapath}/title.ratings.tsv', sep='\t', low_memory=False)
+    title_ratings = pd.read_csv(f'{datapath}/title.ratings.tsv', sep='\t', usecols=list(IMDB_RATINGS_DTYPES), dtype=IMDB_RATINGS_DTYPES,
+                                na_values=IMDB_NA_VALUES)
     print(f"There are {len(title_ratings)} movies in the IMDB ratings dataset.")
 
     # Merging the two dataframes on the tconst column (movie identifier)
@@ -24,15 +70,36 @@ def get_movie_votes(datapath):
     # Keeping only the columns we need
     title_basics_ratings = title_basics_ratings[['primaryTitle', 'originalTitle', 'numVotes', 'averageRating', 'startYear']] 
 
-    # drop na values
-    title_basics_ratings = title_basics_ratings.dropna()
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+        title_basics_ratings.to_parquet(cache_path, index=False)
+        cache_utils.write_manifest(cache_path, fingerprint, {'datapath': datapath})
+
+    return title_basics_ratings
+
+
+def get_movie_votes(datapath, cache_path=None, dump_hashes=None):
+    """
+    Function to get the votes of the movies
+    :param datapath: str
+    :param cache_path: str : parquet file where the movies joined with their ratings are cached (optional)
+    :param dump_hashes: dict : hashes of the dumps if they were already computed (see read_imdb_movies_ratings)
+    :return: DataFrame
+    """
+    title_basics_ratings = read_imdb_movies_ratings(datapath, cache_path, dump_hashes)
+
+    # drop na values, a missing startYear or originalTitle (\N) is kept like before (the release date of CMU is used instead)
+    title_basics_ratings = title_basics_ratings.dropna(subset=['primaryTitle', 'numVotes', 'averageRating'])
     print(f"There are {len(title_basics_ratings)} movies in the title-basic merged dataset before treating duplicates.")
     
     # Aggregation of ratings and basics so that there is no duplicates due to different countries origins of votes for movies
-    aggregated_imdb = title_basics_ratings.groupby(['primaryTitle', 'startYear']).apply(lambda group: pd.Series({
-        'weightedAverageRating': round((group['numVotes'] * group['averageRating']).sum() / group['numVotes'].sum(), 2),
-        'totalVotes': group['numVotes'].sum()})
-        ).reset_index()
+    # weighted average = sum(numVotes * averageRating) / sum(numVotes), computed with grouped sums
+    title_basics_ratings['weightedVotes'] = title_basics_ratings['numVotes'] * title_basics_ratings['averageRating']
+    aggregated_imdb = title_basics_ratings.groupby(['primaryTitle', 'startYear'], dropna=False)[['weightedVotes', 'numVotes']].sum()
+    aggregated_imdb['weightedAverageRating'] = (aggregated_imdb['weightedVotes'] / aggregated_imdb['numVotes']).round(2)
+    # float like the previous aggregation
+    aggregated_imdb['totalVotes'] = aggregated_imdb['numVotes'].astype(float)
+    aggregated_imdb = aggregated_imdb[['weightedAverageRating', 'totalVotes']].reset_index()
 
 
     # adding a column to weighted average rating and total votes
@@ -44,37 +111,182 @@ def is_blockbuster(row, votes_threshold=1000000, rating_threshold=8.0):
     """
     Determines if a movie is a blockbuster based on total votes and weighted average rating.
 
-    :param row: A row of the DataFrame
+    :param row: A row of the DataFrame, or the whole DataFrame
     :param votes_threshold: The minimum number of votes to qualify as a blockbuster
     :param rating_threshold: The minimum average rating to qualify as a blockbuster
-    :return: Boolean (True if blockbuster, False otherwise)
+    :return: Boolean (True if blockbuster, False otherwise), a boolean Series for a DataFrame
     """
-    return row['totalVotes'] > votes_threshold and row['weightedAverageRating'] >= rating_threshold
+    return (row['totalVotes'] > votes_threshold) & (row['weightedAverageRating'] >= rating_threshold)
 
 
-def get_all_blockbusters(datapath, votes_threshold=300000, rating_threshold=7.5):
+def get_all_blockbusters(datapath, votes_threshold=300000, rating_threshold=7.5, cache_path=None, dump_hashes=None):
     """
     Function to get all the blockbusters from IMDB data
     :param datapath: str
+    :param cache_path: str : parquet file where the movies joined with their ratings are cached (optional)
+    :param dump_hashes: dict : hashes of the dumps if they were already computed (see read_imdb_movies_ratings)
     :return: DataFrame
     """
 
-    imdb_df = get_movie_votes(datapath)
+    imdb_df = get_movie_votes(datapath, cache_path, dump_hashes)
     # keeping only rows wher is_blockbuster is True
-    imdb_df['is_blockbuster'] = imdb_df.apply(is_blockbuster, args=(votes_threshold, rating_threshold), axis=1)
+    imdb_df['is_blockbuster'] = is_blockbuster(imdb_df, votes_threshold, rating_threshold)
     return imdb_df.sort_values(by='weightedAverageRating', ascending=False)
 
     
 
-def merge_imdb_and_dataset(imdb_df, cmu_df):
+def length_band(length, threshold):
+    """
+    Lengths of the strings that can have a fuzz.ratio >= threshold with a string of the given length.
+    fuzz.ratio = 100 * (1 - indel_distance / (len1 + len2)) and the indel distance is at least |len1 - len2|,
+    so the lengths must verify |len1 - len2| / (len1 + len2) <= 1 - threshold / 100
+    :param length: int : length of the string
+    :param threshold: float : the fuzz.ratio threshold (0-100)
+    :return: (float, float) : the minimum and maximum lengths (included)
+    """
+    ratio = 1 - threshold / 100
+    return length * (1 - ratio) / (1 + ratio), length * (1 + ratio) / (1 - ratio) if ratio < 1 else np.inf
+
+
+def match_titles(queries, choices, threshold=90, max_cells=10_000_000):
+    """
+    Find the best match (fuzz.ratio) of each query in the choices, only the matches with a score >= threshold are kept.
+    Same result as process.extractOne(query, choices, scorer=fuzz.ratio) for each query, but the scores are computed in bulk
+    (rapidfuzz.process.cdist on all the cores) and only against the choices with a compatible length (see length_band).
+    :param queries: list of str : the titles to match
+    :param choices: list of str : the candidate titles, the first one is kept when several have the best score
+    :param threshold: float : minimum score of a match (0-100)
+    :param max_cells: int : maximum size of a block of scores computed at once (memory)
+    :return: DataFrame : with the columns query, match and score, one row per matched query (in the order of the queries)
+    """
+    from rapidfuzz import process, fuzz
+
+    queries = pd.Series(pd.unique(pd.Series(queries, dtype=object)), dtype=object)
+    # The choices are kept in their order (extractOne keeps the first best choice)
+    choices = np.asarray(pd.unique(pd.Series(choices, dtype=object)), dtype=object)
+    choice_lengths = np.fromiter((len(choice) for choice in choices), dtype=np.int64, count=len(choices))
+
+    matches = []
+    # Block the queries by length, each block is only compared to the choices with a compatible length
+    for length, block in queries.groupby(queries.str.len(), sort=False):
+        low, high = length_band(length, threshold)
+        # small margin for the floating point errors, the scorer decides anyway
+        candidates = np.flatnonzero((choice_lengths >= low - 1e-9) & (choice_lengths <= high + 1e-9))
+        if len(candidates) == 0:
+            continue
+
+        positions, block = block.index.to_numpy(), block.to_list()
+        rows_per_step = max(1, max_cells // len(candidates))
+        for start in range(0, len(block), rows_per_step):
+            rows = block[start:start + rows_per_step]
+            # the scores < threshold are set to 0, in float64 as the scores of extractOne (float32 rounds them)
+            scores = process.cdist(rows, choices[candidates], scorer=fuzz.ratio, score_cutoff=threshold, dtype=np.float64, workers=-1)
+            best = scores.argmax(axis=1)
+            best_scores = scores[np.arange(len(rows)), best]
+            found = best_scores >= threshold
+            matches.append(pd.DataFrame({
+                'position': positions[start:start + rows_per_step][found],
+                'query': np.asarray(rows, dtype=object)[found],
+                'match': choices[candidates[best[found]]],
+                'score': best_scores[found]
+            }))
+
+    if not matches:
+        return pd.DataFrame(columns=['query', 'match', 'score'])
+    # Same order as the queries
+    matches = pd.concat(matches).sort_values('position')
+    return matches.drop(columns='position').reset_index(drop=True)
+
+
+def scorer_version(threshold):
+    """
+    Version of the title matching, the cached matches computed with another version are not reused
+    :param threshold: float : the fuzz.ratio threshold
+    :return: str
+    """
+    import rapidfuzz
+    return f"rapidfuzz-{rapidfuzz.__version__}-ratio-{threshold}"
+
+
+def choices_cache_path(cache_path):
+    """
+    Path of the list of IMDb titles the cached matches were computed against
+    """
+    return os.path.splitext(cache_path)[0] + "_imdb_titles.parquet"
+
+
+def match_titles_cached(queries, choices, cache_path, threshold=90):
+    """
+    Same as match_titles, but the match decisions are stored in a table (cache_path) and reused by the next calls: only
+    the new queries are matched against all the choices, the cached queries are only matched against the new choices
+    (and again against all the choices if their match is not a choice anymore).
+    When a new choice has the same score as the cached match, the cached match is kept.
+    The decisions of the titles that are not queried are kept in the table (updated with the new choices, or removed
+    if their match is not a choice anymore), so that the runs on different titles do not evict each other.
+    :param queries: list of str : the titles to match (CMU)
+    :param choices: list of str : the candidate titles (IMDb)
+    :param cache_path: str : path of the parquet table of the matches
+    :param threshold: float : minimum score of a match (0-100)
+    :return: DataFrame : with the columns query, match and score, one row per matched query (in the order of the queries)
+    """
+    version = scorer_version(threshold)
+    queries = pd.unique(pd.Series(queries, dtype=object))
+    choices = pd.unique(pd.Series(choices, dtype=object))
+
+    # Table of the decisions: one row per CMU title, imdb_title is missing if there was no match
+    cache = pd.DataFrame(columns=["cmu_title", "imdb_title", "score", "scorer_version"])
+    seen_choices = set()
+    if os.path.exists(cache_path) and os.path.exists(choices_cache_path(cache_path)):
+        cache = pd.read_parquet(cache_path)
+        cache = cache[cache["scorer_version"] == version]
+        seen_choices = set(pd.read_parquet(choices_cache_path(cache_path))["imdb_title"])
+    cache = cache.set_index("cmu_title")
+
+    choices_set = set(choices)
+    new_choices = [choice for choice in choices if choice not in seen_choices]
+
+    # The cached queries whose match was removed from the choices are matched again against all of them, the other
+    # cached titles whose match was removed are dropped from the table
+    removed = (cache["imdb_title"].notna() & ~cache["imdb_title"].isin(choices_set)).to_numpy()
+    queried = cache.index.isin(queries)
+    to_match = [query for query in queries if query not in cache.index] + cache.index[removed & queried].to_list()
+    to_update = cache.index[~removed].to_list()
+    print(f"Title matches: {len(to_match)} titles to match, {len(to_update)} cached titles to compare with {len(new_choices)} new IMDb titles")
+
+    decisions = cache.loc[to_update, ["imdb_title", "score"]]
+
+    # Cached decisions: only the new choices can give a better match
+    if len(to_update) and len(new_choices):
+        updates = match_titles(to_update, new_choices, threshold=threshold).set_index("query")
+        better = updates.index[updates["score"].to_numpy() > decisions.loc[updates.index, "score"].fillna(-1).to_numpy()]
+        decisions.loc[better, ["imdb_title", "score"]] = updates.loc[better, ["match", "score"]].to_numpy()
+
+    # New decisions, the queries without a match are also stored so that they are not matched again
+    new_matches = match_titles(to_match, choices, threshold=threshold).set_index("query")
+    new_decisions = pd.DataFrame({"imdb_title": new_matches["match"], "score": new_matches["score"]}, index=pd.Index(to_match, dtype=object))
+    frames = [frame for frame in (decisions, new_decisions) if len(frame)]
+    decisions = pd.concat(frames) if frames else new_decisions
+    decisions.index.name = "cmu_title"
+
+    # Write the table and the titles it was computed against (the decisions are only valid for these titles)
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    decisions.assign(scorer_version=version).reset_index().to_parquet(cache_path, index=False)
+    pd.DataFrame({"imdb_title": choices}).to_parquet(choices_cache_path(cache_path), index=False)
+
+    # Matches of the queries, in the order of the queries
+    decisions = decisions.loc[queries].dropna(subset=["imdb_title"])
+    return pd.DataFrame({"query": decisions.index.to_numpy(), "match": decisions["imdb_title"].to_numpy(),
+                         "score": decisions["score"].to_numpy(dtype=np.float64)})
+
+
+def merge_imdb_and_dataset(imdb_df, cmu_df, match_cache_path=None):
     """
     Function to merge the IMDb data with the CMU dataset.
     :param imdb_df: DataFrame
     :param cmu_df: DataFrame
+    :param match_cache_path: str : path of the table of the title matches, reused between the runs (optional)
     :return: DataFrame
     """
-    from rapidfuzz import process, fuzz
-
     # Threshold for similarity
     similarity_threshold = 90  # RapidFuzz scores are 0-100
 
@@ -91,21 +303,18 @@ def merge_imdb_and_dataset(imdb_df, cmu_df):
     unmatched_imdb = merged_df[merged_df["_merge"] == "right_only"]["Movie_name"].dropna().to_list()
     
     print("Similarity-based matching...")
-    # Perform similarity-based matching
-    matched_rows = []
-    for cmu_title in unmatched_cmu:
-        # Find the best match for each CMU title in the unmatched IMDb titles
-        match, score, _ = process.extractOne(cmu_title, unmatched_imdb, scorer=fuzz.ratio)
-        if score >= similarity_threshold:
-            cmu_row = cmu_df[cmu_df["Movie_name"] == cmu_title]
-            imdb_row = imdb_df[imdb_df["Movie_name"] == match]
-
-            # Combine the rows
-            combined_row = cmu_row.iloc[0].combine_first(imdb_row.iloc[0])
-            matched_rows.append(combined_row)
-
-    # Convert matched rows into a DataFrame
-    matched_df = pd.DataFrame(matched_rows)
+    # Perform similarity-based matching, the best match of each CMU title in the unmatched IMDb titles
+    if match_cache_path is not None:
+        matches = match_titles_cached(unmatched_cmu, unmatched_imdb, match_cache_path, threshold=similarity_threshold)
+    else:
+        matches = match_titles(unmatched_cmu, unmatched_imdb, threshold=similarity_threshold)
+
+    # The first row of each title, found by index lookups
+    cmu_rows = cmu_df.drop_duplicates(subset="Movie_name").set_index("Movie_name", drop=False).loc[matches["query"]]
+    imdb_rows = imdb_df.drop_duplicates(subset="Movie_name").set_index("Movie_name", drop=False).loc[matches["match"]]
+
+    # Combine the rows (the CMU values first)
+    matched_df = cmu_rows.reset_index(drop=True).combine_first(imdb_rows.reset_index(drop=True))
 
     # Append the matched rows to the exact merged DataFrame
     exact_matches = merged_df[merged_df["_merge"] == "both"].drop(columns="_merge")
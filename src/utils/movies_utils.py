@@ -1,5 +1,6 @@
 # Description: This file contains some utils functions to work with the movie charachters class.
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 import sys, os
@@ -13,12 +14,59 @@ CLEANED_DATA_PATH = "data/cleaned/movies_char/"
 
 
 
+# Release dates as int64 nanoseconds (NaT is the smallest int64, so two missing dates are equal as in pd.merge)
+def release_date_values(dates):
+    return dates.to_numpy().astype('datetime64[ns]').view(np.int64)
+
+
+# Inner join of the movies and characters on ['Wikipedia_movie_ID', 'Release_date'], same result as pd.merge.
+# The movie ids are indexed once (hash table) and every character looks its movie up, then only the release dates of
+# the matched pairs are compared (as int64). Falls back on pd.merge if a movie id is not unique (or missing).
+def join_movies_characters(movies: DataFrame, characters: DataFrame) -> DataFrame:
+    keys = ['Wikipedia_movie_ID', 'Release_date']
+    movie_ids = movies['Wikipedia_movie_ID']
+    # columns in both tables would get suffixes, pd.merge handles them
+    shared_columns = movies.columns.intersection(characters.columns).difference(keys)
+    if not movie_ids.is_unique or movie_ids.isna().any() or len(shared_columns) > 0:
+        return pd.merge(movies, characters, on=keys, how='inner')
+
+    # position of the movie of each character (-1 if the movie is not in the movies data)
+    positions = pd.Index(movie_ids).get_indexer(characters['Wikipedia_movie_ID'])
+    character_rows = np.flatnonzero(positions >= 0)
+    movie_rows = positions[character_rows]
+    same_date = release_date_values(movies['Release_date'])[movie_rows] == release_date_values(characters['Release_date'])[character_rows]
+    character_rows, movie_rows = character_rows[same_date], movie_rows[same_date]
+
+    # pd.merge keeps the order of the movies, then the order of the characters of each movie
+    merge_order = np.lexsort((character_rows, movie_rows))
+    movie_rows, character_rows = movie_rows[merge_order], character_rows[merge_order]
+
+    # the rows are taken once (no copy of the whole characters data to drop the keys, nor to reset the index)
+    left = movies.iloc[movie_rows]
+    right = characters.iloc[character_rows, [characters.columns.get_loc(column) for column in characters.columns.difference(keys, sort=False)]]
+    left.index = right.index = pd.RangeIndex(len(movie_rows))
+    return pd.concat([left, right], axis=1)
+
+
+# Same as df.duplicated(subset) (the first occurrence is kept): the rows are compared by hash, and only the rows whose
+# hash appears several times are compared column by column (to be exact in case of a collision)
+def duplicated_rows(df: DataFrame, subset=None) -> pd.Series:
+    if subset is not None:
+        df = df[list(subset)]
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    candidates = hashes.duplicated(keep=False)
+    duplicates = pd.Series(False, index=df.index)
+    if candidates.any():
+        duplicates[candidates.to_numpy()] = df[candidates.to_numpy()].duplicated().to_numpy()
+    return duplicates
+
+
 # Merge two names classes together: Movies and Characters and returns a clean DF
 def merge_movies_characters_data(moviesData: DataClass, charactersData: DataClass) -> DataFrame:
     moviesData.check_clean_data()
     charactersData.check_clean_data()
 
-    df = pd.merge(moviesData.clean_df, charactersData.clean_df, on=['Wikipedia_movie_ID', 'Release_date'], how='inner')
+    df = join_movies_characters(moviesData.clean_df, charactersData.clean_df)
     name = f"{moviesData.name} & {charactersData.name}"
 
     # We use this class to use its write method
@@ -27,11 +75,13 @@ def merge_movies_characters_data(moviesData: DataClass, charactersData: DataClas
     merged.clean_df = df
 
     # Check for duplicates and print them if any
-    duplicates = merged.clean_df[merged.clean_df.duplicated()]
-    if not duplicates.empty:
-        print(f"Duplicates found: {len(duplicates)} duplicates ! removing them...")
+    # if the movie ids are unique, the movie columns only depend on the key -> comparing the characters columns is enough
+    subset = charactersData.clean_df.columns if moviesData.clean_df['Wikipedia_movie_ID'].is_unique else None
+    duplicates = duplicated_rows(merged.clean_df, subset)
+    if duplicates.any():
+        print(f"Duplicates found: {duplicates.sum()} duplicates ! removing them...")
     
     # Remove duplicates
-    merged.clean_df = merged.clean_df.drop_duplicates()
+    merged.clean_df = merged.clean_df[~duplicates]
 
     return merged()
\ No newline at end of file
@@ -1,46 +1,135 @@
 # Description: This file contains some utils functions to work with the names class.
 
 # General imports
+import numpy as np
 import pandas as pd
 import sys, os
 
 # Main characters imports
-import codecs, spacy
+import spacy
 from collections import Counter
+from functools import lru_cache
 
 # Change the path if the file is launched directly (not imported)
 if(__name__ == '__main__'):
     sys.path.append(os.path.abspath(os.path.join('../../'))) # root directory
 
-from src.data.names_data import NamesData
+from src.data.names_data import NamesData, most_frequent_sex_mask
+from src.data.names_index import NameSeriesIndex
+from src.utils.general_utils import transliterate
 
+# spaCy model used to find the characters names in the plot summaries, only the named entity recognition is needed
+SPACY_MODEL = 'en_core_web_sm'
+NER_DISABLED_PIPES = ['tagger', 'parser', 'attribute_ruler', 'lemmatizer']
+NER_BATCH_SIZE = 64
 
-# Merge a list of names classes together 
-def merge_names_data(namesData : list) -> NamesData:
-    
-    name = ""
-    df = pd.DataFrame()
 
+def sum_names_counts(frames):
+    """
+    Sum the counts of the same (Year, Name, Sex) in several names tables
+    :param frames: list of DataFrame : with the columns Year, Name, Sex and Count
+    :return: DataFrame : one row per (Year, Name, Sex), sorted by Year, Name and Sex (the rows with a missing key are dropped)
+    """
+    # Concatenated once
+    df = pd.concat([frame[['Year', 'Name', 'Sex', 'Count']] for frame in frames], ignore_index=True)
+
+    # Integer codes of the names and sexes in a shared (sorted) vocabulary -> the order of the codes is the order of the strings
+    name_codes, name_vocabulary = pd.factorize(df['Name'], sort=True)
+    sex_codes, sex_vocabulary = pd.factorize(df['Sex'], sort=True)
+    counts = df['Count'].to_numpy(dtype=np.float64)
+
+    # The rows with a missing Year, Name or Sex are dropped (code -1)
+    valid = (name_codes >= 0) & (sex_codes >= 0) & df['Year'].notna().to_numpy()
+    if not valid.all():
+        name_codes, sex_codes, counts = name_codes[valid], sex_codes[valid], counts[valid]
+    years = df['Year'].to_numpy()[valid].astype(np.int64)
+    first_year = years.min() if len(years) else 0
+
+    # A single integer key per (Year, Name, Sex), sorted like (Year, Name, Sex)
+    n_names, n_sexes = len(name_vocabulary), len(sex_vocabulary)
+    keys = ((years - first_year) * n_names + name_codes) * n_sexes + sex_codes
+
+    # The data might be duplicated -> sum the counts of the same key (np.unique sorts the keys)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(unique_keys))
+
+    return pd.DataFrame({
+        'Year': unique_keys // (n_sexes * n_names) + first_year,
+        'Name': np.asarray(name_vocabulary, dtype=object).take((unique_keys // n_sexes) % n_names),
+        'Sex': np.asarray(sex_vocabulary, dtype=object).take(unique_keys % n_sexes),
+        'Count': counts.astype(np.int64)
+    })
+
+# Merge a list of names classes together 
+def merge_names_data(namesData : list, check_inputs=True) -> NamesData:
+    """
+    Merge the names data of several countries, the counts of the same (Year, Name, Sex) are summed
+    :param namesData: list of NamesData : the clean names data
+    :param check_inputs: bool : if False, the inputs are not checked again (e.g. they were checked when they were cleaned)
+    :return: NamesData : the merged data, sorted by Year, Name and Sex
+    """
     # Check that the inputs have been cleaned
-    for names in namesData:
-        names.check_clean_data()
-        name += f"{names.name} & "
-        # Merge the data
-        df = pd.concat([df, names.clean_df])
-    
+    if check_inputs:
+        for names in namesData:
+            names.check_clean_data()
+
     # New object
-    name = name[:-3] # Remove the last ' & '
+    name = " & ".join(names.name for names in namesData)
     merged = NamesData(name, name.replace(" & ", "_") + ".csv", loaded=False)
-    merged.clean_df = df
-
-    # Due to the merging, the data might be duplicated -> group by and sum the counts
-    merged.clean_df = merged.clean_df.groupby(['Year', 'Name', 'Sex']).sum().reset_index()
-    # sort data
-    merged.clean_df = merged.clean_df.sort_values(by=['Year', 'Name', 'Sex'])
+    merged.clean_df = sum_names_counts([names.clean_df for names in namesData])
+    merged.apply_schema()
 
     merged.check_clean_data()
     return merged
 
+def year_name_isin(df, other):
+    """
+    Mask of the rows of df whose (Year, Name) appears in other
+    :param df: DataFrame : with the columns Year and Name
+    :param other: DataFrame : with the columns Year and Name
+    :return: np.array : True if the (Year, Name) of the row is in other
+    """
+    # Codes of the names in a shared vocabulary, and a single integer key per (Year, Name)
+    name_codes, name_vocabulary = pd.factorize(pd.concat([df['Name'], other['Name']], ignore_index=True))
+    years = np.concatenate([df['Year'].to_numpy(dtype=np.int64), other['Year'].to_numpy(dtype=np.int64)])
+    keys = (years - years.min(initial=0)) * (len(name_vocabulary) + 1) + name_codes + 1
+    return np.isin(keys[:len(df)], keys[len(df):])
+
+def add_names_data(global_names, totals, names, check_inputs=True):
+    """
+    Add the names data of a new country to the global names data without merging all the countries again: the counts are
+    only added to the (Year, Name) of the new country, and the most frequent sex is only computed again for them.
+    global_names and totals are updated in place.
+    :param global_names: NamesData : the global names data (after sex_handling)
+    :param totals: NamesData : the counts of every (Year, Name, Sex) of the global names data before sex_handling
+    :param names: NamesData : the clean names data of the new country
+    :param check_inputs: bool : if False, the new country is not checked again
+    :return: NamesData, NamesData : the updated global names data and totals
+    """
+    if check_inputs:
+        names.check_clean_data()
+
+    new = names.clean_df.dropna(subset=['Year', 'Name', 'Sex'])
+
+    # New totals of the (Year, Name) of the new country
+    affected = year_name_isin(totals.clean_df, new)
+    updated = sum_names_counts([totals.clean_df[affected], new])
+    totals.clean_df = pd.concat([totals.clean_df[~affected], updated]).sort_values(['Year', 'Name', 'Sex'], ignore_index=True)
+
+    # The most frequent sex only changes for these (Year, Name)
+    winners = updated[most_frequent_sex_mask(updated)]
+    unchanged = global_names.clean_df[~year_name_isin(global_names.clean_df, new)]
+    global_names.clean_df = pd.concat([unchanged, winners]).sort_values(['Year', 'Name', 'Sex'], ignore_index=True)
+    # the concatenation of categories that differ gives object columns
+    totals.apply_schema()
+    global_names.apply_schema()
+
+    global_names.name = f"{global_names.name} & {names.name}"
+    totals.name = f"{totals.name} & {names.name}"
+    print(f"{names.name} : added to the global names data ({len(updated)} (Year, Name, Sex) updated)")
+
+    return global_names, totals
+
 def to_csv(self, filepath: str, index: bool = False):
     """
     Saves the clean_df DataFrame to a CSV file.
@@ -73,6 +162,37 @@ def get_film_name_and_date(wiki_id, movies_chars_joined):
         return filtered_data['Movie_name'].iloc[0], date
     return None, None
 
+def build_movie_index(movies_chars_joined):
+    """
+    Builds a dictionary Wikipedia ID -> (film name, release year), with the first row of each movie in movies_chars_joined
+    (same result as get_film_name_and_date, but built once for all the plot summaries).
+
+    Args:
+        movies_chars_joined (pd.DataFrame): A DataFrame with columns 'Wikipedia_movie_ID',
+                                            'Movie_name' and 'Release_date'.
+
+    Returns:
+        dict: Wikipedia ID -> (film name, year), the year is NaN if the release date is missing.
+              The movies with a release date that can not be parsed are not in the dictionary.
+    """
+    movies = movies_chars_joined.drop_duplicates(subset='Wikipedia_movie_ID')
+
+    # The dates are parsed once per distinct value
+    years = {}
+    for date in movies['Release_date'].dropna().unique():
+        try:
+            years[date] = pd.to_datetime(date).year
+        except ValueError:
+            continue
+
+    index = {}
+    for wiki_id, film_name, date in zip(movies['Wikipedia_movie_ID'], movies['Movie_name'], movies['Release_date']):
+        if pd.isna(date):
+            index[wiki_id] = (film_name, float('nan'))
+        elif date in years:
+            index[wiki_id] = (film_name, years[date])
+    return index
+
 # Function to map characters to their corresponding actors
 def map_characters_to_actors(movies_chars_joined):
     # Strip spaces and convert to lowercase to avoid case and whitespace issues
@@ -90,29 +210,27 @@ def map_characters_to_actors(movies_chars_joined):
     
     return actor_name
 
-# Function to extract Names and filter 
-def extract_names(text):
+@lru_cache(maxsize=None)
+def load_ner_model(model=SPACY_MODEL):
     """
-    Extracts names from a given text using spaCy and returns a list of (name, frequency) tuples.
+    Load the spaCy model once, with only the components needed by the named entity recognition
+    :param model: str : name of the spaCy model
+    :return: Language : the spaCy pipeline
+    """
+    nlp = spacy.load(model)
+    nlp.select_pipes(disable=[pipe for pipe in NER_DISABLED_PIPES if pipe in nlp.pipe_names])
+    return nlp
+
+def consolidate_names(name_counts):
+    """
+    Consolidate the names that are part of a longer name (Luke -> Luke Skywalker) and sort them by frequency
 
     Args:
-        text (str): The text to extract names from.
+        name_counts (Counter): The frequency of each name.
 
     Returns:
         list: A list of (name, frequency) tuples sorted by frequency in descending order.
     """
-    # Initialize a Counter to store name frequencies
-    name_counts = Counter() 
-
-    # Initialize the spacy model
-    nlp = spacy.load('en_core_web_sm')
-    doc = nlp(text)
-
-    for ent in doc.ents:
-        if ent.label_ == 'PERSON':
-            name_counts[ent.text] += 1
-            
-    # Consolidate similar names
     consolidated_counts = Counter()
     names = sorted(name_counts.keys(), key=len, reverse=True)  # Sort by length to prioritize full names
 
@@ -127,28 +245,54 @@ def extract_names(text):
             consolidated_counts[name] = name_counts[name]
 
     # Sort names by count in descending order
-    sorted_counts = consolidated_counts.most_common()  # Returns a list of (name, count) tuples sorted by count
-    
-    return sorted_counts
-    
-def main_name_per_movie(plot_summaries_path, movies_chars_joined):
-    # Load plot summaries
-    with codecs.open(plot_summaries_path, encoding="utf8") as file:
-        content = file.read()
+    return consolidated_counts.most_common()  # Returns a list of (name, count) tuples sorted by count
 
-    # Cut the content into lines
-    df_data = cut_plots(content, movies_chars_joined)
+def count_persons(doc):
+    """
+    Count the PERSON entities of a spaCy document
+    """
+    return Counter(ent.text for ent in doc.ents if ent.label_ == 'PERSON')
 
-    # Extract names for each row
-    extracted_data = []
-    for _, row in df_data.iterrows():
-        plot_summary = row['Plot Summary']
-        wikipedia_id = row['Wikipedia ID']
-        movie_name = row['Movie Name']
-        year = row['Year']
+# Function to extract Names and filter 
+def extract_names(text):
+    """
+    Extracts names from a given text using spaCy and returns a list of (name, frequency) tuples.
 
-        # Use the extract_names function on the plot summary to get character names and their frequencies
-        names = extract_names(plot_summary)
+    Args:
+        text (str): The text to extract names from.
+
+    Returns:
+        list: A list of (name, frequency) tuples sorted by frequency in descending order.
+    """
+    # The spacy model is loaded only once
+    doc = load_ner_model()(text)
+    return consolidate_names(count_persons(doc))
+
+def extract_names_batch(texts, batch_size=NER_BATCH_SIZE, n_process=1):
+    """
+    Extracts names from many texts, streamed through spaCy by batches.
+
+    Args:
+        texts (iterable of str): The texts to extract names from.
+        batch_size (int): The number of texts processed at once by spaCy.
+        n_process (int): The number of processes used by spaCy.
+
+    Returns:
+        generator: For each text (in the same order), a list of (name, frequency) tuples sorted by frequency in descending order.
+    """
+    for doc in load_ner_model().pipe(texts, batch_size=batch_size, n_process=n_process):
+        yield consolidate_names(count_persons(doc))
+    
+def main_name_per_movie(plot_summaries_path, movies_chars_joined, batch_size=NER_BATCH_SIZE, n_process=1):
+    # Stream the plot summaries line by line, only the summaries of the movies in movies_chars_joined are kept
+    # (newline='\n' -> the lines are split on '\n' only)
+    with open(plot_summaries_path, encoding="utf8", newline="\n") as file:
+        df_data = cut_plots(file, movies_chars_joined)
+
+    # Extract names for each row, the plot summaries are streamed through spacy by batches
+    extracted_data = []
+    all_names = extract_names_batch(df_data['Plot Summary'], batch_size=batch_size, n_process=n_process)
+    for wikipedia_id, movie_name, year, names in zip(df_data['Wikipedia ID'], df_data['Movie Name'], df_data['Year'], all_names):
 
         # Append each name, its frequency, and associated metadata to the extracted data list
         for name, frequency in names:
@@ -181,8 +325,8 @@ def cut_plots(content, movies_chars_joined):
     filtering out plots that don't match any Wikipedia ID in the provided DataFrame.
 
     Args:
-        content (str): The raw content of the text file, where each line is formatted 
-                       as 'Wikipedia ID<tab>Plot Summary'.
+        content (str or iterable of str): The raw content of the text file (or its lines, e.g. the opened file),
+                       where each line is formatted as 'Wikipedia ID<tab>Plot Summary'.
         movies_chars_joined (pd.DataFrame): A DataFrame with columns 
                                             'Wikipedia_movie_ID' and 'Movie_name', 
                                             used to map IDs to movie names.
@@ -194,7 +338,10 @@ def cut_plots(content, movies_chars_joined):
     columns = ['Wikipedia ID', 'Movie Name', 'Plot Summary', 'Year']
 
     # Split the content into lines
-    plots = content.strip().split("\n")
+    plots = content.strip().split("\n") if isinstance(content, str) else content
+
+    # Wikipedia ID -> (film name, year), built once
+    movie_index = build_movie_index(movies_chars_joined)
     
     # Process each line
     for line in plots:
@@ -203,16 +350,12 @@ def cut_plots(content, movies_chars_joined):
         if len(film_data) == 2:  # Ensure the line has both ID and summary
             try:
                 wikipedia_id = int(film_data[0].strip())  # Convert Wikipedia ID to integer
-                plot_summary = film_data[1].strip()
 
-                # Get the film name for this ID
-                film_name, date = get_film_name_and_date(wikipedia_id, movies_chars_joined)
-
-                # Only add the entry if the film name exists
-                if film_name is not None and date is not None:
-                    # It's a date time object, we only want the year
-                    year = date.year
-                    data.append([wikipedia_id, film_name, plot_summary, year])
+                # Get the film name and year for this ID, only add the entry if the film exists
+                if wikipedia_id in movie_index:
+                    film_name, year = movie_index[wikipedia_id]
+                    if film_name is not None:
+                        data.append([wikipedia_id, film_name, film_data[1].strip(), year])
             except ValueError:
                 # Skip lines with invalid Wikipedia ID formats
                 continue
@@ -226,12 +369,10 @@ def normalize_names(column):
     :param names_data: Series : The column containing the names
     :return: Series : The column with the normalized names (copy)
     """
-    from unidecode import unidecode
-
     out = column.copy()
     out = out.str.upper() # Upper case
     # remove accents
-    out = out.apply(lambda x: unidecode(x))
+    out = transliterate(out)
     # remove special characters
     out = out.str.replace(r'[^A-Z\s]', '')
     # remove multiple spaces
@@ -252,17 +393,21 @@ def chars_and_names_intersection(main_chars, names_data):
     """
     Function to get the intersection between the main characters and the top movies per year
     :param main_chars: DataFrame : The DataFrame with the main characters
-    :param names_data: NamesData : The class containing the names we want to have an intersection with
+    :param names_data: NamesData or NameSeriesIndex : The class containing the names we want to have an intersection with
     :return: DataFrame : The DataFrame of the format of main_chars, but with only the intersection of the names
     """
 
-    names_df = names_data() # We use only the Name column here
+    # We use only the names here
+    if isinstance(names_data, NameSeriesIndex):
+        names = names_data.names
+    else:
+        names = names_data()['Name']
     # get the normalized names in the main_chars
     main_chars_names = normalize_names(main_chars['Character Name'])
     # add it as a temporary column in the df
     main_chars['Normalized_name'] = main_chars_names
     # get the intersection
-    intersection = main_chars[main_chars['Normalized_name'].isin(names_df['Name'])]
+    intersection = main_chars[main_chars['Normalized_name'].isin(names)]
 
     print(f"Fraction of the main characters in the names data : {len(intersection) / len(main_chars)}")
 
@@ -1,13 +1,14 @@
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+from src.data.data_class import read_frame
 
 
 #### Study of Norwegians total dataset
 
 
 def norwegian_names_trend_per_decade():
-    norwegian_df = pd.read_csv('data/clean/names/norway_merged.csv')
+    norwegian_df = read_frame('data/clean/names/norway_merged.parquet')
 
 
     # Create a new column for 10-year periods
@@ -15,13 +16,13 @@ def norwegian_names_trend_per_decade():
 
     # Aggregate by Period, Name, and Year
     aggregated_data = (
-        norwegian_df.groupby(['Period', 'Name', 'Year'], as_index=False)['Count']
+        norwegian_df.groupby(['Period', 'Name', 'Year'], as_index=False, observed=True)['Count']
         .sum()  # Sum counts for the same name within the same period and year
     )
 
     #  Get top 10 names per period
     top_names_by_period = (
-        aggregated_data.groupby(['Period', 'Name'], as_index=False)['Count']
+        aggregated_data.groupby(['Period', 'Name'], as_index=False, observed=True)['Count']
         .sum()  # Sum total counts for the entire period
         .sort_values(['Period', 'Count'], ascending=[True, False])  # Sort within each period
         .groupby('Period', as_index=False)
@@ -152,7 +153,7 @@ def norwegian_names_trend_per_decade():
 
 
 def evolution_norwegian_names():
-    norwegian_df = pd.read_csv('data/clean/names/norway_merged.csv')
+    norwegian_df = read_frame('data/clean/names/norway_merged.parquet')
 
     # Step 1: Add a 'Decade' column based on the 'Year' column
     norwegian_df['Decade'] = (norwegian_df['Year'] // 10) * 10
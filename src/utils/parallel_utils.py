@@ -0,0 +1,65 @@
+# Description: This file contains the functions used to run a per-name model (SARIMA, Prophet, ...) on many names in
+# parallel. The workers do not receive the names data: the NameSeriesIndex is saved once in a temporary directory and
+# memory-mapped by every worker, so each task only sends a name and a year.
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from src.data.names_index import NameSeriesIndex
+
+# Index of the names, mapped once in each worker process
+_worker_index = None
+
+
+def _init_worker(directory):
+    """
+    Initializer of the worker processes: maps the saved index
+    :param directory: str : directory where the index was saved
+    """
+    global _worker_index
+    _worker_index = NameSeriesIndex.load(directory)
+
+
+def _call_with_index(func, name, year):
+    return func(name, _worker_index, year)
+
+
+def map_names(func, names_index, names, years, n_workers=None, chunksize=8, progress_every=100, on_result=None):
+    """
+    Compute func(name, names_index, year) for every (name, year), in parallel
+    :param func: function (name, names_index, year) -> result, it must be defined at the top level of a module
+    :param names_index: NameSeriesIndex : the index of the names data
+    :param names: list/Series : the names
+    :param years: list/Series : the year of each name
+    :param n_workers: int : number of worker processes, all the cores by default, 1 to run in this process
+    :param chunksize: int : number of (name, year) sent to a worker at once
+    :param progress_every: int : print the progress every progress_every results
+    :param on_result: function (name, year, result) called as soon as a result is available, in the order of the names (optional)
+    :return: list : the results, in the same order as names
+    """
+    names, years = list(names), list(years)
+    n_workers = n_workers or os.cpu_count() or 1
+    results = []
+
+    def add_result(result):
+        if on_result is not None:
+            on_result(names[len(results)], years[len(results)], result)
+        results.append(result)
+        if len(results) % progress_every == 0:
+            print(f"Progress: {len(results)}/{len(names)}")
+
+    if n_workers == 1 or len(names) <= 1:
+        for name, year in zip(names, years):
+            add_result(func(name, names_index, year))
+        return results
+
+    with tempfile.TemporaryDirectory() as directory:
+        names_index.save(directory)
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(directory,)) as executor:
+            # map returns the results in the order of the inputs
+            for result in executor.map(partial(_call_with_index, func), names, years, chunksize=chunksize):
+                add_result(result)
+
+    return results
@@ -1,15 +1,21 @@
 # Contains the complete process of the pipeline
 
 # Imports
-import os, sys
+import os, sys, json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import pandas as pd
 import numpy as np
 import src.data.movies_char_data as movies_char_data
+from src.data.data_class import read_frame, write_frame
 import src.utils.movies_utils as movies_utils
 import src.utils.imdb_manipulation as imdb_manipulation
 import src.utils.names_utils as names_utils
 import src.data.names_data as names_data
+from src.data.names_index import get_names_index
 import src.models.naming_prediction as naming_prediction
+import src.utils.cache_utils as cache_utils
+import src.utils.parallel_utils as parallel_utils
 import tests.interval_test as interval_test
 
 
@@ -19,28 +25,51 @@ import tests.interval_test as interval_test
 CLEANED_CMU_DATA_PATH = "data/clean/movies_char/"
 
 CMU_CHARACTER_IN_PATH = "character.metadata.tsv"
-CMU_CHARACTER_OUT_PATH = "CMU_characters.csv"
+CMU_CHARACTER_OUT_PATH = "CMU_characters.parquet"
 CMU_MOVIE_IN_PATH = "movie.metadata.tsv"
-CMU_MOVIE_OUT_PATH = "CMU_movies.csv"
-CMU_MOVIES_CHARS_OUT_PATH = CLEANED_CMU_DATA_PATH + "CMU_movies_chars.csv"
+CMU_MOVIE_OUT_PATH = "CMU_movies.parquet"
+CMU_MOVIES_CHARS_OUT_PATH = CLEANED_CMU_DATA_PATH + "CMU_movies_chars.parquet"
 
 IMDB_DIR_PATH = "data/raw/imdb/"
-CMU_IMDB_MERGED_OUT_PATH = "data/clean/CMU_IMDB_merged.csv"
-BLOCKBUSTERS_OUT_PATH = "data/clean/blockbusters.csv"
+# IMDb movies joined with their ratings, reused while the IMDb dumps do not change
+IMDB_MOVIES_RATINGS_PATH = "data/clean/imdb_movies_ratings.parquet"
+CMU_IMDB_MERGED_OUT_PATH = "data/clean/CMU_IMDB_merged.parquet"
+# Fuzzy title matches between CMU and IMDb, reused when the IMDb data is refreshed
+TITLE_MATCHES_PATH = "data/clean/CMU_IMDB_title_matches.parquet"
+BLOCKBUSTERS_OUT_PATH = "data/clean/blockbusters.parquet"
 
-TOP_PER_YEAR_DF_PATH = "data/clean/top_per_year.csv"
+TOP_PER_YEAR_DF_PATH = "data/clean/top_per_year.parquet"
 
 PLOT_SUMMARIES_PATH = "data/raw/plot_summaries.txt"
-MAIN_CHARACTERS_PATH = "data/clean/main_chars_in_top_movies.csv" 
+MAIN_CHARACTERS_PATH = "data/clean/main_chars_in_top_movies.parquet" 
 
 ## Results
 RESULTS_PATH_SARIMA = "data/clean/influenced_names_sarima.csv"
 RESULTS_PATH_PROPHET = "data/clean/influenced_names_prophet.csv"
 RESULTS_PATH_MEANS = "data/clean/influenced_names_means_diff.csv"
+# Checkpoints of the long computations, to resume them after a crash or an interruption
+CHECKPOINT_PATH_SARIMA = "data/clean/checkpoints/influenced_names_sarima.csv"
+CHECKPOINT_PATH_PROPHET = "data/clean/checkpoints/influenced_names_prophet.csv"
+CHECKPOINT_FLUSH_EVERY = 50
+
+# Global names data (all the countries), and the counts of both sexes before sex_handling
+GLOBAL_NAMES_FILE = "UK_France_US_Norway.csv"
+GLOBAL_TOTALS_FILE = "UK_France_US_Norway_totals.csv"
 
 ## Arguments
 FIRST_YEAR = 1960
+# Number of rows kept from the CMU and IMDb data in debug mode
+DEBUG_SAMPLE_SIZE = 100
 N_BIGGEST_RATING = 15
+# Maximum number of seconds for one prophet fit, and what to do when a fit fails
+PROPHET_TIMEOUT = 60
+PROPHET_ERROR_POLICIES = ("nan", "zero", "raise")
+# Errors of a failed fit: name not in the names data / not enough data (ValueError), stan failure (RuntimeError)
+# and fit longer than the timeout (TimeoutError), the other errors are bugs and are always raised
+PROPHET_FIT_ERRORS = (ValueError, RuntimeError, TimeoutError)
+# Number of rows read at once from the biggest raw files (US, France, CMU characters), None to read them in one go
+# (e.g. 500000 on machines with a small memory)
+RAW_CHUNKSIZE = None
 
 
 def print_step(message):
@@ -53,38 +82,153 @@ def print_step(message):
     print("-------------------")
 
 
-def write_all_names_data():
+def run_stage(output_path, compute, inputs, modules, use_cache=True):
+    """
+    Function to run a step of the pipeline, the step is skipped if its output was already computed from the same inputs and code
+    :param output_path: str : where the output DataFrame is written
+    :param compute: function : computes the output DataFrame (without arguments)
+    :param inputs: dict : everything the step depends on (fingerprints of the previous steps, parameters, ...)
+    :param modules: list : modules containing the code of the step
+    :param use_cache: bool : if False, the step is always computed
+    :return: DataFrame, str : the output and its fingerprint (to give as input to the next steps)
+    """
+    fingerprint = cache_utils.hash_object({"inputs": inputs, "code": cache_utils.hash_modules(modules)})
+    if use_cache and cache_utils.is_up_to_date(output_path, fingerprint):
+        print(f"The inputs did not change, using the saved data from {output_path}")
+        return read_frame(output_path), fingerprint
+
+    output = compute()
+    write_frame(output, output_path)
+    cache_utils.write_manifest(output_path, fingerprint, inputs)
+    return output, fingerprint
+
+
+def debug_fingerprint(fingerprint):
+    """
+    Function to get the fingerprint of data sampled in debug mode, so that the outputs computed from the sample
+    (and their manifests) are never taken for the outputs of the whole data in the next runs
+    :param fingerprint: str : fingerprint of the whole data
+    :return: str : fingerprint of the sample
+    """
+    return cache_utils.hash_object({"debug_sample_size": DEBUG_SAMPLE_SIZE, "data": fingerprint})
+
+
+def clean_names_data(names, use_cache=True):
+    """
+    Function to clean and write the names data of a country (years before FIRST_YEAR are excluded),
+    skipped if the raw data and the cleaning code did not change since the last run
+    :param names: NamesData : The names data of the country
+    :param use_cache: bool : if False, the data is always cleaned
+    :return: str : The fingerprint of the clean data
     """
-    Function to get and write the names data of all countries
+    params = {"FIRST_YEAR": FIRST_YEAR}
+    fingerprint = names.fingerprint(params)
+    if use_cache and names.is_up_to_date(fingerprint):
+        print(f"{names.name} : Raw data and cleaning code did not change, using the saved clean data")
+        names.load_clean_data()
+        return fingerprint
+
+    names.clean_data()
+    names.clean_df = names.clean_df[names.clean_df["Year"] >= FIRST_YEAR] # Exclude the input with years before FIRST_YEAR
+    names.write_clean_data()
+    names.write_manifest(fingerprint, params)
+    return fingerprint
+
+
+def clean_names_data_in_process(names, use_cache=True):
+    """
+    Function to clean the names data of a country in a worker process (see clean_names_data)
+    :param names: NamesData : The names data of the country (the raw data is not loaded yet)
+    :param use_cache: bool : if False, the data is always cleaned
+    :return: DataFrame, str : The clean data (sent back to the main process) and its fingerprint
+    """
+    fingerprint = clean_names_data(names, use_cache)
+    return names.clean_df, fingerprint
+
+
+def write_all_names_data(use_cache=True, n_workers=None):
+    """
+    Function to get and write the names data of all countries, only the countries whose raw data or cleaning code changed are cleaned again
+    :param use_cache: bool : if False, everything is recomputed
+    :param n_workers: int : number of processes cleaning the countries at the same time, one per country by default (1 to clean them one after the other)
     :return: NamesData : The global names data, and the names data for each country
     """
 
     # Loading and cleaning the data from the different countries
     uk = names_data.UKNamesData("UK", "ukbabynames.csv")
-    uk.clean_raw_data()
-    uk.clean_df = uk.clean_df[uk.clean_df["Year"] >= FIRST_YEAR] # Exckude the input with years before FIRST_YEAR
-    uk.write_clean_data()
-    france = names_data.FranceNamesData("France", "france.csv", "https://www.insee.fr/fr/statistiques/8205621?sommaire=8205628#dictionnaire", ";")
-    france.clean_raw_data()
-    france.clean_df = france.clean_df[france.clean_df["Year"] >= FIRST_YEAR] # Exckude the input with years before FIRST_YEAR
-    france.write_clean_data()
-    us = names_data.USNamesData("US", "babyNamesUSYOB-full.csv")
-    us.clean_raw_data()
-    us.clean_df = us.clean_df[us.clean_df["Year"] >= FIRST_YEAR] # Exckude the input with years before FIRST_YEAR
-    us.write_clean_data()
+    france = names_data.FranceNamesData("France", "france.csv", "https://www.insee.fr/fr/statistiques/8205621?sommaire=8205628#dictionnaire", ";", chunksize=RAW_CHUNKSIZE)
+    us = names_data.USNamesData("US", "babyNamesUSYOB-full.csv", chunksize=RAW_CHUNKSIZE)
     norway = names_data.NovergianNamesData("Norway", "norway/norway_merged.csv")
-    norway.clean_raw_data()
-    norway.clean_df = norway.clean_df[norway.clean_df["Year"] >= FIRST_YEAR] # Exckude the input with years before FIRST_YEAR
-    norway.write_clean_data()
+    countries = [uk, france, us, norway]
 
-    # Merge the data together
-    global_names = names_utils.merge_names_data([uk, france, us, norway])
+    # The countries are cleaned in parallel, each process reads, cleans and writes one country
+    n_workers = n_workers or len(countries)
+    if n_workers == 1:
+        fingerprints = [clean_names_data(names, use_cache) for names in countries]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(countries))) as executor:
+            results = list(executor.map(partial(clean_names_data_in_process, use_cache=use_cache), countries))
+        for names, (clean_df, _) in zip(countries, results):
+            names.clean_df = clean_df
+        fingerprints = [fingerprint for _, fingerprint in results]
+
+    # Merge the data together, only if one of the countries changed
+    global_names = names_data.NamesData("UK & France & US & Norway", GLOBAL_NAMES_FILE, loaded=False)
+    totals = names_data.NamesData("UK & France & US & Norway (totals)", GLOBAL_TOTALS_FILE, loaded=False)
+    params = {"inputs": fingerprints, "merge": cache_utils.hash_modules([names_utils])}
+    fingerprint = global_names.fingerprint(params)
+    if use_cache and global_names.is_up_to_date(fingerprint) and os.path.exists(totals.clean_path + totals.clean_file_name()):
+        print(f"{global_names.name} : The countries did not change, using the saved clean data")
+        global_names.load_clean_data()
+        return global_names, uk, france, us, norway
+
+    # The countries were checked when they were cleaned
+    global_names = names_utils.merge_names_data([uk, france, us, norway], check_inputs=False)
+    global_names.file_name = GLOBAL_NAMES_FILE
+    # The counts of both sexes are kept in the totals, to add a country later without merging everything again (see add_country_to_names_data)
+    totals.clean_df = global_names.clean_df
+    totals.write_clean_data()
     global_names.sex_handling() # Handle the case where a name is in both sex -> only take the most common one
     global_names.write_clean_data()
+    global_names.write_manifest(fingerprint, params)
 
     return global_names, uk, france, us, norway
 
 
+def add_country_to_names_data(names, use_cache=True):
+    """
+    Function to clean the names data of a new country and add it to the saved global names data, only the (Year, Name) of
+    the new country are updated (write_all_names_data has to be called before). The global names data is written in place.
+    /!\ write_all_names_data does not know the added country, it rebuilds the global data from the four countries when it is called again
+    :param names: NamesData : The names data of the new country (cleaner of its raw data)
+    :param use_cache: bool : if False, the new country is always cleaned
+    :return: NamesData : The updated global names data
+    """
+    print_step(f"Adding {names.name} to the global names data")
+    country_fingerprint = clean_names_data(names, use_cache)
+
+    global_names = names_data.NamesData("UK & France & US & Norway", GLOBAL_NAMES_FILE, loaded=False)
+    global_names.load_clean_data()
+    totals = names_data.NamesData("UK & France & US & Norway (totals)", GLOBAL_TOTALS_FILE, loaded=False)
+    totals.load_clean_data()
+
+    # The country was checked when it was cleaned
+    global_names, totals = names_utils.add_names_data(global_names, totals, names, check_inputs=False)
+    totals.write_clean_data()
+    global_names.write_clean_data()
+
+    # The saved global data now also depends on the new country
+    manifest = cache_utils.manifest_path(global_names.clean_path + global_names.clean_file_name())
+    previous = None
+    if os.path.exists(manifest):
+        with open(manifest, encoding='utf-8') as file:
+            previous = json.load(file).get("fingerprint")
+    params = {"previous": previous, "added": {names.name: country_fingerprint}}
+    global_names.write_manifest(cache_utils.hash_object(params), params)
+
+    return global_names
+
+
 def read_all_names_data():
     """
     Function to read the names data of all countries from a saved file
@@ -100,65 +244,79 @@ def read_all_names_data():
     us.load_clean_data()
     norway = names_data.NamesData("Norway", "norway_merged.csv", loaded=False)
     norway.load_clean_data()
-    global_names = names_data.NamesData("UK & France & US & Norway", "UK_France_US_Norway.csv", loaded=False)
+    global_names = names_data.NamesData("UK & France & US & Norway", GLOBAL_NAMES_FILE, loaded=False)
     global_names.load_clean_data()
 
     return global_names, uk, france, us, norway
 
-def write_CMU_and_IMDB(debug=False):
+def write_CMU_and_IMDB(debug=False, use_cache=True):
     """
     Functions that does all the Movie and Character data pipeline, all intermediate data is saved in the data/clean folder
-    (Writes to memory the intermediate and final dataframe). If debug is True, the data is limited to 100 rows
+    (Writes to memory the intermediate and final dataframe). If debug is True, the data is limited to DEBUG_SAMPLE_SIZE rows
+    Only the steps whose inputs (raw files, previous steps, code or parameters) changed are computed again, unless use_cache is False
+    (the cache is never used in debug mode since the data is sampled, and the outputs of the sample get their own fingerprints)
 
     """
+    use_cache = use_cache and not debug
 
     #1. get data from movies and characters (CMU)
     print_step("Getting data from CMU and cleaning it")
-    chars = movies_char_data.CharacterData("CMU Characters", CMU_CHARACTER_IN_PATH, output_name=CMU_CHARACTER_OUT_PATH)
-    chars.pipeline()
+    chars = movies_char_data.CharacterData("CMU Characters", CMU_CHARACTER_IN_PATH, output_name=CMU_CHARACTER_OUT_PATH, chunksize=RAW_CHUNKSIZE)
+    chars_fingerprint = chars.pipeline(use_cache=use_cache)
     movies = movies_char_data.MovieData("CMU Movies", CMU_MOVIE_IN_PATH, output_name=CMU_MOVIE_OUT_PATH)
-    movies.pipeline()
+    movies_fingerprint = movies.pipeline(use_cache=use_cache)
 
     if debug:
-        print("Debug mode: limiting CMU data to 100 rows")
-        chars.clean_df = chars.clean_df.sample(n=100)
-        movies.clean_df = movies.clean_df.sample(n=100)
+        print(f"Debug mode: limiting CMU data to {DEBUG_SAMPLE_SIZE} rows")
+        chars.clean_df = chars.clean_df.sample(n=DEBUG_SAMPLE_SIZE)
+        movies.clean_df = movies.clean_df.sample(n=DEBUG_SAMPLE_SIZE)
+        chars_fingerprint, movies_fingerprint = debug_fingerprint(chars_fingerprint), debug_fingerprint(movies_fingerprint)
 
     #2. Join them together
     print_step("Joining then writing the movies and characters data")
-    movies_chars_joined = movies_utils.merge_movies_characters_data(movies, chars)
-    # Save the data
-    movies_chars_joined.to_csv(CMU_MOVIES_CHARS_OUT_PATH, index=False)
+    movies_chars_joined, _ = run_stage(CMU_MOVIES_CHARS_OUT_PATH,
+                                       lambda: movies_utils.merge_movies_characters_data(movies, chars),
+                                       {"chars": chars_fingerprint, "movies": movies_fingerprint},
+                                       [movies_utils], use_cache)
 
     #3. Augment the data with IMDB data
     #3.1 Get most famous movies from IMDB
     print_step("Getting and filtering data from IMDB...")
-    blockbusters = imdb_manipulation.get_all_blockbusters(IMDB_DIR_PATH)
-    # Save the data
-    blockbusters.to_csv(BLOCKBUSTERS_OUT_PATH, index=False)
+    # the dumps are hashed once: the hashes are the inputs of the stage and the fingerprint of the parquet cache of the movies
+    imdb_inputs = imdb_manipulation.hash_imdb_dumps(IMDB_DIR_PATH) if use_cache else None
+    blockbusters, blockbusters_fingerprint = run_stage(BLOCKBUSTERS_OUT_PATH,
+                                                       lambda: imdb_manipulation.get_all_blockbusters(IMDB_DIR_PATH, cache_path=IMDB_MOVIES_RATINGS_PATH if use_cache else None,
+                                                                                                      dump_hashes=imdb_inputs),
+                                                       imdb_inputs, [imdb_manipulation], use_cache)
     if debug:
-        print("Debug mode: limiting IMDB data to 100 rows")
-        blockbusters = blockbusters.sample(n=100)
+        print(f"Debug mode: limiting IMDB data to {DEBUG_SAMPLE_SIZE} rows")
+        blockbusters = blockbusters.sample(n=DEBUG_SAMPLE_SIZE)
+        blockbusters_fingerprint = debug_fingerprint(blockbusters_fingerprint)
     #3.2 Merge the data with CMU
     print_step("Merging CMU and IMDB data...")
-    merged_cmu_imdb = imdb_manipulation.merge_imdb_and_dataset(blockbusters, movies())
+    merged_cmu_imdb, merged_fingerprint = run_stage(CMU_IMDB_MERGED_OUT_PATH,
+                                                    lambda: imdb_manipulation.merge_imdb_and_dataset(blockbusters, movies(),
+                                                                                                      match_cache_path=None if debug else TITLE_MATCHES_PATH),
+                                                    {"blockbusters": blockbusters_fingerprint, "movies": movies_fingerprint},
+                                                    [imdb_manipulation], use_cache)
     #merged_cmu_imdb = merged_cmu_imdb[merged_cmu_imdb['is_blockbuster'] == True]
-    # Save the data
-    merged_cmu_imdb.to_csv(CMU_IMDB_MERGED_OUT_PATH, index=False)
 
     #4. Get the biggest rating per year
     print_step("Getting the biggest rating per year...")
     # remove every movie without a name, weightedAverageRating or ReleaseDate
     merged_cmu_imdb = merged_cmu_imdb.dropna(subset=['Movie_name', 'weightedAverageRating', 'Release_date'])
     # Get the biggest rating per year
-    top_per_year_df = imdb_manipulation.biggest_rating_per_year(merged_cmu_imdb, N_BIGGEST_RATING, FIRST_YEAR, by_num_votes=True)
-    # Save the data
-    top_per_year_df.to_csv(TOP_PER_YEAR_DF_PATH, index=False)    
+    top_per_year_df, top_per_year_fingerprint = run_stage(TOP_PER_YEAR_DF_PATH,
+                                                          lambda: imdb_manipulation.biggest_rating_per_year(merged_cmu_imdb, N_BIGGEST_RATING, FIRST_YEAR, by_num_votes=True),
+                                                          {"merged": merged_fingerprint, "N_BIGGEST_RATING": N_BIGGEST_RATING, "FIRST_YEAR": FIRST_YEAR},
+                                                          [imdb_manipulation], use_cache)
 
     # 5. Compute the main characters in the top movies
     print_step("Computing the main characters' name in the top movies...")
-    main_chars = names_utils.main_name_per_movie(PLOT_SUMMARIES_PATH, top_per_year_df)
-    main_chars.to_csv(MAIN_CHARACTERS_PATH, index=False)
+    plots_inputs = {"plots": cache_utils.hash_file(PLOT_SUMMARIES_PATH), "top_per_year": top_per_year_fingerprint} if use_cache else None
+    main_chars, _ = run_stage(MAIN_CHARACTERS_PATH,
+                              lambda: names_utils.main_name_per_movie(PLOT_SUMMARIES_PATH, top_per_year_df),
+                              plots_inputs, [names_utils], use_cache)
 
 
     return main_chars, top_per_year_df, merged_cmu_imdb, movies_chars_joined, blockbusters, chars, movies
@@ -169,30 +327,63 @@ def read_CMU_IMDB():
     :return: List<DataFrame> : The DataFrame for the Top N movies per year, imdb and cmu merge, the movies and characters data, the blockbusters data, the characters data and the movies data 
     """
 
-    top_n_per_year = pd.read_csv(TOP_PER_YEAR_DF_PATH)
-    merged_cmu_imdb = pd.read_csv(CMU_IMDB_MERGED_OUT_PATH)
-    movies_chars_joined = pd.read_csv(CMU_MOVIES_CHARS_OUT_PATH)
-    blockbusters = pd.read_csv(BLOCKBUSTERS_OUT_PATH)
-    chars = pd.read_csv(CLEANED_CMU_DATA_PATH + CMU_CHARACTER_OUT_PATH)
-    movies = pd.read_csv(CLEANED_CMU_DATA_PATH + CMU_MOVIE_OUT_PATH)
-    main_chars = pd.read_csv(MAIN_CHARACTERS_PATH)
+    # parquet files, read_frame falls back on the csv files written by older versions
+    top_n_per_year = read_frame(TOP_PER_YEAR_DF_PATH)
+    merged_cmu_imdb = read_frame(CMU_IMDB_MERGED_OUT_PATH)
+    movies_chars_joined = read_frame(CMU_MOVIES_CHARS_OUT_PATH)
+    blockbusters = read_frame(BLOCKBUSTERS_OUT_PATH)
+    chars = read_frame(CLEANED_CMU_DATA_PATH + CMU_CHARACTER_OUT_PATH)
+    movies = read_frame(CLEANED_CMU_DATA_PATH + CMU_MOVIE_OUT_PATH)
+    main_chars = read_frame(MAIN_CHARACTERS_PATH)
 
     return main_chars, top_n_per_year, merged_cmu_imdb, movies_chars_joined, blockbusters, chars, movies
 
 
-def is_name_influenced_sarima(name, names_data, year, progress, plot=False):
+def compute_with_checkpoint(func, names_index, df, checkpoint_path, method, params, resume=True, n_workers=None, chunksize=8, is_failure=None):
+    """
+    Function to compute func(name, names_index, year) for every row of df, the results are saved in a checkpoint store
+    while they are computed, and the (name, year) already in the store are not computed again
+    :param func: function (name, names_index, year) -> result, defined at the top level of a module
+    :param names_index: NameSeriesIndex : the index of the names data
+    :param df: DataFrame : with the columns Normalized_name and Year
+    :param checkpoint_path: str : path of the checkpoint store
+    :param method: str : name of the method in the store
+    :param params: dict : parameters of the method, the results computed with other parameters (or other names data / code) are not reused
+    :param resume: bool : if False, the checkpoint store is cleared and everything is computed again
+    :param n_workers: int : number of processes
+    :param chunksize: int : number of names sent to a process at once
+    :param is_failure: function result -> bool : the failed results are not checkpointed, they are computed again on resume (optional)
+    :return: list : the result of each row of df
+    """
+    # the results also depend on the names data and on the code of the models
+    params = dict(params, names_index=names_index.fingerprint(), code=cache_utils.hash_modules([naming_prediction, interval_test]))
+
+    with cache_utils.CheckpointStore(checkpoint_path, method, params, flush_every=CHECKPOINT_FLUSH_EVERY, is_failure=is_failure) as store:
+        if not resume:
+            store.clear()
+
+        names, years = store.missing(df["Normalized_name"], df["Year"])
+        print(f"{len(df) - len(names)} results found in the checkpoint, {len(names)} to compute")
+
+        parallel_utils.map_names(func, names_index, names, years, n_workers=n_workers, chunksize=chunksize, on_result=store.add)
+
+    return store.get_results(df["Normalized_name"], df["Year"])
+
+def is_name_influenced_sarima(name, names_data, year, progress=None, plot=False):
     """
     Function to check if a name is influenced by a movie
     :param name: str : The name we want to check
-    :param names_data: NamesData : The names data of the country we want / or global
+    :param names_data: NamesData or NameSeriesIndex : The names data of the country we want / or global
     :param year: int : The year of the movie
+    :param progress: np.array : [number of names computed, total number of names], to print the progress (optional)
     :return: bool : True if the name is influenced, False otherwise
     """
 
     # Progress
-    progress[0] += 1
-    if(progress[0] % 100 == 0):
-        print(f"Progress: {progress[0]}/{progress[1]}")
+    if(progress is not None):
+        progress[0] += 1
+        if(progress[0] % 100 == 0):
+            print(f"Progress: {progress[0]}/{progress[1]}")
 
 
     # Some of the retreived characters names are not 
@@ -215,13 +406,16 @@ def is_name_influenced_sarima(name, names_data, year, progress, plot=False):
     else:
         return False
 
-def compute_all_influence_sarima(namesData, mean_df):
+def compute_all_influence_sarima(namesData, mean_df, n_workers=None, chunksize=8, resume=True):
     """
     Function to compute the influenced names by the movies using the sarima method
 
     :param main_characters: DataFrame : The names of the main character in the top movies
-    :param namesData: NamesData : The names data of the country we want / or global
+    :param namesData: NamesData or NameSeriesIndex : The names data of the country we want / or global
     :param mean_df: DataFrame : The DataFrame containing the mean difference of the names -> will allow to speed up the process
+    :param n_workers: int : number of processes fitting the models, all the cores by default (1 to run without workers)
+    :param chunksize: int : number of names sent to a process at once
+    :param resume: bool : if True, the names already computed in the checkpoint (CHECKPOINT_PATH_SARIMA) are not computed again
     """
 
     print_step("Using the mean difference results to speed up the SARIMA method...")
@@ -233,12 +427,13 @@ def compute_all_influence_sarima(namesData, mean_df):
 
     print(f"Using {len(sarima_df)} names to speed up the SARIMA method. (from {len(mean_df)} names)")
 
-    progress = np.zeros((2,)) # we use this to print the progress of the computation, first value is the number of names computed, second is the total number of names to compute
-    progress[1] = len(sarima_df)
+    # Index of the yearly counts per name, built once for all the names
+    names_index = get_names_index(namesData)
 
-    # We add a column "Influenced" to the DataFrame, and we fill it with the result of the function is_name_influenced (for each row)
-    sarima_df["Influenced"] = sarima_df.apply(lambda x: 
-                                                    is_name_influenced_sarima( x["Normalized_name"], namesData, x["Year"], progress), axis=1)
+    # We add a column "Influenced" to the DataFrame, the models are fitted in parallel, the workers only receive the names and the years
+    # The results are checkpointed while they are computed, and the final csv is built from the checkpoint
+    sarima_df["Influenced"] = compute_with_checkpoint(is_name_influenced_sarima, names_index, sarima_df, CHECKPOINT_PATH_SARIMA, "sarima",
+                                                      {"nb_years": 5, "tolerance": 0.82}, resume=resume, n_workers=n_workers, chunksize=chunksize)
 
     # Write the data
     sarima_df.to_csv(RESULTS_PATH_SARIMA, index=False)
@@ -247,17 +442,22 @@ def compute_all_influence_sarima(namesData, mean_df):
 
     return sarima_df
 
-def is_name_influenced_prophet(name, names_data, year, plot=False):
+def is_name_influenced_prophet(name, names_data, year, plot=False, timeout=None, on_error="nan"):
     """
     Function to check if a name is influenced by a movie using the prophet method
     :param name: str : The name we want to check
-    :param names_data: NamesData : The names data of the country we want / or global
+    :param names_data: NamesData or NameSeriesIndex : The names data of the country we want / or global
     :param year: int : The year of the movie
-    :return: bool : True if the name is influenced, False otherwise
+    :param timeout: float : maximum number of seconds for the fit (optional)
+    :param on_error: str : what to return when the fit fails or times out: "nan" (unknown), "zero" (not influenced) or "raise"
+    :return: int : 1 if the name is influenced, 0 otherwise (NaN or 0 if the fit failed, depending on on_error)
     """
+    if on_error not in PROPHET_ERROR_POLICIES:
+        raise ValueError(f"on_error must be one of {PROPHET_ERROR_POLICIES}, not {on_error}")
+
     try:
         # Some of the retreived characters names are not 
-        pred = naming_prediction.predict_naming_prophet(names_data, name, year, 10, plot=plot)
+        pred = naming_prediction.predict_naming_prophet(names_data, name, year, 10, plot=plot, timeout=timeout)
 
         # We use our decision method to see if the name is influenced
         predicted_curve = pred["Predicted Count"]
@@ -273,21 +473,31 @@ def is_name_influenced_prophet(name, names_data, year, plot=False):
             return 1
         else:
             return 0
-    except ValueError as e:
-        print(f"Error with {name} in {year} : {e}")
-        return 0
+    except PROPHET_FIT_ERRORS as e:
+        if on_error == "raise":
+            raise
+        print(f"Error with {name} in {year} : {e!r}")
+        return 0 if on_error == "zero" else np.nan
 
 
-def compute_all_influence_prophet(mean_df, namesData, output_path=None):
+def compute_all_influence_prophet(mean_df, namesData, output_path=None, n_workers=None, chunksize=8, timeout=PROPHET_TIMEOUT, on_error="nan", resume=True):
     """
     Function to compute the influenced names by the movies using the prophet method
 
     :param main_characters: DataFrame : The names of the main character in the top movies
-    :param namesData: NamesData : The names data of the country we want / or global
+    :param namesData: NamesData or NameSeriesIndex : The names data of the country we want / or global
     :param mean_df: DataFrame : The DataFrame containing the mean difference of the names -> will allow to speed up the process
     :param output_path: str : The path where to save the results (optional)
+    :param n_workers: int : number of processes fitting the models, all the cores by default (1 to run without workers)
+    :param chunksize: int : number of names sent to a process at once
+    :param timeout: float : maximum number of seconds for one fit, None for no limit
+    :param on_error: str : what to do when a fit fails or times out: "nan" (unknown), "zero" (not influenced) or "raise"
+    :param resume: bool : if True, the names already computed in the checkpoint (CHECKPOINT_PATH_PROPHET) are not computed again
     """
 
+    if on_error not in PROPHET_ERROR_POLICIES:
+        raise ValueError(f"on_error must be one of {PROPHET_ERROR_POLICIES}, not {on_error}")
+
     print_step("Using the mean difference results to speed up the Prophet method...")
     # We keep only the names were the column Influence is not < 0 and not = inf (excluded cases and already marked as created)
     prophet_df = mean_df[mean_df["Influence"] > 0].copy()
@@ -297,8 +507,17 @@ def compute_all_influence_prophet(mean_df, namesData, output_path=None):
 
     print(f"Using {len(prophet_df)} names to speed up the SARIMA method. (from {len(mean_df)} names)")
 
-    # Now we want to apply the prophet method to the names, it is a fast process, no need to log the progress
-    prophet_df["Influenced"] = prophet_df.apply(lambda x: is_name_influenced_prophet( x["Normalized_name"], namesData, x["Year"]), axis=1)
+    # Index of the yearly counts per name, built once for all the names
+    names_index = get_names_index(namesData)
+
+    # The models are fitted in parallel, each process reuses its stan backend and only receives the names and the years
+    # The failed fits are NaN while computing, they are not checkpointed (computed again on resume) and the policy is applied at the end
+    is_influenced = partial(is_name_influenced_prophet, timeout=timeout, on_error="raise" if on_error == "raise" else "nan")
+    prophet_df["Influenced"] = compute_with_checkpoint(is_influenced, names_index, prophet_df, CHECKPOINT_PATH_PROPHET, "prophet",
+                                                       {"nb_years": 10, "tolerance": 0.9, "timeout": timeout},
+                                                       resume=resume, n_workers=n_workers, chunksize=chunksize, is_failure=pd.isna)
+    if on_error == "zero":
+        prophet_df["Influenced"] = prophet_df["Influenced"].fillna(0)
 
     # Write the data
     if(output_path is not None):
@@ -330,13 +549,16 @@ def compute_all_influence_mean(main_characters, namesData, output_path=None):
     Function to compute the influenced names by the movies using the mean comparison method
 
     :param main_characters: DataFrame : The names of the main character in the top movies
-    :param namesData: NamesData : The names data of the country we want / or global
+    :param namesData: NamesData or NameSeriesIndex : The names data of the country we want / or global
     :param output_path: str : The path where to save the results (optional)
     """
 
     print_step("Computing the influenced names using the mean difference...")
 
-    namesData.check_clean_data()
+    # Index of the yearly counts per name, built once for all the names
+    if isinstance(namesData, names_data.NamesData):
+        namesData.check_clean_data()
+    names_index = get_names_index(namesData)
 
     # This method is way faster than the SARIMA method, so instead of keeping only the first part of the characters name, we iterate over the names using the split method
     ## We split the names in main_characters so that each row has only a one word name (Princess Leia -> Princess, Leia)
@@ -349,14 +571,10 @@ def compute_all_influence_mean(main_characters, namesData, output_path=None):
 
     print(f"Splitting the names in {len(main_characters)} main characters to {len(splitted_main_characters)} names")
 
-    intersection = names_utils.chars_and_names_intersection(splitted_main_characters, namesData)
+    intersection = names_utils.chars_and_names_intersection(splitted_main_characters, names_index)
 
-    progress = np.zeros((2,)) # we use this to print the progress of the computation, first value is the number of names computed, second is the total number of names to compute
-    progress[1] = len(intersection)
-    
-    # We add a column "Influence" to the DataFrame, and we fill it with the result of the function is_name_influenced (for each row) /!\ This is not a boolean but a difference of mean
-    intersection["Influence"] = intersection.apply(lambda x: 
-                                                    naming_prediction.difference_in_means( namesData, x["Normalized_name"], x["Year"], 5, progress), axis=1)
+    # We add a column "Influence" to the DataFrame, computed for all the rows at once /!\ This is not a boolean but a difference of mean
+    intersection["Influence"] = naming_prediction.batch_difference_in_means(names_index, intersection["Normalized_name"], intersection["Year"], 5)
 
     intersection  = intersection.sort_values(by="Influence", ascending=False)
 
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The tests import the project as the scripts do (src.*), from the root folder
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# interval_test is a helper of the pipeline (imported by src.utils.pipelines), not a test file
+collect_ignore = ['interval_test.py']
@@ -0,0 +1,76 @@
+import math
+
+import src.utils.cache_utils as cache_utils
+from src.data.movies_char_data import CharacterData, MovieData
+from src.data.names_data import NamesData
+from src.utils import general_utils
+
+
+def test_hash_class_code_depends_on_the_helpers_of_the_cleaner(monkeypatch):
+    before = {cls: cache_utils.hash_class_code(cls) for cls in [NamesData, CharacterData, MovieData]}
+
+    # a change in general_utils (transliterate) changes the code of the cleaners calling it
+    hash_file = cache_utils.hash_file
+    monkeypatch.setattr(cache_utils, 'hash_file',
+                        lambda path: 'changed' if path == general_utils.__file__ else hash_file(path))
+
+    assert cache_utils.hash_class_code(NamesData) != before[NamesData]
+    assert cache_utils.hash_class_code(CharacterData) != before[CharacterData]
+    # MovieData does not call it
+    assert cache_utils.hash_class_code(MovieData) == before[MovieData]
+
+
+def test_checkpoint_store_resumes_the_flushed_results(tmp_path):
+    path = str(tmp_path / 'checkpoints' / 'prophet.csv')
+
+    store = cache_utils.CheckpointStore(path, 'prophet', {'nb_years': 10}, flush_every=2)
+    store.add('NA', 2000, 1)
+    store.add('ANNA', 2001, float('nan'))
+    # not flushed yet when the computation crashes
+    store.add('LEO', 2002, 0)
+
+    resumed = cache_utils.CheckpointStore(path, 'prophet', {'nb_years': 10})
+    assert len(resumed) == 2
+    # "NA" is a name, not a missing value
+    assert ('NA', 2000) in resumed and ('LEO', 2002) not in resumed
+    assert resumed.missing(['NA', 'LEO', 'LEO', 'ANNA'], [2000, 2002, 2002, 2001]) == (['LEO'], [2002])
+    result, nan_result = resumed.get_results(['NA', 'ANNA'], [2000, 2001])
+    assert result == 1 and math.isnan(nan_result)
+
+    # the results of other parameters or methods are ignored
+    assert len(cache_utils.CheckpointStore(path, 'prophet', {'nb_years': 5})) == 0
+    assert len(cache_utils.CheckpointStore(path, 'sarima', {'nb_years': 10})) == 0
+
+
+def test_checkpoint_store_flushes_on_exit(tmp_path):
+    path = str(tmp_path / 'sarima.csv')
+    try:
+        with cache_utils.CheckpointStore(path, 'sarima', flush_every=100) as store:
+            store.add('ANNA', 2000, 1)
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+
+    store = cache_utils.CheckpointStore(path, 'sarima')
+    assert store.get_results(['ANNA'], [2000]) == [1]
+    store.clear()
+    assert len(store) == 0 and len(cache_utils.CheckpointStore(path, 'sarima')) == 0
+
+
+def test_checkpoint_store_computes_the_failures_again_on_resume(tmp_path):
+    path = str(tmp_path / 'prophet.csv')
+
+    with cache_utils.CheckpointStore(path, 'prophet', is_failure=math.isnan) as store:
+        store.add('ANNA', 2000, 1)
+        store.add('LEO', 2001, float('nan'))
+        # the failure is still returned in this run
+        result, failure = store.get_results(['ANNA', 'LEO'], [2000, 2001])
+        assert result == 1 and math.isnan(failure)
+
+    # but it is not written: the resumed computation fits it again
+    resumed = cache_utils.CheckpointStore(path, 'prophet', is_failure=math.isnan)
+    assert len(resumed) == 1 and ('LEO', 2001) not in resumed
+    assert resumed.missing(['ANNA', 'LEO'], [2000, 2001]) == (['LEO'], [2001])
+    resumed.add('LEO', 2001, 0)
+    resumed.flush()
+    assert cache_utils.CheckpointStore(path, 'prophet').get_results(['ANNA', 'LEO'], [2000, 2001]) == [1, 0]
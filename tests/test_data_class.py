@@ -0,0 +1,171 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.data_class import read_frame, write_frame
+from src.data.movies_char_data import CharacterData, MovieData
+from src.data.names_data import FranceNamesData, NamesData, USNamesData
+
+# Raw CMU files in the format of the dumps (tab separated, the first line is read as the header)
+MOVIES_RAW = [
+    ['975900', '/m/03vyhn', 'Ghosts of Mars', '2001-08-24', '14010832', '98.0',
+     '{"/m/02h40lc": "English Language"}', '{"/m/09c7w0": "United States of America"}',
+     '{"/m/01jfsb": "Thriller", "/m/06n90": "Science Fiction"}'],
+    ['3196793', '/m/08yl5d', 'Getting Away with Murder', '2000-02-16', '', '95.0',
+     '{"/m/02h40lc": "English Language"}', '{"/m/09c7w0": "United States of America"}',
+     '{"/m/02n4kr": "Mystery", "/m/03bxz7": "Biographical film"}'],
+    ['28463795', '/m/0crgdbh', 'Brun bitter', '1988', '', '83.0',
+     '{"/m/05f_3": "Norwegian Language"}', '{"/m/05b4w": "Norway"}',
+     '{"/m/0lsxr": "Crime Fiction", "/m/07s9rl0": "Drama"}'],
+]
+
+# some ages are missing in every chunk, as in the dump (the column is read as floats)
+CHARACTERS_RAW = [
+    ['975900', '/m/03vyhn', '2001-08-24', 'Akooshay', '1958-08-26', 'F', '1.62', '', 'Wanda De Jesus', '42',
+     '/m/0bgchxw', '/m/0bgcj3x', '/m/03wcfv7'],
+    ['975900', '/m/03vyhn', '2001-08-24', 'Lieutenant Melanie Ballard', '1974-08-15', 'F', '1.78', '/m/044038p',
+     'Natasha Henstridge', '', '/m/0jys3m', '/m/0bgchn4', '/m/0346l4'],
+    ['3196793', '/m/08yl5d', '2000-02-16', 'Desolation Williams', '1969-06-15', 'M', '1.727', '/m/0x67',
+     'Ice Cube', '', '/m/0jys3g', '/m/0bgchn_', '/m/01vw26l'],
+]
+
+
+# Raw names files (with their header), a (year, name, sex) is spread over several rows / chunks
+US_RAW = ['Year,Name,Sex,Count', '2000,Anna,F,10', '2000,Anna,M,4', '2000,Leo,M,7', '2001,Leo,F,3', '2001,Leo,M,3',
+          '2001,Anna,F,12', '2002,Zoe,F,5', '2002,Zoe,M,6']
+FRANCE_RAW = ['sexe;preusuel;annais;dpt;nombre', '2;ÉLODIE;2000;75;4', '2;ELODIE;2000;13;3', '1;LÉO;2000;75;5',
+              '1;_PRENOMS_RARES;2000;75;100', '2;ELODIE;XXXX;XX;8', '1;LEO;2000;13;2', '2;Élodie;2001;75;1', '1;LEO;2001;XX;6',
+              '2;ELODIE;2000;69;1']
+
+
+def write_raw(path, rows):
+    # the first row is repeated: it is read as the header of the file
+    with open(path, 'w', encoding='utf-8') as file:
+        for row in rows[:1] + rows:
+            file.write('\t'.join(row) + '\n')
+
+
+@pytest.fixture
+def folders(tmp_path):
+    raw, clean = tmp_path / 'raw', tmp_path / 'clean'
+    raw.mkdir()
+    clean.mkdir()
+    write_raw(raw / 'movie.metadata.tsv', MOVIES_RAW)
+    write_raw(raw / 'character.metadata.tsv', CHARACTERS_RAW)
+    return f'{raw}/', f'{clean}/'
+
+
+def make(cls, folders, file_name, **kwargs):
+    data = cls(cls.__name__, file_name, **kwargs)
+    data.raw_path, data.clean_path = folders
+    return data
+
+
+@pytest.mark.parametrize('cls, file_name, kwargs', [
+    (MovieData, 'movie.metadata.tsv', {}),
+    (CharacterData, 'character.metadata.tsv', {}),
+    (CharacterData, 'character.metadata.tsv', {'chunksize': 2}),
+])
+def test_pipeline_twice_reloads_the_clean_data(folders, capsys, cls, file_name, kwargs):
+    first = make(cls, folders, file_name, **kwargs)
+    fingerprint = first.pipeline()
+    assert 'using the saved clean data' not in capsys.readouterr().out
+
+    # cache hit: the clean data is loaded back (the clean data has less columns than the raw data)
+    second = make(cls, folders, file_name, **kwargs)
+    assert second.pipeline() == fingerprint
+    assert 'using the saved clean data' in capsys.readouterr().out
+
+    pd.testing.assert_frame_equal(second.clean_df.reset_index(drop=True), first.clean_df.reset_index(drop=True))
+    second.check_clean_data()
+
+
+def test_pipeline_runs_again_when_the_raw_data_changed(folders, capsys):
+    fingerprint = make(MovieData, folders, 'movie.metadata.tsv').pipeline()
+
+    write_raw(f'{folders[0]}movie.metadata.tsv', MOVIES_RAW[:2])
+    movies = make(MovieData, folders, 'movie.metadata.tsv')
+    assert movies.pipeline() != fingerprint
+    assert 'using the saved clean data' not in capsys.readouterr().out
+    assert len(movies) == 2
+
+
+def test_load_clean_data_renames_the_columns_of_old_csv_files(tmp_path):
+    # csv files written by older versions can have other headers, the columns of the names data are set on load
+    pd.DataFrame({'annee': [2000], 'prenom': ['ANNA'], 'sexe': ['F'], 'nombre': [3]}).to_csv(tmp_path / 'france.csv', index=False)
+
+    names = FranceNamesData('France', 'france.csv', loaded=False, storage_format='csv')
+    names.clean_path = f'{tmp_path}/'
+    names.load_clean_data()
+    assert list(names.clean_df.columns) == ['Year', 'Name', 'Sex', 'Count']
+
+
+@pytest.mark.parametrize('cls, file_name, lines, separator', [
+    (USNamesData, 'us.csv', US_RAW, ','),
+    (FranceNamesData, 'france.csv', FRANCE_RAW, ';'),
+    (CharacterData, 'character.metadata.tsv', None, '\t'),
+])
+@pytest.mark.parametrize('chunksize', [1, 2, 3])
+def test_streaming_gives_the_clean_data_of_the_whole_file(folders, cls, file_name, lines, separator, chunksize):
+    if lines is not None:
+        with open(f'{folders[0]}{file_name}', 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    whole = make(cls, folders, file_name)
+    whole.separator = separator
+    whole.clean_data()
+    streamed = make(cls, folders, file_name, chunksize=chunksize)
+    streamed.separator = separator
+    streamed.clean_data()
+
+    assert len(whole) > 0
+    pd.testing.assert_frame_equal(streamed.clean_df.reset_index(drop=True), whole.clean_df.reset_index(drop=True))
+
+
+def names_frame(n=300):
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'Year': rng.integers(1960, 2020, size=n), 'Name': rng.choice(['ANNA', "O'BRIEN", 'JEAN-LUC'], size=n),
+                         'Sex': rng.choice(['F', 'M'], size=n), 'Count': rng.integers(1, 70000, size=n)})
+
+
+def test_write_frame_and_read_frame_keep_the_dtypes(tmp_path):
+    df = names_frame().astype(NamesData.schema)
+    df['Date'] = pd.to_datetime('2000-01-01') + pd.to_timedelta(df['Year'].astype(int), unit='D')
+    df['Height'] = np.where(df['Count'] % 2 == 0, np.nan, 1.7)
+    df['Actor'] = np.where(df['Count'] % 3 == 0, None, 'ACTOR')
+
+    path = str(tmp_path / 'data.parquet')
+    write_frame(df, path)
+    pd.testing.assert_frame_equal(read_frame(path), df)
+    pd.testing.assert_frame_equal(read_frame(path, columns=['Name', 'Count']), df[['Name', 'Count']])
+
+
+def test_csv_fallback_gets_the_dtypes_of_the_schema_back(tmp_path, capsys):
+    df = names_frame().astype(NamesData.schema)
+    # clean data written as csv by an older version, the parquet file does not exist
+    write_frame(df, str(tmp_path / 'names.csv'))
+
+    names = NamesData('Names', 'names.csv', loaded=False)
+    names.clean_path = f'{tmp_path}/'
+    names.load_clean_data()
+    assert 'reading the csv file instead' in capsys.readouterr().out
+    assert names.clean_df.dtypes.to_dict() == df.dtypes.to_dict()
+    pd.testing.assert_frame_equal(names.clean_df, df, check_categorical=False)
+
+
+def test_memory_report_before_and_after_the_schema():
+    names = NamesData('Names', 'names.csv', loaded=False)
+    names.clean_df = names_frame()
+
+    # schema not applied yet: "after" is what the schema would give
+    report = names.memory_report()
+    assert list(report.index) == ['Year', 'Name', 'Sex', 'Count', 'Total']
+    assert report.loc['Year', 'dtype_before'] == 'int64' and report.loc['Year', 'dtype_after'] == 'int16'
+    assert report.loc['Name', 'dtype_after'] == 'category'
+    assert report.loc['Year', 'bytes_after'] == 2 * len(names) and report.loc['Count', 'bytes_after'] == 4 * len(names)
+    assert report.loc['Name', 'bytes_after'] < report.loc['Name', 'bytes_before']
+    assert report.loc['Total', 'bytes_before'] == names.clean_df.memory_usage(index=False, deep=True).sum()
+
+    # schema applied: the memory used before is measured with the previous dtypes
+    names.apply_schema()
+    pd.testing.assert_frame_equal(names.memory_report(), report)
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+from src.utils.general_utils import transliterate
+
+
+def test_transliterate_is_unidecode_on_each_row():
+    column = pd.Series(['ÉLODIE', 'Zoé', 'ÉLODIE', None, 'Björn', 'LEO', np.nan, 'Ægir', 'Łukasz', 'Zoé'],
+                       index=range(100, 110), name='Name')
+
+    result = transliterate(column)
+    expected = column.map(lambda value: unidecode(value) if isinstance(value, str) else value)
+    pd.testing.assert_series_equal(result, expected.fillna(np.nan))
+    assert result.tolist()[:3] == ['ELODIE', 'Zoe', 'ELODIE']
+    # the input is not modified
+    assert column[100] == 'ÉLODIE'
+
+
+def test_transliterate_categorical_column():
+    column = pd.Series(['Zoé', 'Zoé', 'LÉO'], dtype='category')
+    assert transliterate(column).tolist() == ['Zoe', 'Zoe', 'LEO']
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.genre_matrix import GenreMatrix
+
+GENRES = pd.Series(['Drama, Comedy', 'Comedy', np.nan, 'Drama, Drama, Thriller', 'Comedy'])
+
+
+def exploded(genres=GENRES):
+    # reference: split and explode the Genres column as the analyses did before
+    df = pd.DataFrame({'Genres': genres.str.split(', '), 'Value': [1.0, 2.0, 3.0, 4.0, np.nan]}).explode('Genres')
+    return df.dropna(subset=['Genres']).drop_duplicates().reset_index(names='Row')
+
+
+def test_from_strings_counts_and_sums_as_the_exploded_rows():
+    matrix = GenreMatrix.from_strings(GENRES)
+    reference = exploded()
+
+    assert list(matrix.genres) == ['Drama', 'Comedy', 'Thriller']
+    assert len(matrix) == len(GENRES)
+    pd.testing.assert_series_equal(matrix.counts(), reference['Genres'].value_counts().reindex(matrix.genres),
+                                   check_names=False)
+    pd.testing.assert_series_equal(matrix.sums([1.0, 2.0, 3.0, 4.0, np.nan]),
+                                   reference.groupby('Genres')['Value'].sum().reindex(matrix.genres), check_names=False)
+
+
+def test_from_lists_is_the_same_matrix_as_from_strings():
+    lists = [['Drama', 'Comedy'], ['Comedy'], None, ['Drama', 'Drama', 'Thriller'], ['Comedy']]
+    from_lists, from_strings = GenreMatrix.from_lists(lists), GenreMatrix.from_strings(GENRES)
+    assert list(from_lists.genres) == list(from_strings.genres)
+    assert (from_lists.matrix != from_strings.matrix).nnz == 0
+
+
+def test_grouped_sums_and_rows():
+    matrix = GenreMatrix.from_strings(GENRES)
+    keys = np.array([0, 1, 0, 1, -1])
+
+    sums = matrix.grouped_sums(keys).toarray()
+    # Drama: rows 0 (key 0) and 3 (key 1), Comedy: rows 0 (key 0) and 1 (key 1), row 4 is skipped
+    np.testing.assert_array_equal(sums, [[1, 1], [1, 1], [0, 1]])
+    np.testing.assert_array_equal(matrix.rows_of_genre('Comedy'), [0, 1, 4])
+    assert len(matrix.rows_of_genre('Western')) == 0
+
+
+def test_explode_keeps_the_order_of_the_rows():
+    matrix = GenreMatrix.from_strings(GENRES)
+    df = pd.DataFrame({'Value': range(len(GENRES))})
+
+    result = matrix.explode(df, ['Comedy', 'Thriller'])
+    assert result['Value'].tolist() == [0, 1, 3, 4]
+    assert result['Genres'].tolist() == ['Comedy', 'Comedy', 'Thriller', 'Comedy']
+
+
+def test_take_drop_and_save_load(tmp_path):
+    matrix = GenreMatrix.from_strings(GENRES, ids=[10, 11, 12, 13, 14])
+
+    taken = matrix.take(matrix.rows_of_ids([11, 14]))
+    assert list(taken.genres) == ['Comedy'] and list(taken.ids) == [11, 14]
+    assert list(matrix.drop(['Drama']).genres) == ['Comedy', 'Thriller']
+    np.testing.assert_array_equal(matrix.rows_of_ids([13, 99]), [3, -1])
+
+    path = str(tmp_path / 'genres.npz')
+    matrix.save(path)
+    loaded = GenreMatrix.load(path)
+    assert list(loaded.genres) == list(matrix.genres)
+    np.testing.assert_array_equal(loaded.ids, matrix.ids)
+    assert (loaded.matrix != matrix.matrix).nnz == 0
+
+
+def test_trend_by_genres_uses_the_genres_of_the_given_rows(tmp_path, monkeypatch):
+    # plotly and matplotlib are needed by the module
+    trend_by_genres = pytest.importorskip('src.models.trend_by_genres')
+
+    # the genre matrix saved with the clean movies has other genres for the same movies, it is not used
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'clean' / 'movies_char').mkdir(parents=True)
+    GenreMatrix.from_strings(pd.Series(['Comedy', 'Comedy']), ids=[1, 2]).save('data/clean/movies_char/CMU_movies_genres.npz')
+
+    df = pd.DataFrame({'Wikipedia_movie_ID': [1, 2], 'Genres': ['Drama', np.nan]})
+    _, genres = trend_by_genres.process_genres(df)
+    assert genres.counts().to_dict() == {'Drama': 1}
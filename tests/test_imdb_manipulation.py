@@ -0,0 +1,224 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.utils.imdb_manipulation as imdb_manipulation
+
+QUERIES = ['the matrix', 'star wars', 'zzz unknown']
+CHOICES = ['the matrlx', 'star war', 'other title']
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    # (queries, choices) of the calls to match_titles with some queries
+    calls = []
+    match_titles = imdb_manipulation.match_titles
+
+    def spy(queries, choices, threshold=90):
+        if len(queries):
+            calls.append((sorted(queries), sorted(choices)))
+        return match_titles(queries, choices, threshold=threshold)
+
+    monkeypatch.setattr(imdb_manipulation, 'match_titles', spy)
+    return calls
+
+
+def as_dict(matches):
+    return dict(zip(matches['query'], matches['match']))
+
+
+def test_first_call_is_match_titles_and_the_next_ones_reuse_it(tmp_path, calls):
+    cache_path = str(tmp_path / 'matches.parquet')
+
+    first = imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+    pd.testing.assert_frame_equal(first, imdb_manipulation.match_titles(QUERIES, CHOICES))
+    assert as_dict(first) == {'the matrix': 'the matrlx', 'star wars': 'star war'}
+
+    # nothing new: nothing is matched again, the queries without a match included
+    calls.clear()
+    pd.testing.assert_frame_equal(imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path), first)
+    assert calls == []
+
+
+def test_other_scorer_version_matches_again(tmp_path, calls, monkeypatch):
+    cache_path = str(tmp_path / 'matches.parquet')
+    imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+
+    monkeypatch.setattr(imdb_manipulation, 'scorer_version', lambda threshold: 'other')
+    calls.clear()
+    imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+    assert calls == [(sorted(QUERIES), sorted(CHOICES))]
+
+
+def test_new_choices_only_replace_a_cached_match_with_a_better_score(tmp_path, calls):
+    cache_path = str(tmp_path / 'matches.parquet')
+    imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+
+    # 'thx matrix' has the score of the cached match (90) and is the first choice, 'stars wars' is better than 'star war'
+    calls.clear()
+    choices = ['thx matrix', 'stars wars'] + CHOICES
+    matches = imdb_manipulation.match_titles_cached(QUERIES, choices, cache_path)
+    assert as_dict(matches) == {'the matrix': 'the matrlx', 'star wars': 'stars wars'}
+    # the cached titles are only compared with the new choices
+    assert calls == [(sorted(QUERIES), ['stars wars', 'thx matrix'])]
+    assert as_dict(imdb_manipulation.match_titles(QUERIES, choices)) == {'the matrix': 'thx matrix', 'star wars': 'stars wars'}
+
+
+def test_removed_choice_matches_the_query_again(tmp_path, calls):
+    cache_path = str(tmp_path / 'matches.parquet')
+    imdb_manipulation.match_titles_cached(QUERIES, CHOICES + ['thx matrix'], cache_path)
+
+    calls.clear()
+    choices = ['thx matrix', 'star war', 'other title']
+    matches = imdb_manipulation.match_titles_cached(QUERIES, choices, cache_path)
+    assert as_dict(matches) == {'the matrix': 'thx matrix', 'star wars': 'star war'}
+    assert calls == [(['the matrix'], sorted(choices))]
+
+
+def test_query_without_match_is_found_by_a_new_choice(tmp_path, calls):
+    cache_path = str(tmp_path / 'matches.parquet')
+    imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+
+    matches = imdb_manipulation.match_titles_cached(QUERIES, CHOICES + ['zzz unknown!'], cache_path)
+    assert as_dict(matches)['zzz unknown'] == 'zzz unknown!'
+
+
+def test_runs_on_other_titles_do_not_evict_each_other(tmp_path, calls):
+    cache_path = str(tmp_path / 'matches.parquet')
+    imdb_manipulation.match_titles_cached(QUERIES[:1], CHOICES, cache_path)
+    imdb_manipulation.match_titles_cached(QUERIES[1:], CHOICES, cache_path)
+
+    calls.clear()
+    matches = imdb_manipulation.match_titles_cached(QUERIES, CHOICES, cache_path)
+    assert calls == []
+    pd.testing.assert_frame_equal(matches, imdb_manipulation.match_titles(QUERIES, CHOICES))
+
+    # the titles that are not queried are still compared with the new choices
+    imdb_manipulation.match_titles_cached(QUERIES[:1], CHOICES + ['stars wars'], cache_path)
+    calls.clear()
+    matches = imdb_manipulation.match_titles_cached(QUERIES, CHOICES + ['stars wars'], cache_path)
+    assert calls == [] and as_dict(matches)['star wars'] == 'stars wars'
+
+
+def extract_one(queries, choices, threshold=90):
+    from rapidfuzz import fuzz, process
+
+    matches = {}
+    for query in dict.fromkeys(queries):
+        match = process.extractOne(query, list(dict.fromkeys(choices)), scorer=fuzz.ratio, score_cutoff=threshold)
+        if match is not None:
+            matches[query] = match[:2]
+    return matches
+
+
+def test_match_titles_is_extract_one_on_ties_and_length_boundaries():
+    # 'abcdefghiyy' and 'abcdefghixx' have the same score (90, the threshold, at the limit of the length band): the first
+    # one wins, 'abcdefghixxx' is just outside of the band and 'abcdefg' has no match
+    choices = ['abcdefghixxx', 'abcdefghiyy', 'abcdefghixx']
+    matches = imdb_manipulation.match_titles(['abcdefghi', 'abcdefg', 'abcdefghi'], choices)
+
+    assert matches['score'].dtype == 'float64'
+    assert dict(zip(matches['query'], zip(matches['match'], matches['score']))) == extract_one(['abcdefghi', 'abcdefg'], choices)
+    assert matches['match'].tolist() == ['abcdefghiyy'] and matches['score'].tolist() == [90.0]
+
+
+def test_match_titles_is_extract_one_on_random_titles():
+    rng = np.random.default_rng(0)
+    queries = [''.join(rng.choice(list('abc '), size=rng.integers(3, 25))) for _ in range(200)]
+    # choices close to the queries (a few characters replaced), with duplicates and ties
+    choices = []
+    for query in rng.choice(queries, size=600):
+        start = rng.integers(0, len(query))
+        choices.append(query[:start] + ''.join(rng.choice(list('abc '), size=rng.integers(0, 3))) + query[start + rng.integers(0, 3):])
+
+    # small blocks: the queries of a length are split in several blocks
+    matches = imdb_manipulation.match_titles(queries, choices, max_cells=1000)
+    expected = extract_one(queries, choices)
+    assert len(expected) > 50
+    assert dict(zip(matches['query'], zip(matches['match'], matches['score']))) == expected
+    assert matches['query'].tolist() == [query for query in dict.fromkeys(queries) if query in expected]
+
+
+BASICS = ['tconst\ttitleType\tprimaryTitle\toriginalTitle\tisAdult\tstartYear\tendYear\truntimeMinutes\tgenres',
+          'tt01\tmovie\tThe Matrix\tThe Matrix\t0\t1999\t\\N\t136\tAction,Sci-Fi',
+          'tt02\tshort\tThe Matrix\tThe Matrix\t0\t1999\t\\N\t5\tShort',
+          'tt03\ttvSeries\tFriends\tFriends\t0\t1994\t2004\t22\tComedy',
+          'tt04\tmovie\tUntitled Project\t\\N\t0\t\\N\t\\N\t\\N\t\\N',
+          'tt05\tmovie\tThe Matrix\tThe Matrix\t0\t1999\t\\N\t136\tAction',
+          'tt06\tmovie\tAlien\tAlien\t0\t1979\t\\N\t117\tHorror']
+RATINGS = ['tconst\taverageRating\tnumVotes', 'tt01\t8.7\t2000000', 'tt02\t6.0\t100', 'tt04\t5.5\t10', 'tt05\t7.0\t500',
+           'tt06\t8.5\t900000']
+
+
+def write_dumps(path, basics, ratings):
+    for file, lines in [('title.basics.tsv', basics), ('title.ratings.tsv', ratings)]:
+        (path / file).write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    return write_dumps(tmp_path, BASICS, RATINGS)
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 100])
+def test_read_imdb_movies_keeps_the_movies_of_every_chunk(dumps, chunksize):
+    movies = imdb_manipulation.read_imdb_movies(dumps, chunksize=chunksize)
+
+    assert movies['tconst'].tolist() == ['tt01', 'tt04', 'tt05', 'tt06']
+    assert list(movies.columns) == ['tconst', 'primaryTitle', 'originalTitle', 'startYear']
+    # \N is a missing value, the years stay strings
+    assert movies['originalTitle'].isna().tolist() == [False, True, False, False]
+    assert movies['startYear'].tolist()[:1] == ['1999'] and pd.isna(movies['startYear'][1])
+
+
+def test_read_imdb_movies_ratings_reuses_the_parquet_cache(dumps, tmp_path, monkeypatch):
+    cache_path = str(tmp_path / 'cache' / 'movies_ratings.parquet')
+    first = imdb_manipulation.read_imdb_movies_ratings(dumps, cache_path)
+    assert first['numVotes'].tolist() == [2000000, 10, 500, 900000]
+    pd.testing.assert_frame_equal(first, imdb_manipulation.read_imdb_movies_ratings(dumps))
+
+    # the dumps did not change: the cache is read, and the hashes given are not computed again
+    hashes = imdb_manipulation.hash_imdb_dumps(dumps)
+    monkeypatch.setattr(imdb_manipulation, 'read_imdb_movies', lambda *args, **kwargs: pytest.fail('dumps read again'))
+    monkeypatch.setattr(imdb_manipulation.cache_utils, 'hash_file', lambda path: pytest.fail('dumps hashed again'))
+    cached = imdb_manipulation.read_imdb_movies_ratings(dumps, cache_path, hashes)
+    # parquet reads the missing strings as None
+    pd.testing.assert_frame_equal(cached.where(cached.notna(), np.nan), first)
+    monkeypatch.undo()
+
+    # a dump changed: read again
+    (tmp_path / 'title.ratings.tsv').write_text('\n'.join(RATINGS[:-1]) + '\n', encoding='utf-8')
+    assert len(imdb_manipulation.read_imdb_movies_ratings(dumps, cache_path)) == 3
+
+
+def old_get_movie_votes(datapath):
+    # first version of get_movie_votes (\N read as a string, groupby + apply), include_groups=False only avoids the warning
+    title_basics = pd.read_csv(f'{datapath}/title.basics.tsv', sep='\t', low_memory=False)
+    title_basics = title_basics[title_basics['titleType'] == 'movie']
+    title_ratings = pd.read_csv(f'{datapath}/title.ratings.tsv', sep='\t', low_memory=False)
+    title_basics_ratings = pd.merge(title_basics, title_ratings, on='tconst', how='inner')
+    title_basics_ratings = title_basics_ratings[['primaryTitle', 'originalTitle', 'numVotes', 'averageRating', 'startYear']].dropna()
+    return title_basics_ratings.groupby(['primaryTitle', 'startYear']).apply(lambda group: pd.Series({
+        'weightedAverageRating': round((group['numVotes'] * group['averageRating']).sum() / group['numVotes'].sum(), 2),
+        'totalVotes': group['numVotes'].sum()}), include_groups=False).reset_index()
+
+
+def test_movie_votes_and_blockbusters_are_the_old_groupby_apply(tmp_path):
+    # the same title and year with several ratings (weighted average to round), missing startYear and originalTitle
+    basics = BASICS + ['tt07\tmovie\tAlien\tAlien\t0\t1979\t\\N\t117\tHorror',
+                       'tt08\tmovie\tUntitled Project\tProjet\t0\t\\N\t\\N\t\\N\t\\N',
+                       'tt09\tmovie\tHeat\t\\N\t0\t1995\t\\N\t170\tCrime',
+                       'tt10\tmovie\tHeat\tHeat\t0\t1995\t\\N\t170\tCrime']
+    ratings = RATINGS + ['tt07\t7.9\t1001', 'tt08\t6.1\t7', 'tt09\t8.3\t700000', 'tt10\t8.2\t300001']
+    datapath = write_dumps(tmp_path, basics, ratings)
+
+    votes = imdb_manipulation.get_movie_votes(datapath)
+    expected = old_get_movie_votes(datapath)
+    # the missing startYear was the string \N
+    votes['startYear'] = votes['startYear'].fillna('\\N')
+    assert votes['totalVotes'].dtype == 'float64'
+    pd.testing.assert_frame_equal(votes, expected)
+
+    assert imdb_manipulation.is_blockbuster(votes, 300000, 7.5).tolist() == \
+        expected.apply(lambda row: imdb_manipulation.is_blockbuster(row, 300000, 7.5), axis=1).tolist() == [True, True, True, False]
@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.data.movies_char_data import MovieData, format_json_value, parse_json_values
+
+
+def old_parse_json_column(data, column_name):
+    # parser of the first version of MovieData (json.loads of the string with the ' replaced by ")
+    if pd.notna(data):
+        try:
+            data_dict = json.loads(data.replace("'", '"'))
+        except Exception:
+            return None
+        return ', '.join(format_json_value(value, column_name) for value in data_dict.values())
+    return None
+
+
+WITHOUT_APOSTROPHE = ['{"/m/02h40lc": "English Language", "/m/064_8sq": "French Language"}', '{}',
+                      "{'/m/09c7w0': 'United States of America'}", '{"/m/0hj3n0w": "Japanese Movies: Anime"}']
+WITH_APOSTROPHE = ['{"/m/0hqxf": "Children\'s", "/m/01z4y": "Comedy"}', '{"/m/02wtdps": "Women\'s cinema"}']
+MALFORMED = '{"/m/02h40lc": "English Language"'
+
+
+def test_values_without_apostrophe_are_parsed_as_before():
+    for data in WITHOUT_APOSTROPHE + [MALFORMED, None, np.nan]:
+        values = parse_json_values(data)
+        joined = None if values is None else ', '.join(format_json_value(value, 'Genres') for value in values)
+        assert joined == old_parse_json_column(data, 'Genres')
+
+
+def test_values_with_an_apostrophe_are_now_parsed():
+    for data in WITH_APOSTROPHE:
+        assert old_parse_json_column(data, 'Genres') is None
+    assert parse_json_values(WITH_APOSTROPHE[0]) == ["Children's", 'Comedy']
+    assert parse_json_values(WITH_APOSTROPHE[1]) == ["Women's cinema"]
+
+
+def test_parse_json_series_counts_the_rows_that_could_not_be_parsed():
+    movies = MovieData('Movies', 'movies.tsv', loaded=False)
+    column = pd.Series([WITHOUT_APOSTROPHE[3], MALFORMED, None, MALFORMED, WITH_APOSTROPHE[0], 'not a dictionary'], index=range(10, 16))
+
+    parsed = movies.parse_json_series(column, 'Genres')
+    assert parsed.tolist() == ['Anime', None, None, None, "Children's, Comedy", None]
+    assert parsed.index.equals(column.index)
+    # the missing value is not a failure, the malformed string is counted once per row
+    assert movies.parse_failures['Genres'] == 3
+    assert movies.json_lists['Genres'].tolist() == [('Anime',), None, None, None, ("Children's", 'Comedy'), None]
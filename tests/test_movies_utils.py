@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils.movies_utils import duplicated_rows, join_movies_characters
+
+
+@pytest.fixture
+def movies():
+    return pd.DataFrame({'Wikipedia_movie_ID': [30, 10, 20, 40],
+                         'Movie_name': ['C', 'A', 'B', 'D'],
+                         'Release_date': pd.to_datetime(['2001-01-01', '1999-05-02', None, '2010-03-04'])})
+
+
+@pytest.fixture
+def characters():
+    # characters of movies in any order, with a wrong date, a missing date and a movie that is not in the movies data
+    return pd.DataFrame({'Wikipedia_movie_ID': [10, 30, 10, 20, 50, 30, 40],
+                         'Release_date': pd.to_datetime(['1999-05-02', '2001-01-01', '1999-05-02', None, '2000-01-01',
+                                                         '2001-01-01', '2011-01-01']),
+                         'Character_name': ['X', 'Y', 'Z', 'W', 'V', 'U', 'T'],
+                         'Actor_age': [30.0, np.nan, 25.0, 40.0, 20.0, 50.0, 60.0]},
+                        index=[7, 3, 5, 1, 0, 2, 9])
+
+
+def test_join_movies_characters_is_the_inner_merge(movies, characters):
+    expected = pd.merge(movies, characters, on=['Wikipedia_movie_ID', 'Release_date'], how='inner')
+    pd.testing.assert_frame_equal(join_movies_characters(movies, characters), expected)
+
+
+def test_join_movies_characters_falls_back_on_merge(movies, characters):
+    # duplicated movie ids, and columns in both tables (suffixes)
+    for left, right in [(pd.concat([movies, movies.iloc[:1]], ignore_index=True), characters),
+                        (movies, characters.assign(Movie_name='name'))]:
+        expected = pd.merge(left, right, on=['Wikipedia_movie_ID', 'Release_date'], how='inner')
+        pd.testing.assert_frame_equal(join_movies_characters(left, right), expected)
+
+
+def test_duplicated_rows_is_duplicated(characters):
+    df = pd.concat([characters, characters.iloc[[0, 3]], characters.iloc[[1]].assign(Actor_age=1.0)], ignore_index=True)
+    pd.testing.assert_series_equal(duplicated_rows(df), df.duplicated())
+    subset = ['Wikipedia_movie_ID', 'Release_date', 'Character_name']
+    pd.testing.assert_series_equal(duplicated_rows(df, subset), df.duplicated(subset))
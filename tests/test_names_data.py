@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.names_data import NamesData, most_frequent_sex_mask
+
+
+def names_data(df):
+    names = NamesData('Test', 'test.csv', loaded=False)
+    names.clean_df = df
+    return names
+
+
+def test_fill_missing_years_reads_as_the_dense_gap_free_table():
+    df = pd.DataFrame({'Year': [2000, 2002, 2001, 2003],
+                       'Name': ['ANNA', 'ANNA', 'ZOE', 'ZOE'],
+                       'Sex': ['F', 'F', 'F', 'F'],
+                       'Count': [5, 7, 0, 2]})
+    names = names_data(df.copy())
+
+    filled = names.fill_missing_years()
+    expected = pd.DataFrame([[5, 0, 7, 0], [0, 0, 0, 2]],
+                            index=pd.Index(['ANNA', 'ZOE'], name='Name'),
+                            columns=pd.RangeIndex(2000, 2004, name='Year'))
+    pd.testing.assert_frame_equal(filled.sparse.to_dense(), expected)
+    assert filled.loc['ANNA'].tolist() == [5, 0, 7, 0]
+
+    # only the non-zero counts are stored, and the clean data is not modified
+    assert filled.sparse.to_coo().nnz == 3
+    pd.testing.assert_frame_equal(names.clean_df, df)
+
+
+def test_fill_missing_years_needs_the_sex_handling():
+    df = pd.DataFrame({'Year': [2000, 2000], 'Name': ['ALEX', 'ALEX'], 'Sex': ['F', 'M'], 'Count': [5, 7]})
+    with pytest.raises(ValueError):
+        names_data(df).fill_missing_years()
+
+    names = names_data(df)
+    names.sex_handling()
+    assert names.fill_missing_years().sparse.to_dense().loc['ALEX', 2000] == 7
+
+
+def old_sex_handling(df):
+    # first version of sex_handling: sum per (Year, Name, Sex), idxmax per (Year, Name) and merge back
+    group = df.groupby(['Year', 'Name', 'Sex'], as_index=False)['Count'].sum()
+    winners = group.loc[group.groupby(['Year', 'Name'])['Count'].idxmax()]
+    return pd.merge(df, winners[['Year', 'Name', 'Sex']], on=['Year', 'Name', 'Sex'], how='inner')
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_sex_handling_keeps_the_rows_of_the_old_groupby_idxmax(categorical):
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({'Year': rng.integers(2000, 2010, size=n),
+                       'Name': rng.choice(['ANNA', 'LEO', 'ALEX', 'CAMILLE', 'SASHA'], size=n),
+                       'Sex': rng.choice(['F', 'M'], size=n),
+                       # small counts -> many ties, and a (Year, Name, Sex) can have several rows
+                       'Count': rng.integers(0, 3, size=n)})
+    df.loc[[3, 7], 'Name'] = None
+    if categorical:
+        df = df.astype({'Name': 'category', 'Sex': 'category'})
+
+    expected = old_sex_handling(df.astype({'Name': object, 'Sex': object}))
+    kept = df[most_frequent_sex_mask(df)]
+    assert len(kept) == len(expected)
+
+    by_key = ['Year', 'Name', 'Sex', 'Count']
+    pd.testing.assert_frame_equal(kept.astype({'Name': object, 'Sex': object}).sort_values(by_key).reset_index(drop=True),
+                                  expected.sort_values(by_key).reset_index(drop=True))
+
+    # the sex handling keeps the order of the rows
+    names = names_data(df.copy())
+    pd.testing.assert_frame_equal(names.sex_handling(), kept.reset_index(drop=True))
+
+
+def test_sex_handling_keeps_f_on_a_tie():
+    df = pd.DataFrame({'Year': [2000, 2000, 2000, 2001, 2001], 'Name': ['ALEX', 'ALEX', 'ALEX', 'ALEX', 'ALEX'],
+                       'Sex': ['M', 'F', 'F', 'M', 'F'], 'Count': [4, 1, 3, 5, 2]})
+    assert most_frequent_sex_mask(df).tolist() == [False, True, True, True, False]
+    assert old_sex_handling(df)['Sex'].tolist() == ['F', 'F', 'M']
+
+
+def clean_names():
+    df = pd.DataFrame({'Year': [2000, 2000, 2001, 2001],
+                       'Name': ['ANNA', "O'BRIEN", 'ANNA', 'JEAN-LUC'],
+                       'Sex': ['F', 'M', 'F', 'M'],
+                       'Count': [5, 7, 0, 2]})
+    return df.astype(NamesData.schema)
+
+
+@pytest.mark.parametrize('mode', ['full', 'sample', 'skip-if-unchanged'])
+@pytest.mark.parametrize('change, message', [
+    (lambda df: df.assign(Name=df['Name'].astype(object).where(df.index != 1)), 'missing values'),
+    (lambda df: df.assign(Sex=df['Sex'].astype(object).where(df.index != 1, '')), 'missing values'),
+    (lambda df: df.assign(Year=df['Year'].astype(float)), 'Year column is not of type int'),
+    (lambda df: df.assign(Name=df['Name'].astype(object).where(df.index != 2, 'Anna')), 'uppercased letters'),
+    (lambda df: df.assign(Sex=df['Sex'].astype(object).where(df.index != 2, 'X')), 'different from M/F'),
+    (lambda df: df.assign(Year=df['Year'].where(df.index != 0, 1700)), 'lower than 1750'),
+    (lambda df: df.assign(Year=df['Year'].where(df.index != 0, 2024)), 'bigger than 2024'),
+    (lambda df: df.assign(Count=df['Count'].astype('int64').where(df.index != 0, -1)), 'count is negative'),
+    (lambda df: pd.concat([df, df.iloc[[1]].assign(Count=1)], ignore_index=True), 'has 1 duplicates'),
+])
+def test_check_clean_data_finds_the_errors(mode, change, message):
+    # the structure and the values are checked in every mode (the sample is the whole data when it is small)
+    names = names_data(clean_names())
+    names.check_clean_data(mode)
+
+    names.clean_df = change(names.clean_df)
+    with pytest.raises(AssertionError, match=message):
+        names.check_clean_data(mode)
+
+
+def test_check_clean_data_skips_the_unchanged_data(monkeypatch):
+    names = names_data(clean_names())
+    names.check_clean_data('skip-if-unchanged')
+
+    # the data is not looked at again while it has the fingerprint of the last successful check
+    monkeypatch.setattr('src.data.names_data.distinct_values', lambda column: pytest.fail('checked again'))
+    names.check_clean_data()
+    names.clean_df = names.clean_df.copy()
+    names.check_clean_data()
+
+    # but the same data is checked fully in the full mode, and any change is checked
+    with pytest.raises(pytest.fail.Exception):
+        names.check_clean_data('full')
+    names.clean_df.loc[0, 'Count'] = 6
+    with pytest.raises(pytest.fail.Exception):
+        names.check_clean_data()
+
+
+def test_check_clean_data_sample(monkeypatch):
+    names = names_data(pd.concat([clean_names()] * 50, ignore_index=True)
+                       .assign(Year=lambda df: 1800 + df.index, Count=lambda df: df['Count'].astype('int64')))
+    monkeypatch.setattr(NamesData, 'check_sample_size', 20)
+
+    # only the rows of the sample are checked (fixed seed), the full mode checks every row
+    unchecked = names.clean_df.index.difference(names.clean_df.sample(n=20, random_state=0).index)[0]
+    names.clean_df.loc[unchecked, 'Count'] = -1
+    names.check_clean_data('sample')
+    with pytest.raises(AssertionError, match='count is negative'):
+        names.check_clean_data('full')
+
+    with pytest.raises(ValueError):
+        names.check_clean_data('everything')
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from src.data.names_data import NamesData
+from src.data.names_index import NameSeriesIndex, get_names_index
+
+NAMES = pd.DataFrame({'Year': [2000, 2000, 2002, 2001, 2003],
+                      'Name': ['ANNA', 'ANNA', 'ANNA', 'LEO', 'LEO'],
+                      'Sex': ['F', 'M', 'F', 'M', 'M'],
+                      'Count': [5, 1, 7, 3, 0]})
+
+
+def test_from_frame_sums_the_sexes_and_fills_the_missing_years():
+    index = NameSeriesIndex.from_frame(NAMES)
+
+    assert index.first_year == 2000 and index.last_year == 2003 and len(index) == 2
+    np.testing.assert_array_equal(index.series('ANNA'), [6, 0, 7, 0])
+    np.testing.assert_array_equal(index.series('LEO'), [0, 3, 0, 0])
+    assert index.series('ZOE') is None and 'ZOE' not in index
+
+    # the filled zeros are not observed years, the rows with a 0 count are
+    assert index.first_observed_year('LEO') == 2001
+    assert index.n_observed('LEO', 2000, 2003) == 2
+    assert index.observed_mean('ANNA', 2000, 2003) == 6.5
+    assert np.isnan(index.observed_mean('ANNA', 2003, 2010))
+
+
+def test_window_outside_of_the_index_is_filled_with_zeros():
+    index = NameSeriesIndex.from_frame(NAMES)
+
+    np.testing.assert_array_equal(index.window('ANNA', 1998, 2001), [0, 0, 6, 0])
+    np.testing.assert_array_equal(index.window('ANNA', 2002, 2005), [7, 0, 0, 0])
+    np.testing.assert_array_equal(index.window('ZOE', 2000, 2001), [0, 0])
+
+
+def test_window_sums_are_the_sums_of_the_windows():
+    index = NameSeriesIndex.from_frame(NAMES)
+    names = ['ANNA', 'LEO', 'ZOE', 'ANNA', 'LEO']
+    starts, stops = np.array([1999, 2000, 2000, 2001, 2003]), np.array([2001, 2003, 2003, 2010, 2002])
+
+    sums, n_observed = index.window_sums(index.rows_of(names), starts, stops)
+    expected_sums = [index.window(name, start, stop).sum() for name, start, stop in zip(names, starts, stops)]
+    expected_observed = [index.n_observed(name, start, stop) for name, start, stop in zip(names, starts, stops)]
+    np.testing.assert_array_equal(sums, expected_sums)
+    np.testing.assert_array_equal(n_observed, expected_observed)
+
+
+def test_save_and_load_the_memory_mapped_index(tmp_path):
+    index = NameSeriesIndex.from_frame(NAMES)
+    index.save(str(tmp_path))
+
+    loaded = NameSeriesIndex.load(str(tmp_path))
+    assert isinstance(loaded.counts, np.memmap)
+    assert loaded.fingerprint() == index.fingerprint()
+    np.testing.assert_array_equal(loaded.series('ANNA'), index.series('ANNA'))
+
+
+def test_get_names_index():
+    names = NamesData('Test', 'test.csv', loaded=False)
+    names.clean_df = NAMES
+
+    index = get_names_index(names)
+    assert get_names_index(index) is index
+    # only one name indexed
+    single = get_names_index(names, 'LEO')
+    assert len(single) == 1 and single.first_year == 2001
+    np.testing.assert_array_equal(single.series('LEO'), index.window('LEO', 2001, 2003))
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.names_data import NamesData
+
+# spacy is needed by the module (named entities of the plot summaries)
+names_utils = pytest.importorskip('src.utils.names_utils')
+
+
+def country(name, seed):
+    # random counts of a few names, with both sexes for some (Year, Name)
+    rng = np.random.default_rng(seed)
+    rows = pd.DataFrame([(year, name_, sex) for year in range(1990, 2000) for name_ in ['ALEX', 'ANNA', 'LEO', "O'NEIL"]
+                         for sex in 'FM'], columns=['Year', 'Name', 'Sex'])
+    rows = rows.sample(frac=0.6, random_state=seed).sort_values(['Year', 'Name', 'Sex'], ignore_index=True)
+    data = NamesData(name, f'{name}.csv', loaded=False)
+    data.clean_df = rows.assign(Count=rng.integers(1, 100, len(rows)))
+    data.apply_schema()
+    return data
+
+
+def global_and_totals(countries):
+    totals = names_utils.merge_names_data(countries)
+    global_names = names_utils.merge_names_data(countries)
+    global_names.sex_handling()
+    return global_names, totals
+
+
+def test_merge_names_data_sums_the_counts():
+    countries = [country('A', 0), country('B', 1)]
+    merged = names_utils.merge_names_data(countries)
+
+    expected = (pd.concat([data.clean_df.astype({'Name': object, 'Sex': object}) for data in countries])
+                .groupby(['Year', 'Name', 'Sex'], as_index=False)['Count'].sum())
+    pd.testing.assert_frame_equal(merged.clean_df.astype({'Name': object, 'Sex': object, 'Year': 'int64', 'Count': 'int64'}),
+                                  expected.astype({'Year': 'int64', 'Count': 'int64'}))
+
+
+def test_add_names_data_is_the_merge_of_all_the_countries():
+    a, b, c = country('A', 0), country('B', 1), country('C', 2)
+    global_names, totals = global_and_totals([a, b])
+    expected_global, expected_totals = global_and_totals([a, b, c])
+
+    global_names, totals = names_utils.add_names_data(global_names, totals, c)
+
+    for result, expected in [(global_names, expected_global), (totals, expected_totals)]:
+        pd.testing.assert_frame_equal(result.clean_df.astype({'Name': object, 'Sex': object}),
+                                      expected.clean_df.astype({'Name': object, 'Sex': object}))
+    assert global_names.name.endswith('& C')
+
+
+@pytest.fixture
+def ner_model(monkeypatch):
+    # small pipeline finding the PERSON entities with patterns, instead of the trained model (not installed with spacy)
+    spacy_en = pytest.importorskip('spacy.lang.en')
+    loaded = []
+
+    def load(model):
+        loaded.append(model)
+        nlp = spacy_en.English()
+        nlp.add_pipe('entity_ruler').add_patterns([{'label': 'PERSON', 'pattern': name}
+                                                   for name in ['Luke Skywalker', 'Luke', 'Han Solo', 'Han', 'Leia']])
+        return nlp
+
+    monkeypatch.setattr(names_utils.spacy, 'load', load)
+    names_utils.load_ner_model.cache_clear()
+    yield loaded
+    names_utils.load_ner_model.cache_clear()
+
+
+def test_ner_model_is_loaded_once(ner_model):
+    assert names_utils.load_ner_model() is names_utils.load_ner_model()
+    names_utils.extract_names('Luke meets Han.')
+    list(names_utils.extract_names_batch(['Leia.', 'Han.']))
+    assert ner_model == [names_utils.SPACY_MODEL]
+
+
+def test_extract_names_batch_is_extract_names_on_each_text(ner_model):
+    texts = ['Luke Skywalker meets Han Solo. Luke and Han leave with Leia.', 'Nobody is here.', 'Leia, Leia and Han.',
+             'Han Solo and Luke.'] * 3
+
+    batches = list(names_utils.extract_names_batch(texts, batch_size=2))
+    assert batches == [names_utils.extract_names(text) for text in texts]
+    # the short names are counted with the full names
+    assert batches[0] == [('Luke Skywalker', 2), ('Han Solo', 2), ('Leia', 1)]
+    assert batches[1] == []
+
+
+def test_build_movie_index_gives_the_lookups_of_get_film_name_and_date():
+    movies_chars_joined = pd.DataFrame({
+        'Wikipedia_movie_ID': [975900, 975900, 3196793, 28463795, 1234, 5678],
+        'Movie_name': ['Ghosts of Mars', 'Ghosts of Mars (2)', 'Getting Away with Murder', 'Brun bitter', 'No date', 'Bad date'],
+        'Release_date': ['2001-08-24', '1999-01-01', '2000-02-16', '1988', None, '2010-13-45'],
+    })
+    index = names_utils.build_movie_index(movies_chars_joined)
+
+    for wiki_id in [975900, 3196793, 28463795, 1234, 5678, 42]:
+        try:
+            film_name, date = names_utils.get_film_name_and_date(wiki_id, movies_chars_joined)
+        except ValueError:
+            # the date can not be parsed: the plot summary was skipped
+            assert wiki_id not in index
+            continue
+        if film_name is None:
+            assert wiki_id not in index
+        elif pd.isna(date):
+            assert index[wiki_id][0] == film_name and np.isnan(index[wiki_id][1])
+        else:
+            assert index[wiki_id] == (film_name, date.year)
+
+    assert sorted(index) == [1234, 975900, 3196793, 28463795]
+    assert index[975900] == ('Ghosts of Mars', 2001)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.names_index import NameSeriesIndex
+
+# the models need pmdarima, prophet, causalimpact, ...
+naming_prediction = pytest.importorskip('src.models.naming_prediction')
+
+
+def names_index():
+    years = np.arange(1950, 2011)
+    return NameSeriesIndex.from_frame(pd.DataFrame({'Year': years, 'Name': 'ANNA', 'Count': 100 + years % 7}))
+
+
+def test_prophet_timeout_stops_the_stan_process():
+    psutil = pytest.importorskip('psutil')
+
+    with pytest.raises(TimeoutError):
+        naming_prediction.predict_naming_prophet(names_index(), 'ANNA', 2000, 10, timeout=1e-6)
+    # the Stan process was stopped, no orphan process is left
+    assert psutil.Process().children(recursive=True) == []
+
+
+def test_prophet_without_timeout():
+    forecast = naming_prediction.predict_naming_prophet(names_index(), 'ANNA', 2000, 10)
+    assert forecast['Year'].tolist() == list(range(2001, 2011))
+
+
+def test_batch_difference_in_means_is_the_difference_in_means_of_each_name():
+    # names appearing, disappearing, with holes, and a name that is not in the data
+    rng = np.random.default_rng(0)
+    rows = []
+    for name in ['ANNA', 'LEO', 'ZOE', 'MIA', 'NOAH']:
+        years = np.sort(rng.choice(np.arange(1960, 2011), size=rng.integers(1, 40), replace=False))
+        rows.append(pd.DataFrame({'Year': years, 'Name': name, 'Count': rng.integers(0, 50, len(years))}))
+    index = NameSeriesIndex.from_frame(pd.concat(rows, ignore_index=True))
+
+    names = ['ANNA', 'LEO', 'ZOE', 'MIA', 'NOAH', 'LUCAS'] * 6
+    years = np.repeat([1965, 1975, 1985, 1995, 2005, 2010], 6)
+    progress = np.array([0, len(names)])
+    expected = [naming_prediction.difference_in_means(index, name, year, 5, progress) for name, year in zip(names, years)]
+
+    np.testing.assert_array_equal(naming_prediction.batch_difference_in_means(index, names, years, 5), expected)
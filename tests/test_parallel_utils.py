@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from src.data.names_index import NameSeriesIndex
+from src.utils.parallel_utils import map_names
+
+
+def window_sum(name, names_index, year):
+    # top level function: it is sent to the worker processes
+    return int(names_index.window(name, year - 2, year).sum())
+
+
+def test_map_names_in_parallel_is_the_serial_result_in_order():
+    years = np.arange(1990, 2011)
+    index = NameSeriesIndex.from_frame(pd.DataFrame({'Year': np.tile(years, 2), 'Name': ['ANNA'] * 21 + ['LEO'] * 21,
+                                                     'Count': np.arange(42)}))
+    names, query_years = ['ANNA', 'LEO', 'ZOE'] * 10, list(range(1995, 2025))
+
+    serial = map_names(window_sum, index, names, query_years, n_workers=1)
+    received = []
+    parallel = map_names(window_sum, index, names, query_years, n_workers=2, chunksize=4,
+                         on_result=lambda name, year, result: received.append((name, year, result)))
+
+    assert parallel == serial
+    assert serial == [window_sum(name, index, year) for name, year in zip(names, query_years)]
+    # on_result is called in the order of the names
+    assert received == list(zip(names, query_years, serial))
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# the pipeline imports the models (spacy, statsmodels, prophet, ...)
+pipelines = pytest.importorskip('src.utils.pipelines')
+
+
+def test_run_stage_reuses_the_output_while_the_inputs_do_not_change(tmp_path):
+    output_path = str(tmp_path / 'stage.parquet')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pd.DataFrame({'a': [len(calls)]})
+
+    first, fingerprint = pipelines.run_stage(output_path, compute, {'input': 'x'}, [pipelines])
+    second, same_fingerprint = pipelines.run_stage(output_path, compute, {'input': 'x'}, [pipelines])
+    assert len(calls) == 1 and same_fingerprint == fingerprint
+    pd.testing.assert_frame_equal(second, first)
+
+    # another input, or no cache -> computed again, and the manifest follows the last output
+    _, other_fingerprint = pipelines.run_stage(output_path, compute, {'input': 'y'}, [pipelines])
+    assert len(calls) == 2 and other_fingerprint != fingerprint
+    pipelines.run_stage(output_path, compute, {'input': 'y'}, [pipelines], use_cache=False)
+    assert len(calls) == 3
+    pipelines.run_stage(output_path, compute, {'input': 'x'}, [pipelines])
+    assert len(calls) == 4
+
+
+def test_outputs_of_the_debug_sample_are_not_reused_for_the_whole_data(tmp_path):
+    output_path = str(tmp_path / 'stage.parquet')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pd.DataFrame({'a': [len(calls)]})
+
+    # debug run: computed from the sample, with the fingerprint of the sample
+    pipelines.run_stage(output_path, compute, {'movies': pipelines.debug_fingerprint('full')}, [pipelines], use_cache=False)
+    # next normal run on the whole data
+    output, _ = pipelines.run_stage(output_path, compute, {'movies': 'full'}, [pipelines])
+    assert len(calls) == 2 and output['a'].tolist() == [2]
+
+
+def raise_error(error):
+    def predict_naming_prophet(*args, **kwargs):
+        raise error
+    return predict_naming_prophet
+
+
+@pytest.mark.parametrize('error', [TimeoutError('fit took more than 1 s'), RuntimeError('Error during optimization'), ValueError('not in the data')])
+def test_failed_prophet_fit_returns_the_policy_value(monkeypatch, error):
+    monkeypatch.setattr(pipelines.naming_prediction, 'predict_naming_prophet', raise_error(error))
+
+    # a failed fit is unknown by default, not "not influenced"
+    assert np.isnan(pipelines.is_name_influenced_prophet('ANNA', None, 2000, timeout=1))
+    assert pipelines.is_name_influenced_prophet('ANNA', None, 2000, timeout=1, on_error='zero') == 0
+    with pytest.raises(type(error)):
+        pipelines.is_name_influenced_prophet('ANNA', None, 2000, timeout=1, on_error='raise')
+
+
+def test_other_errors_of_prophet_are_raised(monkeypatch):
+    monkeypatch.setattr(pipelines.naming_prediction, 'predict_naming_prophet', raise_error(KeyError('yhat_lower')))
+    with pytest.raises(KeyError):
+        pipelines.is_name_influenced_prophet('ANNA', None, 2000, on_error='zero')
+
+
+def test_failed_prophet_fits_are_computed_again_on_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipelines, 'CHECKPOINT_PATH_PROPHET', str(tmp_path / 'checkpoint.csv'))
+    monkeypatch.setattr(pipelines.interval_test, 'outside_interval', lambda *args: True)
+    fitted = []
+
+    def predict_naming_prophet(names_data, name, year, nb_years, plot=False, timeout=None):
+        fitted.append(name)
+        if name == 'LEO' and fitted.count('LEO') == 1:
+            raise TimeoutError('fit took more than 1 s')
+        return {'Predicted Count': None, 'yhat_lower': None, 'yhat_upper': None, 'True Count': None}
+
+    monkeypatch.setattr(pipelines.naming_prediction, 'predict_naming_prophet', predict_naming_prophet)
+    index = pipelines.get_names_index(pd.DataFrame({'Year': [2000, 2000], 'Name': ['ANNA', 'LEO'], 'Count': [1, 2]}))
+    mean_df = pd.DataFrame({'Normalized_name': ['ANNA', 'LEO'], 'Year': [2000, 2001], 'Influence': [1.0, 2.0]})
+    output_path = str(tmp_path / 'prophet.csv')
+
+    first = pipelines.compute_all_influence_prophet(mean_df, index, output_path, n_workers=1, timeout=1, on_error='zero')
+    assert first['Influenced'].tolist() == [1, 0]
+
+    # the timed out fit is not in the checkpoint: only LEO is fitted again
+    second = pipelines.compute_all_influence_prophet(mean_df, index, output_path, n_workers=1, timeout=1)
+    assert fitted == ['ANNA', 'LEO', 'LEO']
+    assert second['Influenced'].tolist() == [1, 1]
+
+
+NAMES_RAW = {
+    'ukbabynames.csv': ['nation,sex,year,name,n,rank', 'England,F,1990,Anna,10,1', 'England,F,1990,anna,2,9', 'England,M,1991,Leo,7,1',
+                        'England,M,1950,Leo,3,1', 'England,F,1991,Zoé,4,2'],
+    'france.csv': ['sexe;preusuel;annais;dpt;nombre', '2;ANNA;1990;75;4', '2;ANNA;1990;13;3', '1;LÉO;1991;75;5', '1;LEO;1991;13;2',
+                   '2;ZOE;XXXX;XX;8', '1;ANNA;1990;75;9'],
+    'babyNamesUSYOB-full.csv': ['Year,Name,Sex,Count', '1990,Anna,F,10', '1990,Anna,M,4', '1991,Leo,M,7', '1991,Zoe,F,5'],
+    'norway/norway_merged.csv': ['name,year,count,sex', 'Anna,1990,6,F', 'Leo,1991,..,M', 'Leo,1991,3,M', 'Ola,1991,4,M'],
+}
+
+
+def write_names(folder, n_workers):
+    raw = folder / 'data' / 'raw' / 'names'
+    (raw / 'norway').mkdir(parents=True)
+    (folder / 'data' / 'clean' / 'names').mkdir(parents=True)
+    for file, lines in NAMES_RAW.items():
+        (raw / file).write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return pipelines.write_all_names_data(use_cache=False, n_workers=n_workers)
+
+
+def test_names_data_cleaned_in_parallel_is_the_serial_one(tmp_path, monkeypatch):
+    outputs = {}
+    for n_workers in [1, 4]:
+        folder = tmp_path / str(n_workers)
+        folder.mkdir()
+        # the paths of the names data are relative to the root folder
+        monkeypatch.chdir(folder)
+        data = write_names(folder, n_workers)
+        # the clean data in memory and the files written (countries, global data and totals)
+        files = {path.name: pd.read_parquet(path) for path in (folder / 'data' / 'clean' / 'names').glob('*.parquet')}
+        outputs[n_workers] = [names.clean_df.reset_index(drop=True) for names in data], files
+
+    (serial, serial_files), (parallel, parallel_files) = outputs[1], outputs[4]
+    assert len(serial_files) == 6 and sorted(parallel_files) == sorted(serial_files)
+    for name, df in serial_files.items():
+        pd.testing.assert_frame_equal(parallel_files[name], df)
+    for parallel_df, serial_df in zip(parallel, serial):
+        pd.testing.assert_frame_equal(parallel_df, serial_df)
+    # the global totals are the sum of the countries
+    assert serial_files['UK_France_US_Norway_totals.parquet']['Count'].sum() == sum(df['Count'].sum() for df in serial[1:])